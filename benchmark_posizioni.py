@@ -0,0 +1,299 @@
+"""
+Benchmark della pipeline delle posizioni su preventivi sintetici.
+
+Genera preventivi di 100 / 1.000 / 10.000 posizioni pescando serramenti, modelli e
+controtelai dai cataloghi reali (catalogo.py) e misura tre gruppi di operazioni:
+
+- frame: i metodi del PosizioniFrame su una root Tk nascosta (caricamento della tabella,
+  aggiungi_riga, save_edited_row, aggiorna_tutti_gli_sconti_treeview fino all'applicazione
+  del risultato), quindi con giornale, TabellaVirtuale, tag, rinumerazione e calcoli in
+  background. Richiedono un display (anche Xvfb); senza display il gruppo è null;
+- motore: il solo motore prezzi su tutte le righe (calcolo completo, sconti, cambio del
+  controtelaio) e la formattazione delle righe;
+- file: salvataggio e apertura del file (JSON e .prevz).
+
+I risultati sono scritti in JSON, per confrontarli tra una versione e l'altra:
+
+    python benchmark_posizioni.py --dimensioni 100 1000 --output risultati.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from calcoli_posizioni import ricalcola_valori, sconti_valori
+from catalogo import indice_controtelaio, indice_elementi, indice_listino
+from motore_prezzi import CODICI_COLORE
+from posizione import Posizione
+import preventivo_colonnare
+from salvataggio_preventivo import scrivi_atomico, serializza
+from schema_posizioni import COLONNE_INPUT, INDICI
+
+DIMENSIONI = (100, 1000, 10000)
+RIPETIZIONI = 3
+SEME = 1234
+
+# Sconti del preventivo usati per tutte le misure
+SCONTI = {"Sconto 1": "35", "Sconto 2": "10", "Sconto 3": "", "Sconto in decimali": "0,415",
+          "Dicitura sconto": "35+10"}
+SCONTI_MODIFICATI = dict(SCONTI, **{"Sconto 2": "5", "Sconto in decimali": "0,3825", "Dicitura sconto": "35+5"})
+
+
+def genera_preventivo(numero_posizioni, seme=SEME):
+    """Dict di un preventivo sintetico con `numero_posizioni` posizioni già calcolate dal motore prezzi."""
+    caso = random.Random(seme)
+    serramenti = sorted(indice_elementi.chiavi(), key=str)
+    modelli = sorted(indice_listino.chiavi(), key=str)
+    controtelai = sorted(indice_controtelaio.chiavi(), key=str) + [""]
+    if not serramenti or not modelli:
+        raise RuntimeError("Cataloghi elementi e listino vuoti: impossibile generare posizioni")
+    righe = []
+    for pos in range(1, numero_posizioni + 1):
+        distanziale = caso.random() < 0.3
+        righe.append({
+            "Pos.": pos,
+            "nr. pezzi": caso.randint(1, 6),
+            "Serramento": caso.choice(serramenti),
+            "Modello": caso.choice(modelli),
+            "Modello grata combinato": "DA DEFINIRE",
+            "Colore": caso.choice(list(CODICI_COLORE)),
+            "L (mm)": caso.randrange(400, 2400, 10),
+            "H (mm)": caso.randrange(600, 2600, 10),
+            "Tipo telaio": "",
+            "BUNK": "NO",
+            "Dmcp / Scp": "",
+            "Defender": "NO",
+            "Dist.": "SI" if distanziale else "NO",
+            "Tipo dist.": caso.choice(["SALDATO", "IMBOTTE"]) if distanziale else "",
+            "L (mm) dist.": caso.randrange(400, 2400, 10) if distanziale else "",
+            "H (mm) dist.": caso.randrange(600, 2600, 10) if distanziale else "",
+            "Tipologia controtelaio": caso.choice(controtelai),
+            "Anta a giro posizione": "ANTA A GIRO",
+            "M.rib.": "NO",
+        })
+    valori = ricalcola_valori([Posizione.da_dict(riga).valori() for riga in righe], SCONTI)
+    return {
+        "dati_b1": dict(SCONTI, numero_protocollo="BENCH", nome_cliente="Benchmark"),
+        "dati_b2": {"numero_protocollo": "BENCH", "nome_cliente": "Benchmark", "rif_cliente": str(numero_posizioni)},
+        "posizioni": [Posizione(v) for v in valori],
+    }
+
+
+def misura(funzione, ripetizioni, preparazione=None):
+    """
+    Esegue `funzione` più volte: tempi in secondi (minimo e mediana).
+    `preparazione`, se indicata, viene eseguita prima di ogni ripetizione fuori dalla misura.
+    """
+    tempi = []
+    for _ in range(ripetizioni):
+        if preparazione is not None:
+            preparazione()
+        inizio = time.perf_counter()
+        funzione()
+        tempi.append(time.perf_counter() - inizio)
+    return {"minimo": round(min(tempi), 6), "mediana": round(statistics.median(tempi), 6), "ripetizioni": ripetizioni}
+
+
+def _cambia_controtelaio(posizioni):
+    """Stesso controtelaio assegnato a tutte le righe, poi ricalcolo completo con il motore prezzi."""
+    controtelai = sorted(indice_controtelaio.chiavi(), key=str)
+    controtelaio = controtelai[0] if controtelai else ""
+    valori = []
+    for posizione in posizioni:
+        nuova = posizione.copia()
+        nuova["Tipologia controtelaio"] = controtelaio
+        valori.append(nuova.valori())
+    ricalcola_valori(valori, SCONTI)
+
+
+def _salva(percorso, dati):
+    scrivi_atomico(percorso, serializza(percorso, dati))
+
+
+def _apri(percorso):
+    """Lettura del file e conversione delle posizioni in record, come all'apertura di un preventivo."""
+    if percorso.endswith(preventivo_colonnare.ESTENSIONE):
+        dati = preventivo_colonnare.carica(percorso)
+    else:
+        with open(percorso, "r", encoding="utf-8") as f:
+            dati = json.load(f)
+    return [Posizione.da_dict(p) for p in dati["posizioni"]]
+
+
+def _crea_root():
+    """Root Tk nascosta, oppure None se non c'è un display."""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception:
+        return None
+    root.withdraw()
+    return root
+
+
+def _crea_frame(root, dati, cartella):
+    """PosizioniFrame vuoto sul preventivo sintetico, con il giornale nella cartella temporanea."""
+    from modulo_posizioni import PosizioniFrame
+    classe = type("PosizioniFrameBenchmark", (PosizioniFrame,), {"cartella_giornale": cartella})
+    preventivo = SimpleNamespace(dati_b1=dict(dati["dati_b1"]), dati_b2=dict(dati["dati_b2"]), posizioni=[])
+    frame = classe(root, preventivo=preventivo)
+    frame.pack(fill="both", expand=True)
+    root.update_idletasks()
+    return frame
+
+
+def _carica_frame(frame, posizioni):
+    """Come all'apertura di un preventivo: tabella ricostruita da preventivo.posizioni."""
+    frame.preventivo.posizioni = list(posizioni)
+    frame.aggiorna_da_preventivo()
+    frame.update_idletasks()
+
+
+def _compila_nuova_riga(frame, posizione):
+    """Compila i campi di inserimento come l'utente (la scelta del serramento aggiorna i campi ricavati)."""
+    testi = posizione.formattati()
+    for entry, col in ((frame.nr_pezzi_entry, "nr. pezzi"), (frame.l_mm_entry, "L (mm)"),
+                       (frame.h_mm_entry, "H (mm)")):
+        entry.delete(0, "end")
+        entry.insert(0, testi[INDICI[col]])
+    frame.serramento_combobox.set(testi[INDICI["Serramento"]])
+    frame.aggiorna_campi_aggiuntivi()
+    frame.modello_combobox.set(testi[INDICI["Modello"]])
+    frame.colore_combobox.set(testi[INDICI["Colore"]])
+    frame.tipo_controtelaio_combobox.set(testi[INDICI["Tipologia controtelaio"]])
+
+
+def _prepara_modifica(frame, stato):
+    """
+    Finestra di modifica nascosta sulla riga centrale, con la larghezza aumentata di 10 mm: i campi
+    sono Entry con il testo della riga, come li legge save_edited_row. Gli argomenti vanno in `stato`.
+    """
+    import tkinter as tk
+    item = frame.tabella.righe[len(frame.tabella) // 2]
+    testi = frame.posizioni[item].formattati()
+    dialog = tk.Toplevel(frame)
+    dialog.withdraw()
+    entries = {}
+    for col in COLONNE_INPUT:
+        if col == "Pos.":
+            continue
+        entry = tk.Entry(dialog)
+        entry.insert(0, testi[INDICI[col]])
+        entries[col] = entry
+    entries["L (mm)"].delete(0, "end")
+    entries["L (mm)"].insert(0, str(int(frame.posizioni[item]["L (mm)"] or 0) + 10))
+    stato[:] = [dialog, item, entries]
+
+
+def _alterna_sconti(frame):
+    """Sconti del preventivo alternati a ogni ripetizione, così ogni propagazione cambia davvero le righe."""
+    attuali = frame.preventivo.dati_b1
+    nuovi = SCONTI_MODIFICATI if attuali.get("Sconto 2") == SCONTI["Sconto 2"] else SCONTI
+    frame.preventivo.dati_b1 = dict(attuali, **nuovi)
+
+
+def _propaga_sconti_frame(frame):
+    """aggiorna_tutti_gli_sconti_treeview fino all'applicazione del risultato (anche se calcolato in background)."""
+    frame.aggiorna_tutti_gli_sconti_treeview()
+    while frame.calcoli.in_corso():
+        frame.update()
+        time.sleep(0.001)
+    frame.update_idletasks()
+
+
+def misura_frame(root, dati, ripetizioni, cartella):
+    """Tempi dei metodi del PosizioniFrame sul preventivo `dati`."""
+    frame = _crea_frame(root, dati, cartella)
+    try:
+        posizioni = dati["posizioni"]
+        stato_modifica = []
+        risultati = {
+            "caricamento": misura(lambda: _carica_frame(frame, posizioni), ripetizioni),
+            "save_edited_row": misura(lambda: frame.save_edited_row(*stato_modifica), ripetizioni,
+                                      lambda: _prepara_modifica(frame, stato_modifica)),
+            "aggiorna_tutti_gli_sconti_treeview": misura(lambda: _propaga_sconti_frame(frame), ripetizioni,
+                                                         lambda: _alterna_sconti(frame)),
+            "aggiungi_riga": misura(frame.aggiungi_riga, ripetizioni,
+                                    lambda: _compila_nuova_riga(frame, posizioni[-1])),
+        }
+    finally:
+        frame.destroy()
+    return risultati
+
+
+def esegui_benchmark(dimensioni=DIMENSIONI, ripetizioni=RIPETIZIONI, cartella=None, con_frame=True):
+    """
+    Misura tutte le operazioni per ogni dimensione di preventivo.
+
+    :return: dict pronto per json.dump (ambiente e tempi per dimensione, gruppo e operazione)
+    """
+    root = _crea_root() if con_frame else None
+    risultati = {}
+    with tempfile.TemporaryDirectory(dir=cartella) as temporanea:
+        for numero in dimensioni:
+            inizio = time.perf_counter()
+            dati = genera_preventivo(numero)
+            posizioni = dati["posizioni"]
+            generazione = time.perf_counter() - inizio
+            percorso_json = os.path.join(temporanea, f"bench_{numero}.json")
+            percorso_prevz = os.path.join(temporanea, f"bench_{numero}{preventivo_colonnare.ESTENSIONE}")
+            motore = {
+                "calcolo_completo": misura(lambda: ricalcola_valori([p.valori() for p in posizioni], SCONTI),
+                                           ripetizioni),
+                "sconti": misura(lambda: sconti_valori([p.valori() for p in posizioni], SCONTI_MODIFICATI),
+                                 ripetizioni),
+                "cambio_controtelaio": misura(lambda: _cambia_controtelaio(posizioni), ripetizioni),
+                "formattazione_righe": misura(lambda: [p.formattati() for p in posizioni], ripetizioni),
+            }
+            file = {
+                "salvataggio_json": misura(lambda: _salva(percorso_json, dati), ripetizioni),
+                "apertura_json": misura(lambda: _apri(percorso_json), ripetizioni),
+                "salvataggio_prevz": misura(lambda: _salva(percorso_prevz, dati), ripetizioni),
+                "apertura_prevz": misura(lambda: _apri(percorso_prevz), ripetizioni),
+            }
+            frame = misura_frame(root, dati, ripetizioni, temporanea) if root else None
+            risultati[str(numero)] = {
+                "generazione": round(generazione, 6),
+                "dimensione_json": os.path.getsize(percorso_json),
+                "dimensione_prevz": os.path.getsize(percorso_prevz),
+                "operazioni": {"frame": frame, "motore": motore, "file": file},
+            }
+            print(f"{numero} posizioni: completato", file=sys.stderr)
+    if root:
+        root.destroy()
+    return {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "piattaforma": platform.platform(),
+        "ripetizioni": ripetizioni,
+        "risultati": risultati,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline delle posizioni su preventivi sintetici.")
+    parser.add_argument("--dimensioni", type=int, nargs="+", default=list(DIMENSIONI),
+                        help="numero di posizioni dei preventivi generati (predefinito: 100 1000 10000)")
+    parser.add_argument("--ripetizioni", type=int, default=RIPETIZIONI, help="ripetizioni di ogni misura")
+    parser.add_argument("--output", help="file JSON dei risultati (predefinito: standard output)")
+    parser.add_argument("--senza-frame", action="store_true", help="non misura i metodi del PosizioniFrame")
+    args = parser.parse_args(argv)
+
+    risultati = esegui_benchmark(args.dimensioni, args.ripetizioni, con_frame=not args.senza_frame)
+    testo = json.dumps(risultati, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(testo + "\n")
+    else:
+        print(testo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Calcoli delle posizioni in background.
+
+I ricalcoli di molte righe (Ricalcola tutto, nuovi sconti del preventivo) non girano più
+dentro le callback di Tk: il thread di Tk prende un'istantanea dei valori (liste di valori
+tipizzati, nessun riferimento ai record della tabella) e il motore prezzi la elabora su un
+thread di lavoro, oppure in un processo separato per i preventivi molto grandi, così il
+calcolo non contende il GIL con il ridisegno della finestra. I risultati tornano in una
+coda letta dal thread di Tk con after().
+
+Ogni lavoro ha una chiave: un nuovo lavoro con la stessa chiave sostituisce quello
+precedente, che viene annullato se non è ancora partito e il cui risultato viene comunque
+scartato.
+"""
+import logging
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from motore_prezzi import applica_sconti, calcola_posizioni
+from posizione import Posizione, posizioni_da_risultato
+
+# Ogni quanto (ms) il thread di Tk controlla i lavori conclusi
+INTERVALLO_CONTROLLO_MS = 50
+
+# Fino a questo numero di righe il calcolo resta sincrono: finisce prima di un giro della coda
+RIGHE_SINCRONE = 50
+
+# Oltre questo numero di righe il calcolo va in un processo separato invece che su un thread
+RIGHE_PER_PROCESSO = 3000
+
+log = logging.getLogger("gestionale.calcoli")
+
+
+def ricalcola_valori(valori, sconti=None):
+    """
+    Calcola con il motore prezzi le righe indicate (liste di valori tipizzati nell'ordine di COLONNE).
+    Funzione di modulo, quindi eseguibile anche in un processo separato.
+
+    :return: lista dei valori ricalcolati, una lista per riga
+    """
+    risultato = calcola_posizioni([Posizione(v) for v in valori], sconti=sconti)
+    return [posizione.valori() for posizione in posizioni_da_risultato(risultato)]
+
+
+def sconti_valori(valori, sconti):
+    """
+    Campi sconto e costi scontati delle righe indicate con gli sconti `sconti` (dati_b1).
+
+    :return: (colonne, righe) con una lista di valori per riga, nell'ordine di colonne
+    """
+    risultato = applica_sconti([Posizione(v) for v in valori], sconti)
+    colonne = list(risultato.columns)
+    return colonne, [list(riga) for riga in zip(*(risultato[col].tolist() for col in colonne))]
+
+
+class CalcoliInBackground:
+    """Esegue i lavori di calcolo fuori dal thread di Tk e ne riporta i risultati con after()."""
+
+    def __init__(self, widget, al_cambio_stato=None, righe_per_processo=RIGHE_PER_PROCESSO):
+        """
+        :param widget: widget Tk usato per riportare i risultati sul thread principale (after)
+        :param al_cambio_stato: funzione opzionale (lavori_in_corso) chiamata sul thread di Tk quando
+            il numero di lavori in corso cambia (es. per mostrare un indicatore di avanzamento)
+        """
+        self.widget = widget
+        self.al_cambio_stato = al_cambio_stato
+        self.righe_per_processo = righe_per_processo
+        self._thread = None
+        self._processi = None
+        # chiave -> (numero del lavoro, future, al_termine)
+        self._correnti = {}
+        self._numero = 0
+        self._conclusi = queue.Queue()
+        self._controllo_programmato = None
+
+    def esegui(self, chiave, funzione, args, al_termine, righe=0):
+        """
+        Esegue funzione(*args) in background e chiama al_termine(risultato, errore) sul thread di Tk.
+        Un lavoro ancora in corso con la stessa chiave viene sostituito: il suo risultato non arriverà.
+
+        :param funzione: funzione di modulo (deve poter girare in un altro processo); gli argomenti
+            devono essere un'istantanea che il thread di Tk non modifica più
+        :param righe: numero di righe coinvolte, per scegliere tra thread e processo
+        """
+        self.annulla(chiave, notifica=False)
+        self._numero += 1
+        numero = self._numero
+        future = self._esecutore(righe).submit(funzione, *args)
+        self._correnti[chiave] = (numero, future, al_termine)
+        future.add_done_callback(lambda f: self._conclusi.put((chiave, numero, f)))
+        self._notifica_stato()
+        if self._controllo_programmato is None:
+            self._controllo_programmato = self.widget.after(INTERVALLO_CONTROLLO_MS, self._controlla)
+        return numero
+
+    def in_corso(self, chiave=None):
+        """True se c'è un lavoro in corso (con la chiave indicata, oppure uno qualsiasi)."""
+        return bool(self._correnti) if chiave is None else chiave in self._correnti
+
+    def annulla(self, chiave, notifica=True):
+        """Annulla il lavoro con la chiave indicata: se è già partito, il suo risultato viene scartato."""
+        corrente = self._correnti.pop(chiave, None)
+        if corrente is not None:
+            corrente[1].cancel()
+            if notifica:
+                self._notifica_stato()
+
+    def chiudi(self):
+        """Scarta tutti i lavori e ferma thread e processo (es. quando il frame viene distrutto)."""
+        for chiave in list(self._correnti):
+            self.annulla(chiave, notifica=False)
+        if self._controllo_programmato is not None:
+            try:
+                self.widget.after_cancel(self._controllo_programmato)
+            except Exception:
+                pass
+            self._controllo_programmato = None
+        for esecutore in (self._thread, self._processi):
+            if esecutore is not None:
+                esecutore.shutdown(wait=False, cancel_futures=True)
+        self._thread = self._processi = None
+
+    def _esecutore(self, righe):
+        if righe >= self.righe_per_processo:
+            if self._processi is None:
+                self._processi = ProcessPoolExecutor(max_workers=1)
+            return self._processi
+        if self._thread is None:
+            self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="calcoli_posizioni")
+        return self._thread
+
+    def _notifica_stato(self):
+        if self.al_cambio_stato is not None:
+            try:
+                self.al_cambio_stato(len(self._correnti))
+            except Exception:
+                log.exception("Errore nell'aggiornamento dell'indicatore dei calcoli")
+
+    def _controlla(self):
+        self._controllo_programmato = None
+        conclusi = False
+        while True:
+            try:
+                chiave, numero, future = self._conclusi.get_nowait()
+            except queue.Empty:
+                break
+            corrente = self._correnti.get(chiave)
+            if corrente is None or corrente[0] != numero:
+                # Lavoro sostituito o annullato: il risultato non vale più
+                log.debug("Risultato del lavoro %s n. %d scartato", chiave, numero)
+                continue
+            del self._correnti[chiave]
+            conclusi = True
+            al_termine = corrente[2]
+            try:
+                errore = future.exception()
+                al_termine(None if errore else future.result(), errore)
+            except Exception:
+                log.exception("Errore nell'applicazione del risultato del lavoro %s", chiave)
+        if conclusi:
+            self._notifica_stato()
+        if self._correnti:
+            self._controllo_programmato = self.widget.after(INTERVALLO_CONTROLLO_MS, self._controlla)
@@ -0,0 +1,192 @@
+"""
+Cataloghi di riferimento condivisi (listino, elementi, controtelaio, modello grata
+combinato, valori del telaio e gli altri dataframe di data/dataframe.py).
+
+I cataloghi vengono caricati una sola volta per processo e passati come stessi oggetti
+a tutti i moduli. Dopo il primo caricamento sono salvati in una cache binaria (pickle)
+in data/, valida finché non cambiano mtime e dimensione dei file sorgente (cartella
+data: .xlsx, dataframe.py, elementi.py): all'avvio e a ogni "Nuovo preventivo" non si
+rilegge più il workbook.
+
+Gli indici (MODELLO, TIPOLOGIA COMPLETA DI APERTURA, CONTROTELAIO) associano a ogni
+chiave la riga del catalogo già estratta come dict, così ogni ricerca costa O(1).
+"""
+import logging
+import os
+import pickle
+import tempfile
+
+from indice_catalogo import IndiceCatalogo
+from prestazioni import misura
+
+CARTELLA_DATI = "data"
+PERCORSO_WORKBOOK = os.path.join(CARTELLA_DATI, "database_gestionale.xlsx")
+PERCORSO_CACHE = os.path.join(CARTELLA_DATI, "cache_cataloghi.pickle")
+
+# Da aumentare quando cambia il contenuto della cache
+VERSIONE_CACHE = 1
+
+# Dataframe letti da data/dataframe.py
+NOMI_DATAFRAME = [
+    "colore_infissi",
+    "scavalco_cerniere",
+    "telaio_prolungato",
+    "modello_grata_combinato",
+    "scontistica",
+    "listino",
+    "controtelaio",
+]
+
+# Foglio e righe (colonna A) con i valori del campo "Tipo telaio"
+FOGLIO_TELAIO = "telaio"
+RIGHE_TELAIO = (2, 130)
+
+log = logging.getLogger("gestionale.catalogo")
+
+_cataloghi = None
+
+# percorso del workbook -> ((mtime_ns, dimensione), valori del telaio)
+_memo_telaio = {}
+
+
+def _file_sorgente():
+    """File da cui dipendono i cataloghi: cambiando uno di questi la cache non è più valida."""
+    sorgenti = [os.path.join(CARTELLA_DATI, nome) for nome in ("dataframe.py", "elementi.py")]
+    if os.path.isdir(CARTELLA_DATI):
+        sorgenti += sorted(
+            voce.path for voce in os.scandir(CARTELLA_DATI)
+            if voce.is_file() and voce.name.lower().endswith(".xlsx") and not voce.name.startswith("~$")
+        )
+    return sorgenti
+
+
+def chiave_sorgenti():
+    """(percorso, mtime_ns, dimensione) di ogni file sorgente esistente."""
+    chiave = []
+    for percorso in _file_sorgente():
+        try:
+            stat = os.stat(percorso)
+        except OSError:
+            continue
+        chiave.append((percorso, stat.st_mtime_ns, stat.st_size))
+    return (VERSIONE_CACHE, tuple(chiave))
+
+
+def leggi_valori_telaio(percorso=PERCORSO_WORKBOOK):
+    """
+    Valori della colonna A del foglio telaio (righe RIGHE_TELAIO) del workbook.
+    Il workbook è aperto in sola lettura e in streaming: si legge solo quel foglio e quell'intervallo,
+    senza caricare gli altri fogli né gli stili.
+    """
+    try:
+        import openpyxl
+        wb = openpyxl.load_workbook(percorso, read_only=True, data_only=True)
+        try:
+            sheet = wb[FOGLIO_TELAIO]
+            righe = sheet.iter_rows(min_row=RIGHE_TELAIO[0], max_row=RIGHE_TELAIO[1],
+                                    min_col=1, max_col=1, values_only=True)
+            return [cell_value for (cell_value,) in righe if cell_value]
+        finally:
+            wb.close()
+    except Exception as e:
+        log.error("Errore nel caricamento dei valori del telaio: %s", e)
+        return []
+
+
+def _firma_file(percorso):
+    try:
+        stat = os.stat(percorso)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def valori_telaio(percorso=PERCORSO_WORKBOOK):
+    """
+    Valori del campo "Tipo telaio", memorizzati per tutta la vita del processo: il workbook viene
+    riletto solo se mtime o dimensione del file sono cambiati dall'ultima lettura.
+    """
+    firma = _firma_file(percorso)
+    memorizzato = _memo_telaio.get(percorso)
+    if memorizzato is None or memorizzato[0] != firma:
+        memorizzato = (firma, leggi_valori_telaio(percorso))
+        _memo_telaio[percorso] = memorizzato
+    return memorizzato[1]
+
+
+def _leggi_sorgenti():
+    """Carica i cataloghi dai sorgenti in data/ (lento: legge i workbook Excel)."""
+    import pandas as pd
+    from data import dataframe
+    from data.elementi import elementi
+    cataloghi = {nome: getattr(dataframe, nome, None) for nome in NOMI_DATAFRAME}
+    for nome, valore in cataloghi.items():
+        if valore is None:
+            log.warning("Catalogo '%s' non trovato in data/dataframe.py", nome)
+            cataloghi[nome] = pd.DataFrame()
+    cataloghi["elementi"] = elementi
+    cataloghi["telaio"] = valori_telaio()
+    return cataloghi
+
+
+def _leggi_cache(chiave):
+    """Cataloghi dalla cache se la chiave coincide; qualsiasi errore di lettura vale come cache assente."""
+    try:
+        with open(PERCORSO_CACHE, "rb") as f:
+            contenuto = pickle.load(f)
+        if contenuto.get("chiave") != chiave:
+            return None
+        return contenuto["cataloghi"]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # File troncato, scritto da un'altra versione di pandas o non più un dict: si rilegge dai sorgenti
+        log.warning("Cache dei cataloghi non leggibile: %s", e)
+        return None
+
+
+def _scrivi_cache(chiave, cataloghi):
+    temporaneo = None
+    try:
+        # Nome temporaneo univoco: più processi (es. riprezza_preventivi) possono scrivere la cache insieme
+        descrittore, temporaneo = tempfile.mkstemp(dir=os.path.dirname(PERCORSO_CACHE) or ".",
+                                                   prefix="cache_cataloghi.", suffix=".tmp")
+        with os.fdopen(descrittore, "wb") as f:
+            pickle.dump({"chiave": chiave, "cataloghi": cataloghi}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaneo, PERCORSO_CACHE)
+    except Exception as e:
+        log.warning("Impossibile scrivere la cache dei cataloghi: %s", e)
+        if temporaneo is not None:
+            try:
+                os.remove(temporaneo)
+            except OSError:
+                pass
+
+
+def carica_cataloghi():
+    """
+    Dict nome -> catalogo (DataFrame; "telaio" è una lista di valori), caricato una volta per processo
+    dalla cache binaria se ancora valida, altrimenti dai sorgenti (e la cache viene riscritta).
+    """
+    global _cataloghi
+    if _cataloghi is None:
+        with misura("catalogo.caricamento"):
+            chiave = chiave_sorgenti()
+            cataloghi = _leggi_cache(chiave)
+            if cataloghi is None:
+                cataloghi = _leggi_sorgenti()
+                _scrivi_cache(chiave, cataloghi)
+            else:
+                # I valori del telaio in cache valgono per il workbook con la firma registrata nella chiave
+                for percorso, mtime_ns, dimensione in chiave[1]:
+                    if percorso == PERCORSO_WORKBOOK:
+                        _memo_telaio[percorso] = ((mtime_ns, dimensione), cataloghi["telaio"])
+        _cataloghi = cataloghi
+    return _cataloghi
+
+
+cataloghi = carica_cataloghi()
+
+indice_listino = IndiceCatalogo(cataloghi["listino"], "MODELLO")
+indice_elementi = IndiceCatalogo(cataloghi["elementi"], "TIPOLOGIA COMPLETA DI APERTURA")
+indice_controtelaio = IndiceCatalogo(cataloghi["controtelaio"], "CONTROTELAIO")
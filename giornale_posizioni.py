@@ -0,0 +1,198 @@
+"""
+Giornale (write-ahead log) delle operazioni sulle posizioni.
+
+Ogni operazione sulla tabella posizioni (inserimento, modifica, eliminazione) viene
+aggiunta in coda a un file JSON-lines, una riga per operazione. Dopo un'uscita
+anomala il giornale si rilegge in O(record) con json, senza generare né importare
+codice Python. Ogni scrittura viene passata subito al sistema operativo (flush),
+mentre la sincronizzazione su disco (fsync) è raggruppata; periodicamente il
+giornale viene compattato in un'unica istantanea dello stato corrente.
+
+Ogni preventivo ha il proprio giornale (risorse/giornali/<impronta della chiave>.jsonl),
+che si apre con una riga di intestazione con la chiave del preventivo (percorso del
+file o numero di protocollo): in rilettura un giornale con una chiave diversa viene
+ignorato, così le posizioni di un preventivo non finiscono mai in un altro.
+
+Formato delle righe:
+    {"op": "preventivo", "chiave": "file:C:/.../N.12 Rossi.json"}   (sempre la prima riga)
+    {"op": "inserisci", "id": "R3", "indice": 2, "valori": [...]}   (indice null = in coda)
+    {"op": "modifica", "id": "R3", "valori": [...]}
+    {"op": "elimina", "id": "R3"}
+    {"op": "istantanea", "righe": [["R1", [...]], ["R2", [...]]]}
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+# Cartella dei giornali, uno per preventivo
+CARTELLA_GIORNALI = os.path.join("risorse", "giornali")
+
+# fsync dopo questo numero di scritture o dopo questo intervallo (secondi) dall'ultimo fsync
+SCRITTURE_PER_FSYNC = 32
+INTERVALLO_FSYNC = 2.0
+
+# Oltre questo numero di operazioni dall'ultima istantanea conviene compattare
+OPERAZIONI_PER_COMPATTAZIONE = 500
+
+log = logging.getLogger("gestionale.giornale")
+
+
+def percorso_giornale(chiave, cartella=CARTELLA_GIORNALI):
+    """File del giornale del preventivo con la chiave indicata."""
+    impronta = hashlib.sha1(chiave.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cartella, f"{impronta}.jsonl")
+
+
+class GiornalePosizioni:
+    """Giornale append-only delle operazioni sulle posizioni di un preventivo."""
+
+    def __init__(self, chiave, cartella=CARTELLA_GIORNALI):
+        """
+        :param chiave: identifica il preventivo (es. "file:<percorso>" o "protocollo:<numero>")
+        """
+        self.chiave = chiave
+        self.percorso = percorso_giornale(chiave, cartella)
+        self._file = None
+        self._da_sincronizzare = 0
+        self._ultimo_fsync = time.monotonic()
+        self.operazioni = 0
+
+    # --- Scrittura ---
+
+    def _apri(self):
+        if self._file is None:
+            cartella = os.path.dirname(self.percorso)
+            if cartella:
+                os.makedirs(cartella, exist_ok=True)
+            self._file = open(self.percorso, "a", encoding="utf-8")
+            if self._file.tell() == 0:
+                self._file.write(self._intestazione())
+        return self._file
+
+    def _intestazione(self):
+        return json.dumps({"op": "preventivo", "chiave": self.chiave}, ensure_ascii=False) + "\n"
+
+    def _scrivi(self, record):
+        f = self._apri()
+        f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        f.flush()
+        self.operazioni += 1
+        self._da_sincronizzare += 1
+        if (self._da_sincronizzare >= SCRITTURE_PER_FSYNC
+                or time.monotonic() - self._ultimo_fsync >= INTERVALLO_FSYNC):
+            self.sincronizza()
+
+    def sincronizza(self):
+        """Forza su disco le scritture in sospeso."""
+        if self._file is not None and self._da_sincronizzare:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._da_sincronizzare = 0
+        self._ultimo_fsync = time.monotonic()
+
+    def inserisci(self, iid, valori, indice=None):
+        """Registra l'inserimento di una riga (in coda se `indice` è None)."""
+        self._scrivi({"op": "inserisci", "id": iid, "indice": indice, "valori": list(valori)})
+
+    def modifica(self, iid, valori):
+        """Registra i nuovi valori di una riga."""
+        self._scrivi({"op": "modifica", "id": iid, "valori": list(valori)})
+
+    def elimina(self, iid):
+        """Registra l'eliminazione di una riga."""
+        self._scrivi({"op": "elimina", "id": iid})
+
+    def deve_compattare(self):
+        return self.operazioni >= OPERAZIONI_PER_COMPATTAZIONE
+
+    def compatta(self, righe):
+        """
+        Sostituisce il giornale con un'unica istantanea dello stato corrente.
+        La nuova versione viene scritta su un file temporaneo e poi rinominata, così un'interruzione
+        durante la compattazione lascia intatto il giornale precedente.
+
+        :param righe: lista di coppie (id, valori) nell'ordine della tabella
+        """
+        self.chiudi()
+        cartella = os.path.dirname(self.percorso)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        temporaneo = self.percorso + ".tmp"
+        with open(temporaneo, "w", encoding="utf-8") as f:
+            f.write(self._intestazione())
+            if righe:
+                istantanea = {"op": "istantanea", "righe": [[iid, list(valori)] for iid, valori in righe]}
+                f.write(json.dumps(istantanea, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporaneo, self.percorso)
+        self.operazioni = 0
+
+    def azzera(self):
+        """Elimina il giornale (chiusura regolare del preventivo)."""
+        self.chiudi()
+        try:
+            os.remove(self.percorso)
+        except FileNotFoundError:
+            pass
+        self.operazioni = 0
+
+    def chiudi(self):
+        if self._file is not None:
+            self.sincronizza()
+            self._file.close()
+            self._file = None
+
+    # --- Lettura ---
+
+    def leggi(self):
+        """
+        Ricostruisce lo stato della tabella rileggendo il giornale.
+        Una riga finale incompleta (scrittura interrotta) viene ignorata, e così l'intero giornale se
+        non appartiene a questo preventivo (chiave diversa o assente).
+
+        :return: lista di coppie (id, valori) nell'ordine della tabella
+        """
+        ordine = []
+        valori_per_id = {}
+        intestazione_valida = False
+        if not os.path.exists(self.percorso):
+            return []
+        with open(self.percorso, "r", encoding="utf-8") as f:
+            for numero, riga in enumerate(f, start=1):
+                if not riga.strip():
+                    continue
+                try:
+                    record = json.loads(riga)
+                except json.JSONDecodeError:
+                    log.warning("Riga %d del giornale non leggibile, ignorata", numero)
+                    continue
+                op = record.get("op")
+                if op == "preventivo":
+                    if record.get("chiave") != self.chiave:
+                        log.warning("Giornale %s di un altro preventivo, ignorato", self.percorso)
+                        return []
+                    intestazione_valida = True
+                    continue
+                if not intestazione_valida:
+                    log.warning("Giornale %s senza intestazione del preventivo, ignorato", self.percorso)
+                    return []
+                if op == "istantanea":
+                    ordine = [iid for iid, _ in record["righe"]]
+                    valori_per_id = {iid: valori for iid, valori in record["righe"]}
+                elif op == "inserisci":
+                    iid = record["id"]
+                    indice = record.get("indice")
+                    if indice is None:
+                        ordine.append(iid)
+                    else:
+                        ordine.insert(indice, iid)
+                    valori_per_id[iid] = record["valori"]
+                elif op == "modifica" and record["id"] in valori_per_id:
+                    valori_per_id[record["id"]] = record["valori"]
+                elif op == "elimina" and record["id"] in valori_per_id:
+                    ordine.remove(record["id"])
+                    del valori_per_id[record["id"]]
+        return [(iid, valori_per_id[iid]) for iid in ordine]
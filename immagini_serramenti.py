@@ -0,0 +1,238 @@
+"""
+Archivio delle immagini dei serramenti (cartella risorse/serramenti).
+
+L'indice nome -> file viene costruito una volta sola con un'unica lettura della
+cartella, e la risoluzione di ogni nome di serramento viene memorizzata. Le immagini
+decodificate e già ridimensionate restano in una cache LRU di PhotoImage; in più le
+miniature ridimensionate possono essere salvate su disco, così anche dopo un riavvio
+non si ridimensiona di nuovo l'immagine originale.
+
+Decodifica e ridimensionamento possono avvenire su un thread di lavoro (richiedi_foto):
+il risultato torna al thread di Tk con after(), dove viene creata la PhotoImage.
+"""
+import logging
+import os
+import queue
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageTk  # type: ignore
+
+CARTELLA_SERRAMENTI = os.path.join("risorse", "serramenti")
+CARTELLA_MINIATURE = os.path.join("risorse", "cache_miniature")
+
+# Estensioni cercate, in ordine di preferenza
+ESTENSIONI = (".png", ".jpg", ".jpeg", ".gif")
+
+# Dimensione massima (larghezza, altezza) dell'immagine mostrata nella finestra di modifica
+DIMENSIONE_MASSIMA = (400, 400)
+
+# Numero di PhotoImage tenute in memoria
+CAPIENZA_CACHE = 32
+
+# Ogni quanto (ms) il thread di Tk controlla le immagini decodificate in background
+INTERVALLO_CONTROLLO_MS = 30
+
+_CARATTERI_NON_VALIDI = re.compile(r'[^a-zA-Z0-9]')
+
+log = logging.getLogger("gestionale.immagini")
+
+
+def normalizza_nome(nome):
+    """Nome del serramento in forma di nome file: minuscolo, caratteri speciali sostituiti da '_'."""
+    return _CARATTERI_NON_VALIDI.sub('_', nome.lower())
+
+
+def dimensione_ridotta(larghezza, altezza, dimensione_massima=DIMENSIONE_MASSIMA):
+    """Dimensioni ridotte mantenendo le proporzioni: il lato maggiore diventa quello massimo."""
+    max_width, max_height = dimensione_massima
+    if larghezza > altezza:
+        return max_width, int(altezza * (max_width / larghezza))
+    return int(larghezza * (max_height / altezza)), max_height
+
+
+class ArchivioImmagini:
+    """Risolve i nomi dei serramenti nei file immagine e conserva le immagini già pronte per Tk."""
+
+    def __init__(self, cartella=CARTELLA_SERRAMENTI, dimensione_massima=DIMENSIONE_MASSIMA,
+                 capienza=CAPIENZA_CACHE, cartella_miniature=CARTELLA_MINIATURE):
+        """
+        :param cartella_miniature: cartella della cache su disco delle miniature (None = disattivata)
+        """
+        self.cartella = cartella
+        self.dimensione_massima = tuple(dimensione_massima)
+        self.capienza = capienza
+        self.cartella_miniature = cartella_miniature
+        self._per_nome = None
+        self._file = None
+        self._risolti = {}
+        self._foto = OrderedDict()
+        # Decodifiche in corso: percorso -> lista di (nome serramento, al_termine)
+        self._in_attesa = {}
+        self._pronte = queue.Queue()
+        self._esecutore = None
+        self._controllo_programmato = None
+
+    def invalida(self):
+        """Dimentica indice e immagini (es. dopo aver aggiunto file alla cartella)."""
+        self._per_nome = None
+        self._file = None
+        self._risolti.clear()
+        self._foto.clear()
+
+    def _costruisci_indice(self):
+        self._per_nome = {}
+        self._file = []
+        try:
+            nomi_file = os.listdir(self.cartella)
+        except OSError as e:
+            log.warning("Cartella immagini serramenti non leggibile: %s", e)
+            return
+        priorita = {ext: i for i, ext in enumerate(ESTENSIONI)}
+        migliori = {}
+        for filename in nomi_file:
+            radice, ext = os.path.splitext(filename)
+            ext = ext.lower()
+            if ext not in priorita:
+                continue
+            percorso = os.path.join(self.cartella, filename)
+            self._file.append((filename.lower(), percorso))
+            # Chiave in minuscolo: su Windows il confronto dei nomi file non distingue le maiuscole
+            radice = radice.lower()
+            if radice not in migliori or priorita[ext] < migliori[radice][0]:
+                migliori[radice] = (priorita[ext], percorso)
+        self._per_nome = {radice: percorso for radice, (_, percorso) in migliori.items()}
+
+    def percorso(self, nome_serramento):
+        """File immagine del serramento, oppure None. Il risultato di ogni nome viene memorizzato."""
+        if nome_serramento in self._risolti:
+            return self._risolti[nome_serramento]
+        if self._per_nome is None:
+            self._costruisci_indice()
+        nome = normalizza_nome(nome_serramento)
+        percorso = self._per_nome.get(nome)
+        if percorso is None:
+            # Nessun file con il nome normalizzato: il primo file che contiene una parte significativa del nome
+            parti = [parte for parte in nome.split('_') if len(parte) > 3]
+            percorso = next(
+                (p for filename, p in self._file if any(parte in filename for parte in parti)), None
+            )
+        self._risolti[nome_serramento] = percorso
+        return percorso
+
+    def _percorso_miniatura(self, percorso):
+        stat = os.stat(percorso)
+        radice = os.path.splitext(os.path.basename(percorso))[0]
+        larghezza, altezza = self.dimensione_massima
+        return os.path.join(
+            self.cartella_miniature, f"{radice}_{larghezza}x{altezza}_{stat.st_mtime_ns}_{stat.st_size}.png"
+        )
+
+    def immagine(self, percorso):
+        """Immagine PIL già ridimensionata, dalla cache su disco se presente."""
+        miniatura = None
+        if self.cartella_miniature:
+            miniatura = self._percorso_miniatura(percorso)
+            if os.path.exists(miniatura):
+                try:
+                    with Image.open(miniatura) as img:
+                        img.load()
+                        return img
+                except OSError as e:
+                    log.debug("Miniatura non leggibile %s: %s", miniatura, e)
+        with Image.open(percorso) as img:
+            img = img.resize(dimensione_ridotta(*img.size, self.dimensione_massima), Image.LANCZOS)
+        if miniatura:
+            try:
+                os.makedirs(self.cartella_miniature, exist_ok=True)
+                temporaneo = miniatura + ".tmp"
+                img.save(temporaneo, format="PNG")
+                os.replace(temporaneo, miniatura)
+            except OSError as e:
+                log.warning("Impossibile salvare la miniatura %s: %s", miniatura, e)
+        return img
+
+    def foto(self, nome_serramento):
+        """PhotoImage ridimensionata del serramento (None se non c'è un'immagine). Va chiamato dal thread di Tk."""
+        percorso = self.percorso(nome_serramento)
+        if percorso is None:
+            return None
+        foto = self._foto.get(percorso)
+        if foto is not None:
+            self._foto.move_to_end(percorso)
+            return foto
+        return self._memorizza_foto(percorso, self.immagine(percorso))
+
+    def _memorizza_foto(self, percorso, img):
+        foto = ImageTk.PhotoImage(img)
+        self._foto[percorso] = foto
+        if len(self._foto) > self.capienza:
+            self._foto.popitem(last=False)
+        return foto
+
+    def richiedi_foto(self, nome_serramento, widget, al_termine):
+        """
+        Versione asincrona di foto(): decodifica e ridimensionamento avvengono su un thread di lavoro e
+        al_termine(nome_serramento, foto) viene chiamata sul thread di Tk (foto None se l'immagine non
+        c'è o non è leggibile). Se la foto è già in cache, al_termine viene chiamata subito.
+
+        :param widget: widget Tk che resta in vita (usato per after)
+        :return: True se la foto era già pronta
+        """
+        percorso = self.percorso(nome_serramento)
+        if percorso is None:
+            al_termine(nome_serramento, None)
+            return True
+        foto = self._foto.get(percorso)
+        if foto is not None:
+            self._foto.move_to_end(percorso)
+            al_termine(nome_serramento, foto)
+            return True
+        attese = self._in_attesa.setdefault(percorso, [])
+        attese.append((nome_serramento, al_termine))
+        if len(attese) == 1:
+            if self._esecutore is None:
+                self._esecutore = ThreadPoolExecutor(max_workers=1, thread_name_prefix="immagini_serramenti")
+            self._esecutore.submit(self._decodifica, percorso)
+        if self._controllo_programmato is None:
+            self._controllo_programmato = widget.after(INTERVALLO_CONTROLLO_MS, lambda: self._controlla(widget))
+        return False
+
+    def _decodifica(self, percorso):
+        """Eseguita sul thread di lavoro: solo PIL, nessuna chiamata a Tk."""
+        try:
+            self._pronte.put((percorso, self.immagine(percorso), None))
+        except Exception as e:
+            self._pronte.put((percorso, None, e))
+
+    def _controlla(self, widget):
+        self._controllo_programmato = None
+        while True:
+            try:
+                percorso, img, errore = self._pronte.get_nowait()
+            except queue.Empty:
+                break
+            foto = None
+            if errore is not None:
+                log.error("Errore nel caricamento dell'immagine %s: %s", percorso, errore)
+            else:
+                foto = self._memorizza_foto(percorso, img)
+            for nome_serramento, al_termine in self._in_attesa.pop(percorso, []):
+                try:
+                    al_termine(nome_serramento, foto)
+                except Exception:
+                    log.exception("Errore nella visualizzazione dell'immagine di %s", nome_serramento)
+        if self._in_attesa:
+            self._controllo_programmato = widget.after(INTERVALLO_CONTROLLO_MS, lambda: self._controlla(widget))
+
+
+_archivio = None
+
+
+def archivio_predefinito():
+    """Archivio condiviso da tutte le finestre, sulla cartella risorse/serramenti."""
+    global _archivio
+    if _archivio is None:
+        _archivio = ArchivioImmagini()
+    return _archivio
@@ -0,0 +1,81 @@
+"""
+Indice hash di un catalogo pandas.
+
+Associa a ogni chiave la riga del catalogo già estratta come dict, così ogni
+ricerca costa O(1) invece di una scansione con maschera booleana sull'intero
+DataFrame. Non dipende dal pacchetto data: gli indici dei cataloghi standard
+sono costruiti in catalogo.py.
+"""
+import numpy as np
+import pandas as pd
+
+from prestazioni import conta, misura
+
+
+def _pulisci(cella):
+    """NaN -> None, il resto invariato."""
+    if cella is None or isinstance(cella, str):
+        return cella
+    return None if pd.isna(cella) else cella
+
+
+class IndiceCatalogo:
+    """Indice hash di un catalogo pandas su una colonna chiave."""
+
+    def __init__(self, tabella, chiave):
+        """
+        :param tabella: DataFrame del catalogo
+        :param chiave: nome della colonna usata come chiave (a parità di chiave vale la prima riga)
+        """
+        self.chiave = chiave
+        self.colonne = list(tabella.columns) if tabella is not None else []
+        self._righe = {}
+        self._mappe = {}
+        if tabella is not None and chiave in tabella.columns:
+            for record in tabella.to_dict("records"):
+                valore = record[chiave]
+                if pd.isna(valore) or valore in self._righe:
+                    continue
+                self._righe[valore] = record
+
+    def __contains__(self, valore):
+        return valore in self._righe
+
+    def __len__(self):
+        return len(self._righe)
+
+    def chiavi(self):
+        """Restituisce le chiavi nell'ordine in cui compaiono nel catalogo."""
+        return list(self._righe)
+
+    def riga(self, valore):
+        """Restituisce la riga (dict) associata alla chiave, oppure None."""
+        conta("catalogo.ricerca")
+        return self._righe.get(valore)
+
+    def valore(self, valore, colonna, default=""):
+        """Restituisce una singola cella della riga associata alla chiave (default se assente o NaN)."""
+        conta("catalogo.ricerca")
+        riga = self._righe.get(valore)
+        if riga is None or colonna not in riga:
+            return default
+        cella = riga[colonna]
+        return default if not isinstance(cella, str) and pd.isna(cella) else cella
+
+    def mappa(self, colonna):
+        """Dizionario chiave -> valore della colonna (None se NaN); viene calcolato una sola volta."""
+        if colonna not in self._mappe:
+            self._mappe[colonna] = {k: _pulisci(riga.get(colonna)) for k, riga in self._righe.items()}
+        return self._mappe[colonna]
+
+    @misura("catalogo.colonna")
+    def colonna(self, valori, colonna):
+        """
+        Restituisce, per ogni chiave di `valori`, la cella `colonna` della riga corrispondente.
+
+        :return: array object, None dove la chiave non è a catalogo o la cella è vuota/NaN
+        """
+        mappa = self.mappa(colonna)
+        celle = np.empty(len(valori), dtype=object)
+        celle[:] = [mappa.get(v) for v in valori]
+        return celle
@@ -0,0 +1,205 @@
+"""
+Indice SQLite dei preventivi salvati.
+
+Per ogni file della cartella preventivi l'indice conserva protocollo, cliente,
+riferimento, data, numero di posizioni e totale, insieme a mtime e dimensione del file.
+L'aggiornamento rilegge solo i file nuovi o modificati (mtime/dimensione diversi) e
+toglie quelli spariti; la ricerca è una query sull'indice e non apre nessun file.
+Ogni chiamata usa una propria connessione, quindi l'aggiornamento può girare su un
+thread separato mentre il thread di Tk esegue le ricerche.
+"""
+import json
+import logging
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+import preventivo_colonnare
+from schema_posizioni import numero_da_testo
+
+CARTELLA_PREVENTIVI = "preventivi"
+PERCORSO_INDICE = os.path.join(CARTELLA_PREVENTIVI, "indice_preventivi.sqlite")
+ESTENSIONI_PREVENTIVO = (".json", preventivo_colonnare.ESTENSIONE)
+
+# Colonne dei costi scontati sommate nel totale del preventivo (stesse del riepilogo .prevz)
+COLONNE_TOTALE = [
+    col for chiave, col in preventivo_colonnare.COLONNE_RIEPILOGO.items() if chiave.startswith("totale_")
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS preventivi (
+    percorso TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    dimensione INTEGER NOT NULL,
+    numero_protocollo TEXT,
+    nome_cliente TEXT,
+    rif_cliente TEXT,
+    data TEXT,
+    numero_posizioni INTEGER,
+    totale REAL
+);
+CREATE INDEX IF NOT EXISTS preventivi_protocollo ON preventivi (numero_protocollo COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS preventivi_cliente ON preventivi (nome_cliente COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS preventivi_mtime ON preventivi (mtime);
+"""
+
+log = logging.getLogger("gestionale.indice_preventivi")
+
+
+def _primo_valore(dizionari, *chiavi):
+    for dizionario in dizionari:
+        for chiave in chiavi:
+            valore = dizionario.get(chiave) if isinstance(dizionario, dict) else None
+            if valore not in (None, ""):
+                return str(valore).strip()
+    return ""
+
+
+def estrai_metadati(dati):
+    """
+    Campi indicizzati di un preventivo (dict di Preventivo.to_dict() o letto da file).
+    Per i .prevz appena aperti usa il riepilogo dell'intestazione invece di leggere le colonne.
+    """
+    dati_b2 = dati.get("dati_b2") or {}
+    dati_b1 = dati.get("dati_b1") or {}
+    fonti = (dati_b2, dati_b1, dati)
+    posizioni = dati.get("posizioni") or []
+    riepilogo = dati.get("riepilogo")
+    if isinstance(riepilogo, dict):
+        totale = sum(riepilogo.get(chiave, 0.0) for chiave in preventivo_colonnare.COLONNE_RIEPILOGO
+                     if chiave.startswith("totale_"))
+    elif isinstance(posizioni, preventivo_colonnare.PosizioniColonnari):
+        totale = sum(numero_da_testo(v) or 0.0 for col in COLONNE_TOTALE for v in posizioni.colonna(col)
+                     if v is not None)
+    else:
+        totale = 0.0
+        for posizione in posizioni:
+            for col in COLONNE_TOTALE:
+                valore = posizione.get(col)
+                numero = numero_da_testo(valore) if valore not in (None, "") else None
+                if numero is not None:
+                    totale += numero
+    return {
+        "numero_protocollo": _primo_valore(fonti, "numero_protocollo", "Numero_protocollo"),
+        "nome_cliente": _primo_valore(fonti, "nome_cliente", "Nome_cliente", "cliente"),
+        "rif_cliente": _primo_valore(fonti, "rif_cliente"),
+        "data": _primo_valore(fonti, "data", "data_preventivo", "Data"),
+        "numero_posizioni": len(posizioni),
+        "totale": round(totale, 2),
+    }
+
+
+def leggi_metadati_file(percorso):
+    """Metadati di un file preventivo: per i .prevz basta l'intestazione, i JSON vanno letti per intero."""
+    if percorso.lower().endswith(preventivo_colonnare.ESTENSIONE):
+        intestazione = preventivo_colonnare.leggi_intestazione(percorso)
+        dati = dict(intestazione.get("dati", {}))
+        dati["riepilogo"] = intestazione.get("riepilogo")
+        dati["posizioni"] = range(intestazione.get("numero_posizioni", 0))
+        return estrai_metadati(dati)
+    with open(percorso, "r", encoding="utf-8") as f:
+        return estrai_metadati(json.load(f))
+
+
+class IndicePreventivi:
+    """Indice dei preventivi salvati in una cartella, aggiornato in modo incrementale."""
+
+    def __init__(self, percorso_indice=PERCORSO_INDICE, cartella=CARTELLA_PREVENTIVI):
+        self.percorso_indice = percorso_indice
+        self.cartella = cartella
+
+    def _connessione(self):
+        cartella = os.path.dirname(self.percorso_indice)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        connessione = sqlite3.connect(self.percorso_indice, timeout=10)
+        connessione.executescript(SCHEMA)
+        return connessione
+
+    def aggiorna(self):
+        """
+        Allinea l'indice al contenuto della cartella: rilegge solo i file con mtime o dimensione
+        diversi da quelli registrati e rimuove le voci dei file che non esistono più. I file salvati
+        fuori dalla cartella (registra, es. "Salva come") restano nell'indice finché esistono.
+
+        :return: numero di file riletti
+        """
+        presenti = {}
+        if os.path.isdir(self.cartella):
+            for voce in os.scandir(self.cartella):
+                if voce.is_file() and voce.name.lower().endswith(ESTENSIONI_PREVENTIVO):
+                    stat = voce.stat()
+                    presenti[os.path.abspath(voce.path)] = (stat.st_mtime, stat.st_size)
+        riletti = 0
+        with closing(self._connessione()) as connessione, connessione:
+            registrati = {
+                percorso: (mtime, dimensione)
+                for percorso, mtime, dimensione in connessione.execute(
+                    "SELECT percorso, mtime, dimensione FROM preventivi")
+            }
+            cartella = os.path.normcase(os.path.abspath(self.cartella))
+            for percorso in registrati:
+                if percorso in presenti or os.path.normcase(os.path.dirname(percorso)) == cartella:
+                    continue
+                # Fuori dalla cartella (anche nelle sue sottocartelle) la scansione non arriva: si controlla il file
+                try:
+                    stat = os.stat(percorso)
+                except OSError:
+                    continue
+                presenti[percorso] = (stat.st_mtime, stat.st_size)
+            spariti = [(percorso,) for percorso in registrati if percorso not in presenti]
+            if spariti:
+                connessione.executemany("DELETE FROM preventivi WHERE percorso = ?", spariti)
+            for percorso, (mtime, dimensione) in presenti.items():
+                if registrati.get(percorso) == (mtime, dimensione):
+                    continue
+                try:
+                    metadati = leggi_metadati_file(percorso)
+                except Exception as e:
+                    log.warning("Impossibile leggere %s: %s", percorso, e)
+                    continue
+                self._scrivi(connessione, percorso, mtime, dimensione, metadati)
+                riletti += 1
+        return riletti
+
+    def registra(self, percorso, metadati):
+        """Aggiorna la voce di un file appena salvato, con i metadati già estratti (senza rileggerlo)."""
+        percorso = os.path.abspath(percorso)
+        stat = os.stat(percorso)
+        with closing(self._connessione()) as connessione, connessione:
+            self._scrivi(connessione, percorso, stat.st_mtime, stat.st_size, metadati)
+
+    @staticmethod
+    def _scrivi(connessione, percorso, mtime, dimensione, metadati):
+        if not metadati.get("data"):
+            metadati = dict(metadati, data=datetime.fromtimestamp(mtime).strftime("%d/%m/%Y"))
+        connessione.execute(
+            "INSERT OR REPLACE INTO preventivi (percorso, mtime, dimensione, numero_protocollo, nome_cliente,"
+            " rif_cliente, data, numero_posizioni, totale) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (percorso, mtime, dimensione, metadati["numero_protocollo"], metadati["nome_cliente"],
+             metadati["rif_cliente"], metadati["data"], metadati["numero_posizioni"], metadati["totale"]),
+        )
+
+    def cerca(self, testo="", limite=200):
+        """
+        Preventivi il cui protocollo, cliente o riferimento contengono `testo`
+        (senza distinzione tra maiuscole e minuscole), dal più recente.
+
+        :return: lista di dict con percorso, numero_protocollo, nome_cliente, rif_cliente, data,
+            numero_posizioni, totale
+        """
+        # %, _ e \ nel testo cercato sono caratteri normali, non caratteri jolly di LIKE
+        letterale = testo.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        filtro = f"%{letterale}%"
+        with closing(self._connessione()) as connessione:
+            connessione.row_factory = sqlite3.Row
+            righe = connessione.execute(
+                "SELECT percorso, numero_protocollo, nome_cliente, rif_cliente, data, numero_posizioni, totale"
+                " FROM preventivi"
+                " WHERE numero_protocollo LIKE :f ESCAPE '\\' OR nome_cliente LIKE :f ESCAPE '\\'"
+                " OR rif_cliente LIKE :f ESCAPE '\\'"
+                " ORDER BY mtime DESC LIMIT :limite",
+                {"f": filtro, "limite": limite},
+            ).fetchall()
+        return [dict(riga) for riga in righe]
@@ -0,0 +1,93 @@
+"""
+Intestazioni di gruppo disegnate su un Canvas sopra un ttk.Treeview.
+
+Le posizioni x dei gruppi si ricavano dalle somme prefisse delle larghezze delle
+colonne, calcolate una volta e riusate finché una larghezza non cambia. I ridisegni
+richiesti più volte nello stesso ciclo di eventi vengono accorpati in uno solo
+(after_idle) e lo scorrimento orizzontale sposta gli oggetti già presenti sul canvas
+con `move` invece di ricrearli.
+"""
+import logging
+from itertools import accumulate
+
+from prestazioni import misura
+
+log = logging.getLogger("gestionale.intestazioni")
+
+
+class IntestazioniGruppi:
+    """Disegna e mantiene allineate al Treeview le intestazioni dei gruppi di colonne."""
+
+    def __init__(self, canvas, tree, gruppi, altezza=30):
+        """
+        :param canvas: Canvas su cui disegnare le intestazioni
+        :param tree: Treeview di cui seguire colonne e scorrimento orizzontale
+        :param gruppi: dict nome -> {"start_col", "end_col" (da 1, inclusi), "bg_color", "text_color"}
+        """
+        self.canvas = canvas
+        self.tree = tree
+        self.gruppi = gruppi
+        self.altezza = altezza
+        self._offset_colonne = None
+        self._scorrimento = 0
+        self._disegnate = False
+        self._ridisegno_programmato = None
+
+    def invalida(self):
+        """Da chiamare quando cambia la larghezza di una colonna: le somme prefisse vanno ricalcolate."""
+        self._offset_colonne = None
+        self.programma()
+
+    def programma(self):
+        """Richiede un ridisegno; più richieste nello stesso ciclo di eventi producono un solo ridisegno."""
+        if self._ridisegno_programmato is None:
+            self._ridisegno_programmato = self.canvas.after_idle(self.disegna)
+
+    def offset_colonne(self):
+        """Somme prefisse delle larghezze: offset_colonne()[k] è la x di inizio della colonna k (da 0)."""
+        if self._offset_colonne is None:
+            larghezze = [int(self.tree.column(col, "width")) for col in self.tree["columns"]]
+            self._offset_colonne = [0] + list(accumulate(larghezze))
+        return self._offset_colonne
+
+    def _scorrimento_corrente(self):
+        return int(self.tree.xview()[0] * self.offset_colonne()[-1])
+
+    @misura("intestazioni.disegno")
+    def disegna(self):
+        """Posiziona i rettangoli e i testi dei gruppi; li crea solo la prima volta."""
+        self._ridisegno_programmato = None
+        try:
+            offset = self.offset_colonne()
+            self._scorrimento = self._scorrimento_corrente()
+            larghezza = self.tree.winfo_width()
+            if larghezza > 1:
+                self.canvas.configure(width=larghezza)
+            for nome, gruppo in self.gruppi.items():
+                x_inizio = offset[gruppo["start_col"] - 1] - self._scorrimento
+                x_fine = offset[min(gruppo["end_col"], len(offset) - 1)] - self._scorrimento
+                if not self._disegnate:
+                    self.canvas.create_rectangle(
+                        x_inizio, 0, x_fine, self.altezza,
+                        fill=gruppo["bg_color"], outline="#999999",
+                        tags=("header", f"header_{nome}"))
+                    self.canvas.create_text(
+                        (x_inizio + x_fine) / 2, self.altezza / 2,
+                        text=nome, fill=gruppo["text_color"], font=("Arial", 10, "bold"),
+                        tags=("header", f"text_{nome}"))
+                else:
+                    self.canvas.coords(f"header_{nome}", x_inizio, 0, x_fine, self.altezza)
+                    self.canvas.coords(f"text_{nome}", (x_inizio + x_fine) / 2, self.altezza / 2)
+            self._disegnate = True
+        except Exception as e:
+            log.error("Errore nel disegno degli header: %s", e)
+
+    def scorri(self):
+        """Allinea le intestazioni allo scorrimento orizzontale del Treeview spostando gli oggetti esistenti."""
+        if not self._disegnate or self._offset_colonne is None:
+            self.programma()
+            return
+        scorrimento = self._scorrimento_corrente()
+        if scorrimento != self._scorrimento:
+            self.canvas.move("header", self._scorrimento - scorrimento, 0)
+            self._scorrimento = scorrimento
@@ -1,20 +1,44 @@
+import argparse
 import os
 import sys
 import json
+import logging
+import importlib
 import importlib.util
+import threading
 from datetime import datetime
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 
 from PIL import Image, ImageTk  # type: ignore
-import pandas as pd
 from preventivo_class import Preventivo
-import moduli.certificato_modulo_26 as certificato_modulo_26
-import moduli.modulo_b1 as modulo_b1
-import moduli.modulo_b2 as modulo_b2
-import moduli.modulo_posizioni as modulo_posizioni
-import moduli.modulo_telaio as modulo_telaio
-import moduli.modulo_scansioni as modulo_scansioni
+from salvataggio_preventivo import (SalvataggioPreventivo, autosalvataggio_recente, elimina_autosalvataggio,
+                                    percorso_autosalvataggio, percorso_formato)
+import preventivo_colonnare
+from indice_preventivi import IndicePreventivi, estrai_metadati
+from schema_posizioni import formatta_euro
+from registro import configura_log, debug_attivo, imposta_debug
+import prestazioni
+from profilatore import Profilatore, percorso_profilo
+
+log = logging.getLogger("gestionale.app")
+
+# Moduli dei tab: nome -> (modulo Python, classe del frame, titolo del tab).
+# Ogni modulo viene importato solo quando il suo tab viene aperto la prima volta, così la
+# finestra compare senza aspettare pandas, openpyxl e i cataloghi in data/.
+MODULI_TAB = {
+    "modulo_b1": ("moduli.modulo_b1", "ModuloB1Frame", "Anagrafica Clienti"),
+    "modulo_b2": ("moduli.modulo_b2", "ModuloB2Frame", "Dati Generali"),
+    "modulo_posizioni": ("moduli.modulo_posizioni", "PosizioniFrame", "Inserimento posizioni"),
+    "modulo_telaio": ("moduli.modulo_telaio", "ModuloTelaio", "Telaio"),
+    "modulo_scansioni": ("moduli.modulo_scansioni", "ModuloScansioni", "Scanner e WhatsApp"),
+}
+
+# Moduli aperti con ogni preventivo (nuovo o caricato da file)
+MODULI_PREVENTIVO = ["modulo_b1", "modulo_b2", "modulo_posizioni", "modulo_telaio"]
+
+# Intervallo del salvataggio automatico del preventivo corrente in una copia di recupero (ms)
+INTERVALLO_AUTOSALVATAGGIO_MS = 120000
 
 class GestionaleApp(tk.Tk):
     """Applicazione gestionale IFG SRL."""
@@ -29,9 +53,12 @@ class GestionaleApp(tk.Tk):
         # Inizializza il preventivo corrente
         self.preventivo_corrente = Preventivo()
         self.percorso_preventivo_corrente = None
-        # Carica i dataframes
-        self.dataframes = {}
-        self._carica_dataframes()
+        # I dataframes vengono caricati al primo accesso a self.dataframes
+        self._dataframes = None
+        # Salvataggi su un thread di lavoro (scrittura atomica, saltata se il contenuto non è cambiato)
+        self.salvataggio = SalvataggioPreventivo(self)
+        # Indice dei preventivi salvati, per la ricerca senza aprire i file
+        self.indice_preventivi = IndicePreventivi()
         # Imposta l'icona dell'applicazione
         try:
             if os.path.exists("risorse/logo.png"):
@@ -48,6 +75,8 @@ class GestionaleApp(tk.Tk):
         # Inizializza le variabili per i moduli
         self.moduli = {}
         self.moduli_disponibili = []
+        # Tab segnaposto dei moduli non ancora aperti: id del tab -> nome del modulo
+        self.tab_in_attesa = {}
         # Inizializza il log
         self.log_entries = []
         # Crea il menu principale
@@ -58,6 +87,7 @@ class GestionaleApp(tk.Tk):
         # Crea il notebook per i tab dei moduli
         self.notebook = ttk.Notebook(self.main_frame)
         self.notebook.pack(fill="both", expand=True)
+        self.notebook.bind("<<NotebookTabChanged>>", self._on_tab_cambiato)
         # Barra di stato
         self.status_var = tk.StringVar()
         self.status_bar = ttk.Label(self, textvariable=self.status_var, relief="sunken", anchor="w")
@@ -79,57 +109,45 @@ class GestionaleApp(tk.Tk):
         # Aggiorna l'ora ogni secondo
         self.update_time()
         self.after(1000, self._update_clock)
+        # Salvataggio automatico periodico, in una copia di recupero accanto al preventivo già salvato
+        self.after(INTERVALLO_AUTOSALVATAGGIO_MS, self._autosalva)
 
     def _update_clock(self):
         """Aggiorna l'orologio ogni secondo."""
         self.update_time()
         self.after_id = self.after(1000, self._update_clock)
 
+    @property
+    def dataframes(self):
+        """Dataframe condivisi dai moduli, caricati (con pandas) solo la prima volta che servono."""
+        if self._dataframes is None:
+            self._dataframes = {}
+            self._carica_dataframes()
+        return self._dataframes
+
     def _carica_dataframes(self):
-        """Carica i dataframe da utilizzare in tutti i moduli."""
+        """Carica i dataframe da utilizzare in tutti i moduli (gli stessi oggetti del catalogo condiviso)."""
         try:
-            # Verifica se il file dataframe.py esiste
-            if os.path.exists("data/dataframe.py"):
-                # Aggiungi la directory data al path di Python
-                sys.path.insert(0, os.path.abspath("data"))
-                # Importa il modulo dataframe
-                import dataframe
-                # Carica i dataframe specifici
-                dataframe_names = [
-                    'colore_infissi',
-                    'scavalco_cerniere',
-                    'telaio_prolungato',
-                    'elementi',
-                    'modello_grata_combinato',
-                    'scontistica',
-                    'listino'
-                ]
-                for df_name in dataframe_names:
-                    if hasattr(dataframe, df_name):
-                        self.dataframes[df_name] = getattr(dataframe, df_name)
-                        # print(f"Dataframe '{df_name}' caricato con successo")
-                    else:
-                        # print(f"Dataframe '{df_name}' non trovato nel modulo dataframe.py")
-                        # Crea un dataframe vuoto come fallback
-                        self.dataframes[df_name] = pd.DataFrame()
-            else:
-                # print("File dataframe.py non trovato. Creazione di dataframe vuoti.")
-                pass
+            import catalogo
+            dataframe_names = [
+                'colore_infissi',
+                'scavalco_cerniere',
+                'telaio_prolungato',
+                'elementi',
+                'modello_grata_combinato',
+                'scontistica',
+                'listino'
+            ]
+            for df_name in dataframe_names:
+                self._dataframes[df_name] = catalogo.cataloghi[df_name]
         except Exception as e:
-            print(f"Errore nel caricamento dei dataframe: {e}")
+            log.error("Errore nel caricamento dei dataframe: %s", e)
 
     def _nuovo_preventivo(self):
         """Crea un nuovo preventivo caricando i moduli necessari."""
         self.preventivo_corrente = Preventivo()
         self.percorso_preventivo_corrente = None
-        self.moduli = {}
-        # Rimuovi tutti i tab tranne quello di benvenuto (indice 0)
-        while len(self.notebook.tabs()) > 1:
-            self.notebook.forget(self.notebook.tabs()[1])
-        self._carica_modulo("modulo_b1")
-        self._carica_modulo("modulo_b2")
-        self._carica_modulo("modulo_posizioni")
-        self._carica_modulo("modulo_telaio")
+        self._ricrea_tab_preventivo()
         self.status_var.set("Nuovo preventivo creato")
         
     def _apri_preventivo(self):
@@ -154,29 +172,133 @@ class GestionaleApp(tk.Tk):
         """
         file_path = filedialog.askopenfilename(
             title="Apri Preventivo",
-            filetypes=[("File Preventivo", "*.json")],
+            filetypes=[("File Preventivo", "*.json *.prevz"), ("File Preventivo compatto", "*.prevz")],
             initialdir="preventivi"
         )
         if file_path:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    dati_preventivo = json.load(f)
+            self._carica_preventivo(file_path)
+
+    def _carica_preventivo(self, file_path):
+        """Carica il preventivo salvato in `file_path` e ricrea i tab dei moduli principali."""
+        try:
+            recupero = autosalvataggio_recente(file_path)
+            if recupero and not messagebox.askyesno(
+                    "Salvataggio automatico",
+                    f"Per {os.path.basename(file_path)} esiste un salvataggio automatico più recente del file, "
+                    "con modifiche non salvate.\n\nVuoi recuperarlo?"):
+                elimina_autosalvataggio(file_path)
+                recupero = None
+            with prestazioni.misura("preventivo.apertura") as tempo:
+                # Dalla copia di recupero il file dell'utente resta com'è fino al prossimo salvataggio
+                dati_preventivo = self._leggi_file_preventivo(recupero or file_path)
+                if recupero and dati_preventivo.get("posizioni") is not None:
+                    # Le posizioni di un .prevz si leggono al primo accesso: la copia potrebbe non esserci più
+                    dati_preventivo["posizioni"] = list(dati_preventivo["posizioni"])
                 self.preventivo_corrente = Preventivo()
                 self.preventivo_corrente.from_dict(dati_preventivo)
+                if recupero:
+                    self.preventivo_corrente.modificato = True
                 self.percorso_preventivo_corrente = file_path
-                self.moduli = {}
-                # Rimuovi tutti i tab tranne quello di benvenuto (indice 0)
-                while len(self.notebook.tabs()) > 1:
-                    self.notebook.forget(self.notebook.tabs()[1])
-                self._carica_modulo("modulo_b1")
-                self._carica_modulo("modulo_b2")
-                self._carica_modulo("modulo_posizioni")
-                self._carica_modulo("modulo_telaio")
-                self.status_var.set(f"Preventivo caricato: {os.path.basename(file_path)}")
-                self._aggiungi_log(f"preventivo caricato {os.path.basename(file_path)}")
+                self._ricrea_tab_preventivo()
+            self.status_var.set(f"Preventivo caricato: {os.path.basename(file_path)} ({tempo.durata * 1000:.0f} ms)")
+            self._aggiungi_log(f"preventivo caricato {os.path.basename(file_path)}")
+        except Exception as e:
+            messagebox.showerror("Errore", f"Impossibile caricare il preventivo: {str(e)}")
+            self._aggiungi_log(f"Errore nel caricamento del preventivo: {str(e)}")
+
+    def _mostra_ricerca_preventivi(self):
+        """Finestra di ricerca dei preventivi salvati (protocollo, cliente, riferimento) tramite l'indice."""
+        ricerca_window = tk.Toplevel(self)
+        ricerca_window.title("Cerca Preventivi")
+        ricerca_window.geometry("900x500")
+        
+        main_frame = ttk.Frame(ricerca_window, padding=10)
+        main_frame.pack(fill="both", expand=True)
+        
+        # Campo di ricerca
+        search_frame = ttk.Frame(main_frame)
+        search_frame.pack(fill="x", pady=(0, 5))
+        ttk.Label(search_frame, text="Cerca (protocollo, cliente, riferimento):").pack(side="left", padx=5)
+        testo_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=testo_var, width=40)
+        search_entry.pack(side="left", padx=5)
+        stato_var = tk.StringVar(value="Aggiornamento indice in corso...")
+        ttk.Label(search_frame, textvariable=stato_var).pack(side="right", padx=5)
+        
+        # Risultati
+        colonne = ("Protocollo", "Cliente", "Rif.", "Data", "Posizioni", "Totale", "File")
+        larghezze = (90, 200, 120, 80, 70, 100, 220)
+        tree_frame = ttk.Frame(main_frame)
+        tree_frame.pack(fill="both", expand=True)
+        tree = ttk.Treeview(tree_frame, columns=colonne, show="headings", selectmode="browse")
+        for col, larghezza in zip(colonne, larghezze):
+            tree.heading(col, text=col)
+            tree.column(col, width=larghezza, anchor="e" if col in ("Posizioni", "Totale") else "w")
+        vsb = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=vsb.set)
+        tree.pack(side="left", fill="both", expand=True)
+        vsb.pack(side="right", fill="y")
+        
+        ricerca_programmata = [None]
+        
+        def esegui_ricerca():
+            ricerca_programmata[0] = None
+            try:
+                risultati = self.indice_preventivi.cerca(testo_var.get())
             except Exception as e:
-                messagebox.showerror("Errore", f"Impossibile caricare il preventivo: {str(e)}")
-                self._aggiungi_log(f"Errore nel caricamento del preventivo: {str(e)}")
+                stato_var.set(f"Errore nella ricerca: {e}")
+                return
+            tree.delete(*tree.get_children())
+            for r in risultati:
+                tree.insert("", "end", iid=r["percorso"], values=(
+                    r["numero_protocollo"], r["nome_cliente"], r["rif_cliente"], r["data"],
+                    r["numero_posizioni"], formatta_euro(r["totale"]), os.path.basename(r["percorso"])
+                ))
+            stato_var.set(f"{len(risultati)} preventivi trovati")
+        
+        def programma_ricerca(event=None):
+            # Accorpa le ricerche mentre si digita
+            if ricerca_programmata[0] is not None:
+                ricerca_window.after_cancel(ricerca_programmata[0])
+            ricerca_programmata[0] = ricerca_window.after(150, esegui_ricerca)
+        
+        def apri_selezionato(event=None):
+            selezione = tree.selection()
+            if selezione:
+                ricerca_window.destroy()
+                self._carica_preventivo(selezione[0])
+        
+        search_entry.bind("<KeyRelease>", programma_ricerca)
+        tree.bind("<Double-1>", apri_selezionato)
+        tree.bind("<Return>", apri_selezionato)
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill="x", pady=(5, 0))
+        ttk.Button(button_frame, text="Apri", command=apri_selezionato).pack(side="right", padx=5)
+        ttk.Button(button_frame, text="Chiudi", command=ricerca_window.destroy).pack(side="right", padx=5)
+        
+        # Risultati subito dall'indice esistente; intanto si rileggono solo i file nuovi o modificati
+        esegui_ricerca()
+        aggiornamento = threading.Thread(target=self.indice_preventivi.aggiorna, daemon=True)
+        aggiornamento.start()
+        
+        def controlla_aggiornamento():
+            if not ricerca_window.winfo_exists():
+                return
+            if aggiornamento.is_alive():
+                ricerca_window.after(200, controlla_aggiornamento)
+            else:
+                esegui_ricerca()
+        
+        ricerca_window.after(200, controlla_aggiornamento)
+        search_entry.focus_set()
+        self._aggiungi_log("Aperta ricerca preventivi")
+
+    def _leggi_file_preventivo(self, file_path):
+        """Legge un preventivo JSON oppure .prevz (colonnare: le posizioni si caricano al primo accesso)."""
+        if percorso_formato(file_path).lower().endswith(preventivo_colonnare.ESTENSIONE):
+            return preventivo_colonnare.carica(file_path)
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
 
     def _salva_preventivo(self):
         """Salva il preventivo corrente."""
@@ -211,9 +333,8 @@ class GestionaleApp(tk.Tk):
         riferimento_cliente = sanitize_component(
             get_val(dati_b2, 'rif_cliente') or get_val(dati_b1, 'rif_cliente')
         )
-        print(f"[DEBUG] numero_protocollo='{numero_protocollo}', nome_cliente='{nome_cliente}', riferimento_cliente='{riferimento_cliente}'")
-        import logging
-        logging.debug(f"[DEBUG] INPUTS: numero_protocollo='{numero_protocollo}', nome_cliente='{nome_cliente}', riferimento_cliente='{riferimento_cliente}'")
+        log.debug("numero_protocollo=%r, nome_cliente=%r, riferimento_cliente=%r",
+                  numero_protocollo, nome_cliente, riferimento_cliente)
         nome_file = f"N.{numero_protocollo} {nome_cliente}".strip()
         # Aggiungi la parte RIF. solo se riferimento_cliente è valorizzato (non vuoto dopo strip)
         if riferimento_cliente.strip():
@@ -223,42 +344,113 @@ class GestionaleApp(tk.Tk):
         if not os.path.exists(percorso_dir):
             os.makedirs(percorso_dir)
         percorso_file = os.path.join(percorso_dir, nome_file)
-        print(f"[DEBUG] Salvataggio preventivo in: {percorso_file}")
-        logging.debug(f"[DEBUG] Salvataggio preventivo in: {percorso_file}")
+        log.debug("Salvataggio preventivo in: %s", percorso_file)
         try:
-            with open(percorso_file, 'w', encoding='utf-8') as f:
-                json.dump(self.preventivo_corrente.to_dict(), f, ensure_ascii=False, indent=4)
+            # Serializzazione e scrittura avvengono in background: qui si accoda solo un'istantanea
+            self._accoda_salvataggio(percorso_file)
             self.preventivo_corrente.modificato = False
+            if self.percorso_preventivo_corrente and self.percorso_preventivo_corrente != percorso_file:
+                # Le modifiche non salvate del file precedente sono ora nel nuovo file
+                elimina_autosalvataggio(self.percorso_preventivo_corrente)
             self.percorso_preventivo_corrente = percorso_file
-            self._aggiungi_log(f"preventivo salvato {nome_file}")
-            messagebox.showinfo("Preventivo Salvato", f"Preventivo salvato con successo come {nome_file}.")
+            self._aggiorna_chiave_giornale()
+            self.status_var.set(f"Salvataggio di {nome_file} in corso...")
             return True
         except Exception as e:
             messagebox.showerror("Errore", f"Impossibile salvare il preventivo: {str(e)}")
             self._aggiungi_log(f"Errore nel salvataggio del preventivo: {str(e)}")
             return False
 
+    def _accoda_salvataggio(self, percorso):
+        """Accoda il salvataggio in background del preventivo corrente; a scrittura conclusa aggiorna l'indice."""
+        dati = self.preventivo_corrente.to_dict()
+        metadati = estrai_metadati(dati)
+        self.salvataggio.salva(
+            percorso, dati, lambda percorso, esito, errore: self._on_preventivo_salvato(percorso, esito, errore, metadati)
+        )
+
+    def _on_preventivo_salvato(self, percorso, esito, errore, metadati=None):
+        """Esito di un salvataggio in background (chiamato sul thread di Tk)."""
+        nome_file = os.path.basename(percorso)
+        if esito in ("salvato", "invariato"):
+            # Il file è allineato allo stato corrente: la copia di recupero non serve più
+            elimina_autosalvataggio(percorso)
+        if esito == "salvato" and metadati is not None:
+            try:
+                self.indice_preventivi.registra(percorso, metadati)
+            except Exception as e:
+                log.error("Errore nell'aggiornamento dell'indice preventivi: %s", e)
+        if esito == "errore":
+            if hasattr(self, 'preventivo_corrente') and self.preventivo_corrente:
+                self.preventivo_corrente.modificato = True
+            self._aggiungi_log(f"Errore nel salvataggio del preventivo: {str(errore)}")
+            messagebox.showerror("Errore", f"Impossibile salvare il preventivo {nome_file}: {str(errore)}")
+        elif esito == "invariato":
+            self.status_var.set(f"Preventivo {nome_file} invariato, nessuna scrittura necessaria")
+        else:
+            self._aggiungi_log(f"preventivo salvato {nome_file}")
+            self.status_var.set(f"Preventivo salvato: {nome_file}")
+
+    def _autosalva(self):
+        """
+        Salva in background il preventivo corrente, se ha già un file, nella sua copia di recupero
+        (<file>.autosave): il file dell'utente cambia solo con un salvataggio esplicito. Se il contenuto
+        non è cambiato la scrittura viene saltata.
+        """
+        try:
+            if self.percorso_preventivo_corrente and self.preventivo_corrente:
+                for nome_modulo, chiave in (("modulo_b1", "dati_b1"), ("modulo_b2", "dati_b2")):
+                    if nome_modulo in self.moduli:
+                        setattr(self.preventivo_corrente, chiave, self.moduli[nome_modulo].get_data())
+                if "modulo_posizioni" in self.moduli:
+                    self.preventivo_corrente.posizioni = self.moduli["modulo_posizioni"].get_all_posizioni()
+                self.salvataggio.salva(percorso_autosalvataggio(self.percorso_preventivo_corrente),
+                                       self.preventivo_corrente.to_dict(), self._on_autosalvato,
+                                       riferimento=self.percorso_preventivo_corrente)
+        except Exception as e:
+            log.error("Errore nel salvataggio automatico: %s", e)
+        self.after(INTERVALLO_AUTOSALVATAGGIO_MS, self._autosalva)
+
+    def _on_autosalvato(self, percorso, esito, errore):
+        """Esito del salvataggio automatico: nessun messaggio, solo log e barra di stato."""
+        if esito == "errore":
+            log.error("Errore nel salvataggio automatico in %s: %s", percorso, errore)
+        elif esito == "salvato":
+            self.status_var.set(f"Salvataggio automatico: {os.path.basename(percorso)}")
+
     def _salva_preventivo_come(self):
         """Salva il preventivo corrente con un nuovo nome."""
         file_path = filedialog.asksaveasfilename(
             title="Salva Preventivo Come",
             defaultextension=".json",
-            filetypes=[("File Preventivo", "*.json")],
+            filetypes=[("File Preventivo", "*.json"), ("File Preventivo compatto", "*.prevz")],
             initialdir="preventivi"
         )
         if file_path:
             try:
                 self.save_preventivo()
                 self.preventivo_corrente.file_salvataggio = file_path
-                self.preventivo_corrente.auto_save()
+                # JSON e .prevz passano entrambi da serializza (le posizioni sono record Posizione)
+                self._accoda_salvataggio(file_path)
+                self.preventivo_corrente.modificato = False
+                if self.percorso_preventivo_corrente and self.percorso_preventivo_corrente != file_path:
+                    # Le modifiche non salvate del file precedente sono ora nel nuovo file
+                    elimina_autosalvataggio(self.percorso_preventivo_corrente)
                 self.percorso_preventivo_corrente = file_path
-                self.status_var.set(f"Preventivo salvato: {os.path.basename(file_path)}")
+                self._aggiorna_chiave_giornale()
+                self.status_var.set(f"Salvataggio di {os.path.basename(file_path)} in corso...")
                 return True
             except Exception as e:
                 messagebox.showerror("Errore", f"Impossibile salvare il preventivo: {str(e)}")
                 return False
         return False
 
+    def _aggiorna_chiave_giornale(self):
+        """Il giornale delle posizioni segue il percorso del preventivo appena salvato."""
+        modulo_posizioni_frame = self.moduli.get("modulo_posizioni")
+        if modulo_posizioni_frame is not None and hasattr(modulo_posizioni_frame, 'aggiorna_chiave_giornale'):
+            modulo_posizioni_frame.aggiorna_chiave_giornale()
+
     def save_preventivo(self):
         """Salva i dati da tutti i moduli nel preventivo."""
         # Modulo B1
@@ -289,33 +481,74 @@ class GestionaleApp(tk.Tk):
         if self.percorso_preventivo_corrente:
             self._aggiungi_log(f"preventivo modificato {os.path.basename(self.percorso_preventivo_corrente)}")
 
-    def _carica_modulo(self, nome_modulo):
-        """Carica un modulo e lo aggiunge come tab nel notebook. Solo modulo_posizioni.py è accettato per le posizioni."""
+    def _ricrea_tab_preventivo(self):
+        """Rimuove i tab del preventivo precedente e aggiunge i segnaposto dei moduli del preventivo."""
+        # Il preventivo precedente è stato chiuso regolarmente: il suo giornale non serve più
+        modulo_posizioni_frame = self.moduli.get("modulo_posizioni")
+        if modulo_posizioni_frame is not None and hasattr(modulo_posizioni_frame, 'chiudi_giornale'):
+            modulo_posizioni_frame.chiudi_giornale()
+        self.moduli = {}
+        self.tab_in_attesa = {}
+        # Rimuovi e distruggi tutti i tab tranne quello di benvenuto (indice 0), così i moduli chiudono
+        # giornale e calcoli in background
+        while len(self.notebook.tabs()) > 1:
+            tab = self.notebook.tabs()[1]
+            self.notebook.forget(tab)
+            self.nametowidget(tab).destroy()
+        for nome_modulo in MODULI_PREVENTIVO:
+            self._aggiungi_tab_in_attesa(nome_modulo)
+
+    def _aggiungi_tab_in_attesa(self, nome_modulo):
+        """Aggiunge un tab segnaposto: il modulo vero viene importato e creato quando il tab viene selezionato."""
+        segnaposto = ttk.Frame(self.notebook)
+        ttk.Label(segnaposto, text="Caricamento in corso...", font=("Helvetica", 12)).pack(pady=40)
+        self.notebook.add(segnaposto, text=MODULI_TAB[nome_modulo][2])
+        self.tab_in_attesa[str(segnaposto)] = nome_modulo
+
+    def _on_tab_cambiato(self, event=None):
+        """Alla prima selezione di un tab segnaposto crea il modulo al suo posto."""
+        selezionato = self.notebook.select()
+        nome_modulo = self.tab_in_attesa.pop(selezionato, None)
+        if nome_modulo is None:
+            return
+        segnaposto = self.nametowidget(selezionato)
+        indice = self.notebook.index(selezionato)
+        self.config(cursor="watch")
+        self.update_idletasks()
+        try:
+            modulo = self._carica_modulo(nome_modulo, indice=indice)
+            self.notebook.forget(segnaposto)
+            segnaposto.destroy()
+            if modulo is not None:
+                self.notebook.select(modulo)
+        except Exception as e:
+            messagebox.showerror("Errore", f"Impossibile caricare il modulo {nome_modulo}: {str(e)}")
+            self._aggiungi_log(f"Errore nel caricamento del modulo {nome_modulo}: {str(e)}")
+        finally:
+            self.config(cursor="")
+
+    def _carica_modulo(self, nome_modulo, indice=None):
+        """
+        Carica un modulo e lo aggiunge come tab nel notebook (in coda o alla posizione `indice`).
+        Solo modulo_posizioni.py è accettato per le posizioni.
+        """
         # Protezione: solo modulo_posizioni.py è accettato
         if nome_modulo.startswith("modulo_posizioni") and nome_modulo != "modulo_posizioni":
             raise ImportError(f"È consentito solo 'modulo_posizioni.py' come modulo delle posizioni. Trovato: {nome_modulo}")
-        if nome_modulo == "modulo_b1":
-            modulo = modulo_b1.ModuloB1Frame(self.notebook, preventivo=self.preventivo_corrente, app=self)
-            self.moduli[nome_modulo] = modulo
-            self.notebook.add(modulo, text="Anagrafica Clienti")
-        elif nome_modulo == "modulo_b2":
-            modulo = modulo_b2.ModuloB2Frame(self.notebook, preventivo=self.preventivo_corrente, app=self)
+        if nome_modulo in MODULI_TAB:
+            percorso_modulo, nome_classe, titolo = MODULI_TAB[nome_modulo]
+            classe = getattr(importlib.import_module(percorso_modulo), nome_classe)
+            modulo = classe(self.notebook, preventivo=self.preventivo_corrente, app=self)
             self.moduli[nome_modulo] = modulo
-            self.notebook.add(modulo, text="Dati Generali")
-        elif nome_modulo == "modulo_posizioni":
-            modulo = modulo_posizioni.PosizioniFrame(self.notebook, preventivo=self.preventivo_corrente, app=self)
-            self.moduli[nome_modulo] = modulo
-            self.notebook.add(modulo, text="Inserimento posizioni")
-            if "modulo_b2" in self.moduli:
+            if indice is None:
+                self.notebook.add(modulo, text=titolo)
+            else:
+                self.notebook.insert(indice, modulo, text=titolo)
+            # Il modulo posizioni segue il colore infissi di B2, in qualunque ordine vengano aperti
+            if nome_modulo == "modulo_posizioni" and "modulo_b2" in self.moduli:
                 modulo.collega_modulo_b2(self.moduli["modulo_b2"])
-        elif nome_modulo == "modulo_telaio":
-            modulo = modulo_telaio.ModuloTelaio(self.notebook, preventivo=self.preventivo_corrente, app=self)
-            self.moduli[nome_modulo] = modulo
-            self.notebook.add(modulo, text="Telaio")
-        elif nome_modulo == "modulo_scansioni":
-            modulo = modulo_scansioni.ModuloScansioni(self.notebook, preventivo=self.preventivo_corrente, app=self)
-            self.moduli[nome_modulo] = modulo
-            self.notebook.add(modulo, text="Scanner e WhatsApp")
+            elif nome_modulo == "modulo_b2" and "modulo_posizioni" in self.moduli:
+                self.moduli["modulo_posizioni"].collega_modulo_b2(modulo)
         else:
             modulo = None
             try:
@@ -329,13 +562,14 @@ class GestionaleApp(tk.Tk):
                         modulo = imported_modulo.Frame(self.notebook, preventivo=self.preventivo_corrente, app=self)
                         self.moduli[nome_modulo] = modulo
                         self.notebook.add(modulo, text=nome_modulo)
-            except Exception as e:
-                print(f"Errore nel caricamento del modulo {nome_modulo}: {e}")
+            except Exception:
+                log.exception("Errore nel caricamento del modulo %s", nome_modulo)
         return modulo
 
     def _carica_certificazione_ce_tab(self):
         """Carica la scheda Certificazione CE solo quando richiesto."""
         if self.certificazione_ce_tab is None or self.certificazione_ce_tab not in self.notebook.tabs():
+            certificato_modulo_26 = importlib.import_module("moduli.certificato_modulo_26")
             self.certificazione_ce_tab = certificato_modulo_26.get_certificazione_ce_tab(self.notebook)
             self.notebook.add(self.certificazione_ce_tab, text="Certificazione CE")
         self.notebook.select(self.certificazione_ce_tab)
@@ -527,20 +761,23 @@ class GestionaleApp(tk.Tk):
             result = self._salva_preventivo()
             if not result:
                 messagebox.showerror("Errore salvataggio", "Impossibile salvare il preventivo.")
-        # Pulizia del preventivo.py (come prima)
-        try:
-            path_preventivo_py = os.path.join("risorse", "preventivo.py")
-            if os.path.exists(path_preventivo_py):
-                with open(path_preventivo_py, "r", encoding="utf-8") as f:
-                    lines = f.readlines()
-                with open(path_preventivo_py, "w", encoding="utf-8") as f:
-                    for line in lines:
-                        if line.strip().startswith("dati_posizioni"):
-                            f.write("dati_posizioni: list[dict] = []\n")
-                        else:
-                            f.write(line)
-        except Exception as e:
-            print(f"Errore nella pulizia di preventivo.py: {e}")
+        # Attende la fine delle scritture in background prima di chiudere
+        if not self.salvataggio.attendi(timeout=30):
+            log.warning("Salvataggio del preventivo non concluso entro 30 secondi")
+        # Chiusura regolare: salvate o scartate, le modifiche non vanno riproposte al prossimo avvio
+        if self.percorso_preventivo_corrente:
+            elimina_autosalvataggio(self.percorso_preventivo_corrente)
+        # Una profilazione lasciata attiva viene salvata invece di andare persa
+        if getattr(self, 'profilatore', None) is not None and self.profilatore.attivo:
+            try:
+                percorso = self.profilatore.ferma(percorso_profilo(self.percorso_preventivo_corrente))
+                log.info("Profilo salvato alla chiusura in %s", percorso)
+            except Exception as e:
+                log.error("Impossibile salvare il profilo alla chiusura: %s", e)
+        # Chiusura regolare: il giornale delle posizioni non serve più per il ripristino
+        modulo_posizioni_frame = self.moduli.get("modulo_posizioni")
+        if modulo_posizioni_frame is not None and hasattr(modulo_posizioni_frame, "chiudi_giornale"):
+            modulo_posizioni_frame.chiudi_giornale()
         if hasattr(self, 'after_id'):
             self.after_cancel(self.after_id)
         self.destroy()
@@ -549,13 +786,12 @@ class GestionaleApp(tk.Tk):
         """Carica un preventivo da file JSON e aggiorna le posizioni correnti."""
         file_path = filedialog.askopenfilename(
             defaultextension=".json",
-            filetypes=[("Preventivo files", "*.json"), ("All files", "*.*")],
+            filetypes=[("Preventivo files", "*.json *.prevz"), ("All files", "*.*")],
             initialdir="preventivi"
         )
         if file_path:
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    dati_preventivo = json.load(f)
+                dati_preventivo = self._leggi_file_preventivo(file_path)
                 self.preventivo_corrente = Preventivo()
                 self.preventivo_corrente.from_dict(dati_preventivo)
                 self._aggiungi_log(f"Preventivo caricato da {file_path}")
@@ -569,6 +805,95 @@ class GestionaleApp(tk.Tk):
         current_time = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
         self.time_var.set(f"Data e ora: {current_time}")
         
+    def _mostra_diagnostica(self):
+        """Finestra con i tempi delle operazioni misurate (vedi prestazioni.py) e i contatori."""
+        diagnostica_window = tk.Toplevel(self)
+        diagnostica_window.title("Diagnostica prestazioni")
+        diagnostica_window.geometry("1000x450")
+        
+        main_frame = ttk.Frame(diagnostica_window, padding=10)
+        main_frame.pack(fill="both", expand=True)
+        
+        colonne = ("Operazione", "Chiamate", "Totale (ms)", "Medio (ms)", "p50 (ms)", "p95 (ms)", "Max (ms)", "Istogramma")
+        larghezze = (190, 70, 90, 80, 70, 70, 80, 330)
+        tree_frame = ttk.Frame(main_frame)
+        tree_frame.pack(fill="both", expand=True)
+        tree = ttk.Treeview(tree_frame, columns=colonne, show="headings")
+        for col, larghezza in zip(colonne, larghezze):
+            tree.heading(col, text=col)
+            tree.column(col, width=larghezza, anchor="w" if col in ("Operazione", "Istogramma") else "e")
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        
+        contatori_var = tk.StringVar()
+        ttk.Label(main_frame, textvariable=contatori_var).pack(anchor="w", pady=5)
+        
+        def aggiorna():
+            tree.delete(*tree.get_children())
+            dati = prestazioni.statistiche()
+            for nome, op in sorted(dati["operazioni"].items(), key=lambda voce: -voce[1]["totale"]):
+                istogramma = "  ".join(f"{fascia}: {numero}" for fascia, numero in op["istogramma"].items())
+                tree.insert("", "end", values=(
+                    nome, op["conteggio"], f"{op['totale'] * 1000:.1f}", f"{op['medio'] * 1000:.2f}",
+                    f"{op['p50'] * 1000:.1f}", f"{op['p95'] * 1000:.1f}", f"{op['massimo'] * 1000:.1f}", istogramma,
+                ))
+            contatori = ", ".join(f"{nome}: {numero}" for nome, numero in sorted(dati["contatori"].items()))
+            contatori_var.set(f"Contatori: {contatori or 'nessuno'}")
+        
+        def azzera():
+            prestazioni.azzera()
+            aggiorna()
+        
+        def salva_su_file():
+            percorso = filedialog.asksaveasfilename(
+                parent=diagnostica_window, title="Salva diagnostica", defaultextension=".json",
+                initialfile=f"diagnostica_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                filetypes=[("File JSON", "*.json")],
+            )
+            if percorso:
+                try:
+                    prestazioni.salva(percorso)
+                    self._aggiungi_log(f"diagnostica prestazioni salvata {os.path.basename(percorso)}")
+                except Exception as e:
+                    messagebox.showerror("Errore", f"Impossibile salvare la diagnostica: {str(e)}", parent=diagnostica_window)
+        
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill="x")
+        ttk.Button(button_frame, text="Aggiorna", command=aggiorna).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Azzera", command=azzera).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Salva su file...", command=salva_su_file).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Chiudi", command=diagnostica_window.destroy).pack(side="right", padx=5)
+        aggiorna()
+
+    def _on_profilazione(self):
+        """Avvia o ferma la profilazione (menu Aiuto > Profilazione, solo thread principale) e salva il profilo raccolto."""
+        if not hasattr(self, 'profilatore'):
+            self.profilatore = Profilatore()
+        if self.profilazione_var.get():
+            try:
+                self.profilatore.avvia()
+            except ValueError as e:
+                # Un solo profilatore per processo (es. avvio con --profila-avvio ancora in corso)
+                self.profilazione_var.set(False)
+                messagebox.showerror("Errore", f"Impossibile avviare la profilazione: {str(e)}")
+                return
+            self.status_var.set("Profilazione del thread principale in corso...")
+            self._aggiungi_log("profilazione avviata")
+            return
+        try:
+            percorso = self.profilatore.ferma(percorso_profilo(self.percorso_preventivo_corrente))
+        except Exception as e:
+            messagebox.showerror("Errore", f"Impossibile salvare il profilo: {str(e)}")
+            return
+        if percorso:
+            self.status_var.set(f"Profilo salvato: {os.path.basename(percorso)}")
+            self._aggiungi_log(f"profilo salvato {percorso}")
+            messagebox.showinfo("Profilazione", f"Profilo del thread principale salvato in:\n{percorso}\n\n"
+                                "I lavori in background (calcoli, salvataggio, immagini) non sono compresi: "
+                                "i loro tempi sono in Aiuto > Diagnostica prestazioni.")
+
     def _aggiungi_log(self, messaggio):
         """Aggiunge un'entrata al registro di log."""
         timestamp = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
@@ -590,6 +915,7 @@ class GestionaleApp(tk.Tk):
         file_menu = tk.Menu(self.menu_bar, tearoff=0)
         file_menu.add_command(label="Nuovo Preventivo", command=self._nuovo_preventivo)
         file_menu.add_command(label="Apri Preventivo", command=self._apri_preventivo)
+        file_menu.add_command(label="Cerca Preventivi...", command=self._mostra_ricerca_preventivi)
         file_menu.add_command(label="Salva Preventivo", command=self._salva_preventivo)
         file_menu.add_command(label="Salva Preventivo Come...", command=self._salva_preventivo_come)
         file_menu.add_separator()
@@ -610,6 +936,16 @@ class GestionaleApp(tk.Tk):
         help_menu = tk.Menu(self.menu_bar, tearoff=0)
         help_menu.add_command(label="Guida", command=self._mostra_guida)
         help_menu.add_command(label="Informazioni", command=self._mostra_info)
+        help_menu.add_command(label="Diagnostica prestazioni", command=self._mostra_diagnostica)
+        # Profilazione del thread di Tk: il profilo viene salvato accanto al preventivo aperto
+        self.profilazione_var = tk.BooleanVar(value=False)
+        help_menu.add_checkbutton(label="Profilazione (thread principale)", variable=self.profilazione_var,
+                                  command=self._on_profilazione)
+        help_menu.add_separator()
+        # Livello del log modificabile senza riavviare (file in risorse/log)
+        self.debug_var = tk.BooleanVar(value=debug_attivo())
+        help_menu.add_checkbutton(label="Log di debug", variable=self.debug_var,
+                                  command=lambda: imposta_debug(self.debug_var.get()))
         self.menu_bar.add_cascade(label="Aiuto", menu=help_menu)
         
         self.config(menu=self.menu_bar)
@@ -677,13 +1013,20 @@ class GestionaleApp(tk.Tk):
         messagebox.showinfo("Funzione non disponibile", "La funzione di esportazione in PDF non è ancora implementata.")
 
 if __name__ == "__main__":
-    # --- PATCH: sicurezza import preventivo ---
-    try:
-        from preventivo import dati_posizioni
-        if not isinstance(dati_posizioni, list):
-            dati_posizioni = []
-    except Exception:
-        dati_posizioni = []
-    # -----------------------------------------
+    parser = argparse.ArgumentParser(description="Gestionale IFG SRL")
+    parser.add_argument("--profila-avvio", nargs="?", const="", metavar="FILE",
+                        help="profila l'avvio fino al primo disegno della finestra (predefinito: risorse/profili)")
+    argomenti = parser.parse_args()
+    configura_log()
+    profilatore_avvio = None
+    if argomenti.profila_avvio is not None:
+        profilatore_avvio = Profilatore()
+        profilatore_avvio.avvia()
     app = GestionaleApp()
+    if profilatore_avvio is not None:
+        # Primo disegno della finestra, poi il profilo dell'avvio è completo
+        app.update()
+        percorso = profilatore_avvio.ferma(argomenti.profila_avvio or percorso_profilo(prefisso="profilo_avvio"))
+        log.info("Profilo dell'avvio salvato in %s", percorso)
+        app.status_var.set(f"Profilo dell'avvio salvato: {os.path.basename(percorso)}")
     app.mainloop()
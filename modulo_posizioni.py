@@ -1,27 +1,38 @@
+import os
 import tkinter as tk
 from tkinter import ttk, messagebox
 import pandas as pd
-import os
-import openpyxl
-from data.elementi import elementi
-from data.dataframe import listino, modello_grata_combinato, controtelaio
+from catalogo import cataloghi, indice_elementi, indice_listino, valori_telaio
+from motore_prezzi import COLONNE_SORGENTE, calcola_posizioni
+from schema_posizioni import COLONNE, COLONNE_INPUT, GRUPPI, INDICI
+from posizione import Posizione, posizioni_da_risultato
+from tabella_virtuale import TabellaVirtuale
+from intestazioni_gruppi import IntestazioniGruppi
+from giornale_posizioni import CARTELLA_GIORNALI, GiornalePosizioni
+from immagini_serramenti import archivio_predefinito
+from calcoli_posizioni import RIGHE_SINCRONE, CalcoliInBackground, ricalcola_valori, sconti_valori
 import logging
-import re
 
-# Inizializza logging debug su file
-logging.basicConfig(
-    filename="debug_sconti.log",
-    level=logging.DEBUG,
-    format="%(asctime)s %(levelname)s %(message)s"
-)
+# Configurazione di livello e file di log in registro.py: qui solo il logger del modulo
+log = logging.getLogger("gestionale.posizioni")
+
+# Cataloghi condivisi (caricati una volta per processo dal modulo catalogo)
+elementi = cataloghi["elementi"]
+modello_grata_combinato = cataloghi["modello_grata_combinato"]
 
 # Variabili globali per i valori predefiniti
 colore_infissi_generale = "STANDARD RAL"  # Valore predefinito per il colore
 traverso_inferiore_generale = "ANTA A GIRO"  # Valore predefinito per anta a giro posizione
 maniglia_ribassata_generale = "NO"  # Valore predefinito per maniglia ribassata
 
+# Gruppi di colonne usati per colorare le righe: tag -> (prima, ultima colonna), indici da 0
+GRUPPI_TAG = {gruppo["tag"]: (gruppo["inizio"], gruppo["fine"]) for gruppo in GRUPPI.values()}
+
 
 class PosizioniFrame(ttk.Frame):
+    # Cartella dei giornali delle posizioni (il benchmark ne usa una temporanea)
+    cartella_giornale = CARTELLA_GIORNALI
+
     def __init__(self, parent=None, preventivo=None, app=None, *args, **kwargs):
         """
         Inizializza il modulo posizioni.
@@ -38,45 +49,32 @@ class PosizioniFrame(ttk.Frame):
         self.dataframe = elementi
         
         # Ottieni i valori unici dalla colonna "TIPOLOGIA COMPLETA DI APERTURA"
-        self.serramento_values = sorted(self.dataframe["TIPOLOGIA COMPLETA DI APERTURA"].unique())
+        self.serramento_values = sorted(indice_elementi.chiavi())
         
         # Carica i valori per il campo "Tipo telaio" dal file Excel
         self.telaio_values = self.load_telaio_values()
         
-        # Definisci le colonne
-        self.colonne = [
-            "Pos.", "nr. pezzi", "Serramento", "Modello", "Modello grata combinato", 
-            "Colore", "L (mm)", "H (mm)", "Tipo telaio", "BUNK", "Dmcp / Scp", 
-            "Defender", "Dist.", "Tipo dist.", "L (mm) dist.", "H (mm) dist.", 
-            "Tipologia controtelaio", "Anta a giro posizione", "M.rib.",
-            "N.ANTE", "AP.", "TIP.", "DESCR.TIP", "N.CERN.", "XLAV", "MULT.",
-            "COSTO MLT", "MIN.1", "MIN.2", "MIN.3", "MIN.4", "MIN.5",
-            "P.SERR.", "N.STAFF.",
-            # Nuove colonne dopo N.STAFF.
-            "Sconto 1", "Sconto 2", "Sconto 3", "Sconto in decimali", "Dicitura sconto",
-            "Prezzo_listino",
-            # AGGIUNTA
-            "MqR", "MIR", "Tabella_minimi", "Unita_di_misura", "Min_fatt_pz", "Mq_fatt_pz",
-            "Mq_totali_fatt", "Ml_totali_fatt",
-            # Nuove colonne calcolate automaticamente
-            "Costo_scontato_Mq", "Prezzo_listino_unitario", "Costo_serramento_listino_posizione", "Costo_serramento_scontato_posizione",
-            # Nuovi campi per distanziali/imbotti
-            "Distanziali/Imbotti", "Tipo distanziali/imbotti", "Dicitura distanziale/imbotte", 
-            "Ml Distanziali", "Ml Imbotti", "Colore dist/imb", "Tip. dist/imb",
-            # Nuove colonne per distanziali/imbotti richieste
-            "Ml Distanziali Standard Ral", "Ml Distanziali Effetto legno", "Ml Distanziali grezzo",
-            "Ml imbotti Standard Ral", "Ml imbotti Effetto legno", "Ml imbotti grezzo",
-            "Costo al Ml", "Costo List Dist", "Costo List Imb", "Somma Cost listino dist + imbotte",
-            "Costo scontato somma dist/imb posizione", "N. distanziali a 3 lati", "Ml totali Dist/imb",
-            # Nuove colonne per controtelai
-            "Costo al ml controtelaio singolo", "Verifica controtelaio", "Tipologia ml/nr. Pezzi",
-            "Fattore moltiplicatore ml/nr. Pezzi", "Costo listino per posizione controtelaio",
-            "Costo scontato controtelaio posizione", "N. Controtelai singoli", "ML Controtelaio singolo",
-            "Costo Controtelaio singolo", "N. Controtelai doppi", "ML Controtelaio doppio",
-            "Costo Controtelaio doppio", "N. Controtelaio termico TIP A",
-            "Costo listino controtelaio termico TIP A", "N. Controtelaio termico TIP B",
-            "Costo listino controtelaio termico TIP B"
-        ]
+        # Definisci le colonne (condivise con il motore prezzi)
+        self.colonne = list(COLONNE)
+        
+        # Dati tipizzati delle righe (item id del treeview -> Posizione): il treeview è solo la vista
+        self.posizioni = {}
+        # Tag dei gruppi di colonne di ogni riga, ricalcolati solo quando la riga cambia
+        self.tag_posizioni = {}
+        # Versione di ogni riga (item id -> numero), cambia a ogni modifica dei dati della riga: i calcoli in
+        # background scartano le righe la cui versione non è più quella dell'istantanea. La rinumerazione non
+        # conta: Pos. non entra nei calcoli e viene riportato sul record calcolato
+        self.versioni_posizioni = {}
+        self._ultima_versione = 0
+        
+        # Righe del treeview (item id) i cui campi derivati vanno ricalcolati
+        self.righe_da_ricalcolare = set()
+        
+        # Giornale delle operazioni sulle posizioni, per il ripristino dopo un'uscita anomala
+        self.giornale = GiornalePosizioni(self._chiave_giornale(), self.cartella_giornale)
+        
+        # Ricalcoli di molte righe su un thread di lavoro, con indicatore di avanzamento
+        self.calcoli = CalcoliInBackground(self, al_cambio_stato=self._mostra_avanzamento_calcoli)
         
         # Configura il layout principale
         self.pack_propagate(False)  # Impedisce al frame di ridimensionarsi in base ai contenuti
@@ -97,6 +95,14 @@ class PosizioniFrame(ttk.Frame):
         # --- Pulsante Salva Preventivo ---
         self.save_button = tk.Button(add_button_frame, text="Salva preventivo", command=self._salva_preventivo_menu, bg="blue", fg="white", padx=10, pady=5)
         self.save_button.pack(side="left", padx=5)
+
+        # --- Pulsante Ricalcola tutto: unico punto in cui si ricalcolano tutte le righe ---
+        self.ricalcola_button = tk.Button(add_button_frame, text="Ricalcola tutto", command=self.ricalcola_tutto, padx=10, pady=5)
+        self.ricalcola_button.pack(side="left", padx=5)
+        
+        # Indicatore dei ricalcoli in background: visibile solo mentre un ricalcolo è in corso
+        self.calcolo_progress = ttk.Progressbar(add_button_frame, mode="indeterminate", length=120)
+        self.calcolo_label = tk.Label(add_button_frame, text="Ricalcolo in corso...")
         
         # Creo il menu contestuale
         self.context_menu = tk.Menu(self, tearoff=0)
@@ -400,11 +406,11 @@ class PosizioniFrame(ttk.Frame):
         vsb = ttk.Scrollbar(tree_frame, orient="vertical")
         
         # Crea il Treeview
-        self.tree = ttk.Treeview(tree_frame, columns=self.colonne, show="headings",
-                                yscrollcommand=vsb.set)
+        self.tree = ttk.Treeview(tree_frame, columns=self.colonne, show="headings")
         
-        # Configura le scrollbar
-        vsb.config(command=self.tree.yview)
+        # Tabella virtuale: il Treeview contiene solo le righe visibili, la scrollbar scorre l'archivio
+        self.tabella = TabellaVirtuale(self.tree, vsb, lambda item: self.posizioni[item].formattati(),
+                                       tag_riga=lambda item: self.tag_posizioni.get(item, ()))
         
         # Posiziona le scrollbar e il Treeview
         vsb.pack(side="right", fill="y")
@@ -440,29 +446,28 @@ class PosizioniFrame(ttk.Frame):
         # Aggiunta la logica per aggiornare dinamicamente la variabile globale colore_infissi_generale e la combobox 'Colore' in base alla selezione del campo 'Colore Infissi' da ModuloB2Frame
         self.aggiorna_colore_infissi_generale()
         
-        # Dopo aver creato l'interfaccia, carica i dati dal preventivo se presenti
-        self.aggiorna_da_preventivo()
+        # Dopo aver creato l'interfaccia, carica i dati dal preventivo se presenti; se il giornale
+        # contiene le posizioni di una sessione non chiusa correttamente, propone di ripristinarle
+        righe_giornale = self.leggi_giornale()
+        if righe_giornale and messagebox.askyesno(
+                "Ripristino posizioni",
+                f"Sono state trovate {len(righe_giornale)} posizioni di una sessione non chiusa correttamente.\n"
+                "Vuoi ripristinarle?"):
+            self.ripristina_da_giornale(righe_giornale)
+        else:
+            self.aggiorna_da_preventivo()
         
-        # --- PATCH: contatore posizione ---
-        self.pos_counter = 1  # Contatore posizione, parte da 1
-        # --- FINE PATCH ---
+        # Contatore posizione: sempre numero di righe + 1 (parte da 1 con tabella vuota)
+        self.aggiorna_contatore_posizione()
         
         self.bind_treeview_column_resize()
         
         # --- INIZIO INTESTAZIONE PERSONALIZZATA CONTROTELAI ---
-        print("[DEBUG] Inizio creazione header di gruppo Controtelaio")
+        log.debug("Inizio creazione header di gruppo Controtelaio")
         
-        try:
-            # Indici delle colonne controtelai
-            col_start = self.colonne.index("Costo al ml controtelaio singolo")
-            col_end = self.colonne.index("Costo listino controtelaio termico TIP B")
-            print(f"[DEBUG] Colonne trovate: start={col_start}, end={col_end}")
-            print(f"[DEBUG] Nome colonna start: {self.colonne[col_start]}")
-            print(f"[DEBUG] Nome colonna end: {self.colonne[col_end]}")
-        except ValueError as e:
-            print(f"[DEBUG] Errore nel trovare le colonne: {e}")
-            print(f"[DEBUG] Colonne disponibili: {self.colonne}")
-            return
+        # Indici delle colonne controtelai (dallo schema della tabella)
+        col_start = GRUPPI["Controtelai"]["inizio"]
+        col_end = GRUPPI["Controtelai"]["fine"]
         
         # --- CONFIGURAZIONE HEADER PERSONALIZZATI ---
         # Crea il frame per gli header
@@ -473,70 +478,46 @@ class PosizioniFrame(ttk.Frame):
         self.header_canvas = tk.Canvas(self.header_frame, height=30, bg="white", highlightthickness=0)
         self.header_canvas.pack(side="top", fill="x")
         
-        # Definizione dei gruppi di colonne con i colori
+        # Gruppi di colonne con i colori, ricavati dallo schema (colonne numerate da 1)
         self.group_headers = {
-            "Righe inserite": {
-                "start_col": 1,
-                "end_col": 19,
-                "bg_color": "#F5F5F5",
-                "text_color": "#000000"
-            },
-            "Calcoli": {
-                "start_col": 20,
-                "end_col": 52,
-                "bg_color": "#E0E0E0",
-                "text_color": "#000000"
-            },
-            "Distanziale/Imbotte": {
-                "start_col": 53,
-                "end_col": 72,
-                "bg_color": "#C8E6C9",
-                "text_color": "#000000"
-            },
-            "Controtelai": {
-                "start_col": 73,
-                "end_col": 88,
-                "bg_color": "#FFD580",
-                "text_color": "#000000"
+            nome: {
+                "start_col": gruppo["inizio"] + 1,
+                "end_col": gruppo["fine"] + 1,
+                "bg_color": gruppo["bg_color"],
+                "text_color": gruppo["text_color"]
             }
+            for nome, gruppo in GRUPPI.items()
         }
         
+        # Renderer degli header: offset delle colonne in cache e ridisegni accorpati
+        self.intestazioni = IntestazioniGruppi(self.header_canvas, self.tree, self.group_headers)
+        
         # Configura la scrollbar orizzontale del treeview
         self.tree_scrollbar = ttk.Scrollbar(self, orient="horizontal", command=self.tree.xview)
         self.tree_scrollbar.pack(side="bottom", fill="x")
         
-        # Configura la sincronizzazione dello scroll
+        # Configura la sincronizzazione dello scroll: gli header vengono solo spostati
         def on_treeview_scroll(*args):
-            self.draw_custom_headers()
+            self.intestazioni.scorri()
             self.tree_scrollbar.set(*args)
         
-        # Associa l'evento di scroll del treeview
+        # Associa l'evento di scroll del treeview (copre anche frecce, rotella e trascinamento)
         self.tree.configure(xscrollcommand=on_treeview_scroll)
         
-        # Aggiorna gli header quando il treeview viene ridimensionato o scrollato
-        self.tree.bind('<Configure>', lambda e: self.draw_custom_headers())
-        self.tree.bind('<B2-Motion>', lambda e: self.draw_custom_headers())  # Scrolling con il mouse
-        self.tree.bind('<Button-4>', lambda e: self.draw_custom_headers())   # Scrolling con la rotella
-        self.tree.bind('<Button-5>', lambda e: self.draw_custom_headers())   # Scrolling con la rotella
-        self.tree.bind('<Left>', lambda e: self.draw_custom_headers())       # Tasto freccia sinistra
-        self.tree.bind('<Right>', lambda e: self.draw_custom_headers())      # Tasto freccia destra
-        
-        # Aggiungi binding per il ridimensionamento delle colonne
-        def on_column_resize(event):
-            self.draw_custom_headers()
+        # Ridimensionamento del treeview o delle colonne: le larghezze vanno rilette
+        self.tree.bind('<Configure>', lambda e: self.intestazioni.invalida(), add='+')
+        self.tree.bind('<B1-Motion>', lambda e: self.intestazioni.invalida(), add='+')
         
-        # Associa l'evento di ridimensionamento a tutte le colonne
         for col in self.colonne:
             self.tree.heading(col, command=lambda c=col: None)  # Rimuovi il comando di ordinamento
             self.tree.column(col, width=100)  # Imposta una larghezza iniziale
             self.tree.column(col, stretch=True)  # Permetti lo stretching
-            self.tree.bind(f'<Configure>', on_column_resize, add='+')
         
-        print("[DEBUG] Binding eventi impostato")
+        log.debug("Binding eventi impostato")
         
         # Disegna gli header iniziali dopo un breve ritardo per assicurarsi che il treeview sia configurato
-        self.after(100, self.draw_custom_headers)
-        print("[DEBUG] Header iniziali programmati")
+        self.after(100, self.intestazioni.invalida)
+        log.debug("Header iniziali programmati")
         # --- FINE INTESTAZIONE PERSONALIZZATA CONTROTELAI ---
         # Colora le intestazioni delle colonne controtelai
         style = ttk.Style()
@@ -545,15 +526,6 @@ class PosizioniFrame(ttk.Frame):
             if col_start <= i <= col_end:
                 style.configure(f"Treeview.Heading.{col}", background="#FFF8E1", foreground="#b36b00")
                 self.tree.heading(col, text=col)
-        # Colora le celle delle colonne controtelai (solo visualizzazione, non editing)
-        def tag_controtelai():
-            for item in self.tree.get_children():
-                for i in range(col_start, col_end+1):
-                    self.tree.tag_configure('controtelai', background="#FFF8E1")
-                    self.tree.item(item, tags=('controtelai',))
-        self.tree.bind('<<TreeviewSelect>>', lambda e: tag_controtelai())
-        tag_controtelai()
-        
         # Rimuovi la scrollbar orizzontale dal frame "Righe inserite"
         for widget in self.winfo_children():
             if isinstance(widget, ttk.Frame):
@@ -561,58 +533,19 @@ class PosizioniFrame(ttk.Frame):
                     if isinstance(child, ttk.Scrollbar) and child.cget('orient') == 'horizontal':
                         child.pack_forget()
         
-        # Colora le celle delle colonne in base al gruppo di appartenenza
-        # Definisci i gruppi e i loro colori
-        group_column_ranges = {
-            'righe_inserite': (self.group_headers['Righe inserite']['start_col']-1, self.group_headers['Righe inserite']['end_col']-1),
-            'calcoli': (self.group_headers['Calcoli']['start_col']-1, self.group_headers['Calcoli']['end_col']-1),
-            'distanziali': (self.group_headers['Distanziale/Imbotte']['start_col']-1, self.group_headers['Distanziale/Imbotte']['end_col']-1),
-            'controtelai': (self.group_headers['Controtelai']['start_col']-1, self.group_headers['Controtelai']['end_col']-1),
-        }
-        group_colors = {
-            'righe_inserite': self.group_headers['Righe inserite']['bg_color'],
-            'calcoli': self.group_headers['Calcoli']['bg_color'],
-            'distanziali': self.group_headers['Distanziale/Imbotte']['bg_color'],
-            'controtelai': self.group_headers['Controtelai']['bg_color'],
-        }
+        # Colora le righe in base ai gruppi di colonne valorizzati: i tag di ogni riga sono
+        # calcolati una sola volta quando cambiano i suoi valori (vedi _tag_gruppi), non a ogni selezione
+        group_colors = {gruppo["tag"]: gruppo["bg_color"] for gruppo in GRUPPI.values()}
         # Configura i tag per ogni gruppo
         for group, color in group_colors.items():
             self.tree.tag_configure(group, background=color)
         
-        def color_group_cells():
-            for item in self.tree.get_children():
-                values = self.tree.item(item, 'values')
-                tags = []
-                # Applica i tag ai gruppi di colonne
-                for group, (start, end) in group_column_ranges.items():
-                    # Se almeno una colonna del gruppo ha un valore, applica il tag
-                    if any(values[i] for i in range(start, end+1) if i < len(values)):
-                        tags.append(group)
-                self.tree.item(item, tags=tags)
-        self.tree.bind('<<TreeviewSelect>>', lambda e: color_group_cells())
-        color_group_cells()
-        
     def load_telaio_values(self):
-        """Carica i valori per il campo 'Tipo telaio' dal file Excel."""
-        try:
-            # Percorso del file Excel
-            excel_path = os.path.join("data", "database_gestionale.xlsx")
-            
-            # Carica il foglio "telaio"
-            wb = openpyxl.load_workbook(excel_path)
-            sheet = wb["telaio"]
-            
-            # Estrai i valori dalla colonna A (dalla riga 2 alla 130)
-            values = []
-            for row in range(2, 131):
-                cell_value = sheet.cell(row=row, column=1).value
-                if cell_value:
-                    values.append(cell_value)
-            
-            return values
-        except Exception as e:
-            print(f"Errore nel caricamento dei valori del telaio: {e}")
-            return []
+        """
+        Valori per il campo 'Tipo telaio' (foglio telaio di data/database_gestionale.xlsx).
+        Letti una volta per processo; il workbook viene riletto solo se è cambiato su disco.
+        """
+        return list(valori_telaio())
 
     def update_combobox_values(self):
         """Aggiorna i valori delle combobox con i dati dai DataFrame."""
@@ -627,24 +560,24 @@ class PosizioniFrame(ttk.Frame):
         
         # Modello
         try:
-            if 'listino' in globals() and isinstance(listino, pd.DataFrame) and "MODELLO" in listino.columns:
-                self.modello_combobox['values'] = list(listino["MODELLO"].unique())
+            if len(indice_listino):
+                self.modello_combobox['values'] = indice_listino.chiavi()
             else:
                 self.modello_combobox['values'] = []
         except Exception as e:
-            print(f"Errore nell'aggiornamento dei valori del modello: {e}")
+            log.error("Errore nell'aggiornamento dei valori del modello: %s", e)
             self.modello_combobox['values'] = []
         
         # Modello grata combinato
         try:
-            if 'modello_grata_combinato' in globals() and isinstance(modello_grata_combinato, pd.DataFrame):
+            if isinstance(modello_grata_combinato, pd.DataFrame):
                 # Assumo che il DataFrame abbia una colonna con i modelli
                 first_col = modello_grata_combinato.columns[0]
                 self.modello_grata_combobox['values'] = list(modello_grata_combinato[first_col].unique())
             else:
                 self.modello_grata_combobox['values'] = []
         except Exception as e:
-            print(f"Errore nell'aggiornamento dei valori del modello grata combinato: {e}")
+            log.error("Errore nell'aggiornamento dei valori del modello grata combinato: %s", e)
             self.modello_grata_combobox['values'] = []
 
     def on_modello_selected(self, event=None):
@@ -742,25 +675,25 @@ class PosizioniFrame(ttk.Frame):
         """
         serramento_selezionato = self.serramento_combobox.get()
         if serramento_selezionato and self.dataframe is not None:
-            # Trova la riga corrispondente nel DataFrame
-            riga = self.dataframe[self.dataframe.iloc[:, 0] == serramento_selezionato]
-            if not riga.empty:
-                # Estrai i valori dalle colonne del DataFrame
-                numero_ante = riga["NUMERO ANTE"].values[0] if "NUMERO ANTE" in riga else ""
-                apertura = riga["APERTURA"].values[0] if "APERTURA" in riga else ""
-                tipologia = riga["TIPOLOGIA"].values[0] if "TIPOLOGIA" in riga else ""
-                descrizione_tipologia = riga["DESCRIZIONE TIPOLOGIA"].values[0] if "DESCRIZIONE TIPOLOGIA" in riga else ""
-                n_cerniere = riga["N. CERNIERE"].values[0] if "N. CERNIERE" in riga else ""
-                extra_lavorazione = riga["EXTRA LAVORAZIONE"].values[0] if "EXTRA LAVORAZIONE" in riga else ""
-                multiplo = riga["MULTIPLO"].values[0] if "MULTIPLO" in riga else ""
-                costo_multiplo = riga["COSTO MULTIPLO"].values[0] if "COSTO MULTIPLO" in riga else ""
-                minimi_1 = riga["MINIMI 1 (protezione singola)"].values[0] if "MINIMI 1 (protezione singola)" in riga else ""
-                minimi_2 = riga["MINIMI 2 (snodo)"].values[0] if "MINIMI 2 (snodo)" in riga else ""
-                minimi_3 = riga["MINIMI 3 (combinati)"].values[0] if "MINIMI 3 (combinati)" in riga else ""
-                minimi_4 = riga["MINIMI 4"].values[0] if "MINIMI 4" in riga else ""
-                minimi_5 = riga["MINIMI 5"].values[0] if "MINIMI 5" in riga else ""
-                presenza_serratura = riga["Presenza serratura"].values[0] if "Presenza serratura" in riga else ""
-                numero_staffette = riga["Numero staffette"].values[0] if "Numero staffette" in riga else ""
+            # Ricerca O(1) nell'indice del catalogo elementi
+            riga = indice_elementi.riga(serramento_selezionato)
+            if riga is not None:
+                # Estrai i valori dalle colonne del catalogo
+                numero_ante = indice_elementi.valore(serramento_selezionato, "NUMERO ANTE")
+                apertura = indice_elementi.valore(serramento_selezionato, "APERTURA")
+                tipologia = indice_elementi.valore(serramento_selezionato, "TIPOLOGIA")
+                descrizione_tipologia = indice_elementi.valore(serramento_selezionato, "DESCRIZIONE TIPOLOGIA")
+                n_cerniere = indice_elementi.valore(serramento_selezionato, "N. CERNIERE")
+                extra_lavorazione = indice_elementi.valore(serramento_selezionato, "EXTRA LAVORAZIONE")
+                multiplo = indice_elementi.valore(serramento_selezionato, "MULTIPLO")
+                costo_multiplo = indice_elementi.valore(serramento_selezionato, "COSTO MULTIPLO")
+                minimi_1 = indice_elementi.valore(serramento_selezionato, "MINIMI 1 (protezione singola)")
+                minimi_2 = indice_elementi.valore(serramento_selezionato, "MINIMI 2 (snodo)")
+                minimi_3 = indice_elementi.valore(serramento_selezionato, "MINIMI 3 (combinati)")
+                minimi_4 = indice_elementi.valore(serramento_selezionato, "MINIMI 4")
+                minimi_5 = indice_elementi.valore(serramento_selezionato, "MINIMI 5")
+                presenza_serratura = indice_elementi.valore(serramento_selezionato, "Presenza serratura")
+                numero_staffette = indice_elementi.valore(serramento_selezionato, "Numero staffette")
                 
                 # Popola i campi aggiuntivi con i valori estratti
                 self.numero_ante_label.config(text=str(numero_ante))
@@ -843,435 +776,61 @@ class PosizioniFrame(ttk.Frame):
             messagebox.showerror("Errore", "I campi 'nr. pezzi' e 'Serramento' sono obbligatori.")
             return
         
-        # Il numero di posizione è sempre il prossimo valore libero
-        pos = self.pos_counter
-        
-        # Recupera i valori dei campi aggiuntivi
-        modello = self.modello_combobox.get()
-        modello_grata_combinato = self.modello_grata_combobox.get()
-        colore = self.colore_combobox.get()
-        l_mm = self.l_mm_entry.get()
-        h_mm = self.h_mm_entry.get()
-        tipo_telaio = self.tipo_telaio_combobox.get()
-        bunk = self.bunk_combobox.get()
-        dmcp = self.dmcp_combobox.get()
-        defender = self.defender_combobox.get()
-        dist = self.dist_combobox.get()
-        tipo_dist = self.tipo_dist_combobox.get()
-        l_dist = self.l_dist_entry.get()
-        h_dist = self.h_dist_entry.get()
-        tipo_controtelaio = self.tipo_controtelaio_combobox.get()
-        anta_giro = self.anta_giro_combobox.get()
-        mrib = self.mrib_combobox.get()
-        
-        # Recupera i valori dei campi aggiuntivi dal serramento
-        numero_ante = self.numero_ante_label.cget("text")
-        apertura = self.apertura_label.cget("text")
-        tipologia = self.tipologia_label.cget("text")
-        descrizione_tipologia = self.descrizione_tipologia_label.cget("text")
-        n_cerniere = self.n_cerniere_label.cget("text")
-        extra_lavorazione = self.extra_lavorazione_label.cget("text")
-        multiplo = self.multiplo_label.cget("text")
-        costo_multiplo = self.costo_multiplo_label.cget("text")
-        minimi_1 = self.minimi_1_label.cget("text")
-        minimi_2 = self.minimi_2_label.cget("text")
-        minimi_3 = self.minimi_3_label.cget("text")
-        minimi_4 = self.minimi_4_label.cget("text")
-        minimi_5 = self.minimi_5_label.cget("text")
-        presenza_serratura = self.presenza_serratura_label.cget("text")
-        numero_staffette = self.numero_staffette_label.cget("text")
-        
-        # Calcolo MqR e MIR
-        try:
-            l_val = float(l_mm.replace(",", ".")) if l_mm else 0.0
-            h_val = float(h_mm.replace(",", ".")) if h_mm else 0.0
-        except Exception:
-            l_val = 0.0
-            h_val = 0.0
-        mqr = f"{round(l_val * h_val * 0.000001, 2):.2f}".replace('.', ',')
-        mir = f"{round((l_val + 2 * h_val) * 0.001, 2):.2f}".replace('.', ',')
-        
-        # Calcolo Tabella_minimi
-        tabella_minimi = ""
-        try:
-            if modello:
-                minimi_row = listino.loc[listino["MODELLO"] == modello]
-                if not minimi_row.empty:
-                    # Prova a recuperare la colonna corretta tra le possibili varianti
-                    possible_minimi_cols = [
-                        "Minimi",
-                        "MINIMI 1 (protezione singola)",
-                        "MINIMI 1",
-                        "MINIMI",
-                        "Minimi 1",
-                        "MINIMI_1",
-                    ]
-                    found = False
-                    for col in possible_minimi_cols:
-                        if col in minimi_row.columns:
-                            tabella_minimi = str(minimi_row.iloc[0][col])
-                            found = True
-                            break
-                    if not found:
-                        # Debug: colonna non trovata
-                        print(f"[DEBUG] Nessuna colonna minimi trovata tra {possible_minimi_cols} per modello {modello}")
-                        tabella_minimi = ""
-                else:
-                    print(f"[DEBUG] Nessuna riga in listino per modello: {modello}")
-        except Exception as e:
-            print(f"[DEBUG] Errore durante il recupero di Tabella_minimi: {e}")
-            tabella_minimi = ""
-        
-        # Calcolo dinamico Unita_di_misura dal listino
-        unita_di_misura = ""
-        try:
-            if modello:
-                riga = listino[listino['MODELLO'] == modello]
-                if not riga.empty:
-                    # Sostituisci la chiave 'Unità misura' o simili con 'Unita_di_misura' senza accento
-                    for col in riga.columns:
-                        if col.lower().replace('à','a').replace(' ','_') == 'unita_di_misura':
-                            unita_di_misura = riga.iloc[0][col]
-                            break
-        except Exception as e:
-            unita_di_misura = f"Errore: {e}"
-        
-        # Calcolo Prezzo_listino
-        prezzo_listino = ""
-        try:
-            if modello and colore:
-                row = listino[listino['MODELLO'] == modello]
-                if not row.empty and colore in listino.columns:
-                    prezzo = row.iloc[0][colore]
-                    if pd.notnull(prezzo):
-                        try:
-                            prezzo_float = float(prezzo)
-                            prezzo_listino = f"€ {prezzo_float:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-                        except Exception:
-                            prezzo_listino = f"€ {prezzo},00"
-        except Exception:
-            pass
-        
-        # --- POPOLAMENTO AUTOMATICO CAMPI SCONTO E CALCOLATI ---
-        # Recupera i valori degli sconti dal preventivo se disponibili
-        sconto_1 = sconto_2 = sconto_3 = sconto_decimali = dicitura_sconto = ""
-        if self.preventivo and hasattr(self.preventivo, 'dati_b1'):
-            dati_b1 = self.preventivo.dati_b1
-            def get_sconto_value(dati_b1, *keys):
-                for k in keys:
-                    if k in dati_b1:
-                        return dati_b1[k]
-                return ""
-            sconto_1 = get_sconto_value(dati_b1, 'Sconto 1', 'Sconto1')
-            sconto_2 = get_sconto_value(dati_b1, 'Sconto 2', 'Sconto2')
-            sconto_3 = get_sconto_value(dati_b1, 'Sconto 3', 'Sconto3')
-            sconto_decimali = get_sconto_value(dati_b1, 'Sconto in decimali', 'Sconto_in_decimali')
-            dicitura_sconto = get_sconto_value(dati_b1, 'Dicitura sconto', 'Dicitura_sconto')
-        # Calcolo Min_fatt_pz
-        min_fatt_pz = ""
-        try:
-            tabella_val = tabella_minimi.strip()
-            tab_min = int(tabella_val) if tabella_val.isdigit() else None
-            minimi = [minimi_1, minimi_2, minimi_3, minimi_4, minimi_5]
-            if tab_min and 1 <= tab_min <= 5:
-                min_fatt_pz = minimi[tab_min-1]
-        except Exception:
-            min_fatt_pz = ""
-        # Calcolo Mq_fatt_pz
-        try:
-            mqr_float = float(mqr.replace(",", ".")) if mqr else 0.0
-            min_fatt_pz_float = float(min_fatt_pz.replace(",", ".")) if min_fatt_pz else 0.0
-            mq_fatt_pz = max(mqr_float, min_fatt_pz_float)
-            mq_fatt_pz_str = f"{mq_fatt_pz:.2f}".replace('.', ',')
-        except Exception:
-            mq_fatt_pz_str = ""
-        # Calcolo Mq_totali_fatt
-        try:
-            mq_totali_fatt = mq_fatt_pz * float(nr_pezzi.replace(",", ".")) if mq_fatt_pz_str and nr_pezzi else 0.0
-            mq_totali_fatt_str = f"{mq_totali_fatt:.2f}".replace('.', ',')
-        except Exception:
-            mq_totali_fatt_str = ""
-        # Calcolo Ml_totali_fatt
-        try:
-            mir_float = float(mir.replace(",", ".")) if mir else 0.0
-            ml_totali_fatt = mir_float * float(nr_pezzi.replace(",", ".")) if mir and nr_pezzi else 0.0
-            ml_totali_fatt_str = f"{ml_totali_fatt:.2f}".replace('.', ',')
-        except Exception:
-            ml_totali_fatt_str = ""
-        # Calcolo dei campi di costo
-        try:
-            # Estrai il valore numerico dal prezzo listino
-            prezzo_listino_val = prezzo_listino
-            if isinstance(prezzo_listino_val, str):
-                # Prendi solo la parte numerica (gestione "€" e formati)
-                import re
-                match = re.search(r"([\d.,]+)", prezzo_listino_val)
-                if match:
-                    prezzo_listino_val = match.group(1).replace(".", "").replace(",", ".")
-                else:
-                    prezzo_listino_val = "0"
-            try:
-                prezzo_listino_float = float(prezzo_listino_val)
-            except Exception:
-                prezzo_listino_float = 0.0
-                
-            # Gestione sconto in decimali
-            sconto_decimali_val = sconto_decimali.strip().replace("%", "") if sconto_decimali else "0"
-            sconto_decimali_val = sconto_decimali_val.replace(",", ".")
-            try:
-                sconto_decimali_float = float(sconto_decimali_val)
-                if sconto_decimali_float > 1:
-                    sconto_decimali_float = sconto_decimali_float / 100.0
-            except Exception:
-                sconto_decimali_float = 0.0
-                
-            # Conversione mq_fatt_pz
-            mq_fatt_pz_val = mq_fatt_pz_str.replace(",", ".") if isinstance(mq_fatt_pz_str, str) else "0"
-            try:
-                mq_fatt_pz_float = float(mq_fatt_pz_val)
-            except Exception:
-                mq_fatt_pz_float = 0.0
-                
-            # Conversione mq_totali_fatt
-            mq_totali_fatt_val = mq_totali_fatt_str.replace(",", ".") if isinstance(mq_totali_fatt_str, str) else "0"
-            try:
-                mq_totali_fatt_float = float(mq_totali_fatt_val)
-            except Exception:
-                mq_totali_fatt_float = 0.0
-
-            # Calcolo dei valori
-            costo_scontato_mq_float = prezzo_listino_float * (1 - sconto_decimali_float)
-            prezzo_listino_unitario_float = prezzo_listino_float * mq_fatt_pz_float
-            costo_serramento_listino_posizione_float = prezzo_listino_float * mq_totali_fatt_float
-            costo_serramento_scontato_posizione_float = costo_scontato_mq_float * mq_totali_fatt_float
-
-            # Formattazione in euro
-            def euro(val):
-                return f"€ {val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") if val else ""
-                
-            costo_scontato_mq = euro(costo_scontato_mq_float)
-            prezzo_listino_unitario = euro(prezzo_listino_unitario_float)
-            costo_serramento_listino_posizione = euro(costo_serramento_listino_posizione_float)
-            costo_serramento_scontato_posizione = euro(costo_serramento_scontato_posizione_float)
-            
-        except Exception as e:
-            print(f"[DEBUG] Errore nel calcolo dei campi di costo: {e}")
-            costo_scontato_mq = ""
-            prezzo_listino_unitario = ""
-            costo_serramento_listino_posizione = ""
-            costo_serramento_scontato_posizione = ""
-            
-        # Calcolo dei nuovi campi per distanziali/imbotti
-        # Campo "Distanziali/Imbotti" = SE(O([Dist.]=="",[Dist.]=="NO"),0,1)
-        distanziali_imbotti = "0"
-        if dist and dist != "NO":
-            distanziali_imbotti = "1"
-            
-        # Calcolo del campo "Tipo distanziali/imbotti" in base al valore di "Tipo dist."
-        # =SE([@[Tipo dist.]]="IMBOTTE";2;SE([@[Tipo dist.]]="SALDATO";3;1))
-        tipo_distanziali_imbotti = "1"  # Valore predefinito
-        if tipo_dist == "IMBOTTE":
-            tipo_distanziali_imbotti = "2"
-        elif tipo_dist == "SALDATO":
-            tipo_distanziali_imbotti = "3"
-            
-        # Calcolo del campo "Dicitura distanziale/imbotte" in base al valore di "Tipo distanziali/imbotti"
-        # =SE([@[Tipo distanziali/imbotti]]=3;"DS - SALDATO";SE([@[Tipo distanziali/imbotti]]=2;"I - IMBOTTE";""))
-        dicitura_distanziale_imbotte = ""
-        if tipo_distanziali_imbotti == "3":
-            dicitura_distanziale_imbotte = "DS - SALDATO"
-        elif tipo_distanziali_imbotti == "2":
-            dicitura_distanziale_imbotte = "I - IMBOTTE"
-            
-        # Altri campi per distanziali/imbotti (inizialmente vuoti)
-        ml_distanziali = ""
-        ml_imbotti = ""
-        # --- LOGICA COLORE DIST/IMB ---
-        colore_dist_imb = ""
-        if colore == "STANDARD RAL":
-            colore_dist_imb = "1"
-        elif colore == "EFFETTO LEGNO":
-            colore_dist_imb = "2"
-        elif colore == "GREZZO":
-            colore_dist_imb = "3"
-        elif colore == "EXTRA MAZZETTA":
-            colore_dist_imb = "4"
-        # --- FINE LOGICA COLORE DIST/IMB ---
-        tip_dist_imb = ""
-        
-        # Calcolo del campo "N. distanziali a 3 lati" in base al valore di "Distanziali/Imbotti" e "nr. pezzi"
-        # =SE([@[Distanziali/Imbotti]]=1;[@[nr. pezzi]]*3;"")
-        n_distanziali_a_3_lati = ""
-        if distanziali_imbotti == "1":
-            try:
-                n_pezzi_val = float(nr_pezzi.replace(",", ".")) if nr_pezzi else 0
-                n_distanziali_a_3_lati = str(int(n_pezzi_val * 3))
-            except (ValueError, TypeError):
-                n_distanziali_a_3_lati = ""
-                
-        # Campi aggiuntivi per distanziali/imbotti (inizialmente vuoti)
-        ml_distanziali_standard_ral = ""
-        ml_distanziali_effetto_legno = ""
-        ml_distanziali_grezzo = ""
-        ml_imbotti_standard_ral = ""
-        ml_imbotti_effetto_legno = ""
-        ml_imbotti_grezzo = ""
-        costo_al_ml = ""
-        costo_list_dist = ""
-        costo_list_imb = ""
-        somma_cost_listino_dist_imbotte = ""
-        costo_scontato_somma_dist_imb_posizione = ""
-        ml_totali_dist_imb = ""
-
-        # Calcolo del costo al ml controtelaio singolo
-        costo_ml_controtelaio_singolo = ""
-        try:
-            if tipo_controtelaio:
-                row = controtelaio[controtelaio["CONTROTELAIO"] == tipo_controtelaio]
-                if not row.empty:
-                    costo_ml_controtelaio_singolo = row.iloc[0]["COSTO"]
-        except Exception as e:
-            print(f"[DEBUG] Errore nel calcolo costo_ml_controtelaio_singolo: {e}")
-
-        # --- AGGIORNAMENTO AUTOMATICO NUOVI CAMPI CONTROTELAI ---
-        # Verifica controtelaio
-        if tipo_controtelaio and tipo_controtelaio != "0":
-            verifica_controtelaio = "1"
-        else:
-            verifica_controtelaio = ""
-        # Tipologia ml/nr. Pezzi
-        tipologia_ml_nr_pezzi = ""
-        try:
-            if tipo_controtelaio:
-                # Assegna il valore 1 se il controtelaio è singolo o doppio
-                if tipo_controtelaio in ["C. SINGOLO", "C. DOPPIO"]:
-                    tipologia_ml_nr_pezzi = "1"
-                # Assegna il valore 2 se il controtelaio è termico TIP A o TIP B
-                elif tipo_controtelaio in ["C. TERMICO TIP A", "C. TERMICO TIP B"]:
-                    tipologia_ml_nr_pezzi = "2"
-                # Altrimenti lascia vuoto
-                else:
-                    tipologia_ml_nr_pezzi = ""
-            else:
-                # Se il campo "Tipologia controtelaio" è vuoto, lascia vuoto anche questo campo
-                tipologia_ml_nr_pezzi = ""
-        except Exception as e:
-            print(f"[DEBUG] Errore nell'aggiornamento di tipologia_ml_nr_pezzi: {e}")
-
-        # Fattore moltiplicatore ml/nr. Pezzi
-        fattore_moltiplicatore = ""
-        try:
-            if verifica_controtelaio == "1" and tipologia_ml_nr_pezzi == "1":
-                fattore_moltiplicatore = str(ml_totali_fatt)
-            else:
-                fattore_moltiplicatore = str(nr_pezzi)
-        except Exception as e:
-            print(f"[DEBUG] Errore nel calcolo del fattore moltiplicatore: {e}")
-            fattore_moltiplicatore = ""
-
-        # Costo listino per posizione controtelaio
-        costo_listino_posizione = ""
-        try:
-            if costo_ml_controtelaio_singolo and fattore_moltiplicatore:
-                # Rimuovi il simbolo dell'euro e converte in float
-                costo_ml = float(str(costo_ml_controtelaio_singolo).replace("€", "").replace(".", "").replace(",", ".").strip())
-                fattore = float(str(fattore_moltiplicatore).replace(",", ".").strip())
-                # Calcola il costo totale
-                costo_totale = costo_ml * fattore
-                # Formatta il risultato in euro
-                costo_listino_posizione = f"€ {costo_totale:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        except Exception as e:
-            print(f"[DEBUG] Errore nel calcolo del costo listino per posizione controtelaio: {e}")
-            costo_listino_posizione = ""
-
-        # Costo scontato controtelaio posizione
-        costo_scontato_posizione = ""
-        try:
-            if costo_listino_posizione and sconto_decimali:
-                # Rimuovi il simbolo dell'euro e converte in float
-                costo_listino = float(str(costo_listino_posizione).replace("€", "").replace(".", "").replace(",", ".").strip())
-                # Rimuovi il simbolo % e converte in float
-                sconto = float(str(sconto_decimali).replace("%", "").replace(",", ".").strip()) / 100
-                # Calcola il costo scontato
-                costo_scontato = costo_listino * (1 - sconto)
-                # Formatta il risultato in euro
-                costo_scontato_posizione = f"€ {costo_scontato:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        except Exception as e:
-            print(f"[DEBUG] Errore nel calcolo del costo scontato controtelaio posizione: {e}")
-            costo_scontato_posizione = ""
-
-        # N. Controtelai singoli
-        n_controtelai_singoli = "0"
-        try:
-            if tipo_controtelaio == "C. SINGOLO":
-                n_controtelai_singoli = str(nr_pezzi)
-        except Exception as e:
-            print(f"[DEBUG] Errore nel calcolo del numero controtelai singoli: {e}")
-            n_controtelai_singoli = "0"
-
-        # ML Controtelaio singolo
-        ml_controtelaio_singolo = mir if tipo_controtelaio == "C. SINGOLO" else ""
-        # Costo Controtelaio singolo
-        costo_controtelaio_singolo = costo_ml_controtelaio_singolo if tipo_controtelaio == "C. SINGOLO" else ""
-        # N. Controtelai doppi
-        n_controtelai_doppi = "1" if tipo_controtelaio == "C. DOPPIO" else "0"
-        # ML Controtelaio doppio
-        ml_controtelaio_doppio = mir if tipo_controtelaio == "C. DOPPIO" else ""
-        # Costo Controtelaio doppio
-        costo_controtelaio_doppio = costo_ml_controtelaio_singolo if tipo_controtelaio == "C. DOPPIO" else ""
-        # N. Controtelaio termico TIP A
-        n_controtelaio_termico_a = "1" if tipo_controtelaio == "C. TERMICO TIP A" else "0"
-        # Costo listino controtelaio termico TIP A
-        costo_listino_termico_a = costo_ml_controtelaio_singolo if tipo_controtelaio == "C. TERMICO TIP A" else ""
-        # N. Controtelaio termico TIP B
-        n_controtelaio_termico_b = "1" if tipo_controtelaio == "C. TERMICO TIP B" else "0"
-        # Costo listino controtelaio termico TIP B
-        costo_listino_termico_b = costo_ml_controtelaio_singolo if tipo_controtelaio == "C. TERMICO TIP B" else ""
-
-        # Inserisco i valori dei nuovi campi nella lista values
-        values = [
-            pos, nr_pezzi, serramento, modello, modello_grata_combinato, colore, l_mm, h_mm, tipo_telaio, bunk, dmcp, defender, dist, tipo_dist, l_dist, h_dist,
-            tipo_controtelaio, anta_giro, mrib, numero_ante, apertura, tipologia, descrizione_tipologia, n_cerniere, extra_lavorazione, multiplo, costo_multiplo, minimi_1, minimi_2, minimi_3, minimi_4, minimi_5, presenza_serratura, numero_staffette,
-            sconto_1, sconto_2, sconto_3, sconto_decimali, dicitura_sconto,  # <-- qui i campi sconto
-            prezzo_listino,
-            mqr, mir, tabella_minimi, unita_di_misura, min_fatt_pz, mq_fatt_pz_str, mq_totali_fatt_str, ml_totali_fatt_str,
-            costo_scontato_mq, prezzo_listino_unitario, costo_serramento_listino_posizione, costo_serramento_scontato_posizione,
-            distanziali_imbotti, tipo_distanziali_imbotti, dicitura_distanziale_imbotte, ml_distanziali, ml_imbotti, colore_dist_imb, tip_dist_imb,
-            # Nuove colonne per distanziali/imbotti richieste
-            ml_distanziali_standard_ral, ml_distanziali_effetto_legno, ml_distanziali_grezzo,
-            ml_imbotti_standard_ral, ml_imbotti_effetto_legno, ml_imbotti_grezzo,
-            costo_al_ml, costo_list_dist, costo_list_imb, somma_cost_listino_dist_imbotte,
-            costo_scontato_somma_dist_imb_posizione, n_distanziali_a_3_lati, ml_totali_dist_imb,
-            # Nuove colonne per controtelai
-            costo_ml_controtelaio_singolo, verifica_controtelaio, tipologia_ml_nr_pezzi, fattore_moltiplicatore, costo_listino_posizione, costo_scontato_posizione,
-            n_controtelai_singoli, ml_controtelaio_singolo, costo_controtelaio_singolo, n_controtelai_doppi, ml_controtelaio_doppio, costo_controtelaio_doppio,
-            n_controtelaio_termico_a, costo_listino_termico_a, n_controtelaio_termico_b, costo_listino_termico_b
-        ]
-        
-        # --- DEBUG LOG: valori inseriti in aggiungi_riga ---
-        print("[DEBUG aggiungi_riga] values:", values)
-        print(f"[DEBUG aggiungi_riga] Sconti: S1={sconto_1}, S2={sconto_2}, S3={sconto_3}, Sdec={sconto_decimali}, Dic={dicitura_sconto}")
+        # La riga va in coda: il numero di posizione è il numero di righe + 1
+        pos = len(self.tabella) + 1
+        
+        # Valori inseriti dall'utente e campi ricavati dal serramento selezionato
+        riga = {
+            "Pos.": pos,
+            "nr. pezzi": nr_pezzi,
+            "Serramento": serramento,
+            "Modello": self.modello_combobox.get(),
+            "Modello grata combinato": self.modello_grata_combobox.get(),
+            "Colore": self.colore_combobox.get(),
+            "L (mm)": self.l_mm_entry.get(),
+            "H (mm)": self.h_mm_entry.get(),
+            "Tipo telaio": self.tipo_telaio_combobox.get(),
+            "BUNK": self.bunk_combobox.get(),
+            "Dmcp / Scp": self.dmcp_combobox.get(),
+            "Defender": self.defender_combobox.get(),
+            "Dist.": self.dist_combobox.get(),
+            "Tipo dist.": self.tipo_dist_combobox.get(),
+            "L (mm) dist.": self.l_dist_entry.get(),
+            "H (mm) dist.": self.h_dist_entry.get(),
+            "Tipologia controtelaio": self.tipo_controtelaio_combobox.get(),
+            "Anta a giro posizione": self.anta_giro_combobox.get(),
+            "M.rib.": self.mrib_combobox.get(),
+            "N.ANTE": self.numero_ante_label.cget("text"),
+            "AP.": self.apertura_label.cget("text"),
+            "TIP.": self.tipologia_label.cget("text"),
+            "DESCR.TIP": self.descrizione_tipologia_label.cget("text"),
+            "N.CERN.": self.n_cerniere_label.cget("text"),
+            "XLAV": self.extra_lavorazione_label.cget("text"),
+            "MULT.": self.multiplo_label.cget("text"),
+            "COSTO MLT": self.costo_multiplo_label.cget("text"),
+            "MIN.1": self.minimi_1_label.cget("text"),
+            "MIN.2": self.minimi_2_label.cget("text"),
+            "MIN.3": self.minimi_3_label.cget("text"),
+            "MIN.4": self.minimi_4_label.cget("text"),
+            "MIN.5": self.minimi_5_label.cget("text"),
+            "P.SERR.": self.presenza_serratura_label.cget("text"),
+            "N.STAFF.": self.numero_staffette_label.cget("text"),
+        }
         
-        # Inserisci la riga nel Treeview
-        self.tree.insert("", "end", values=values)
+        # Inserisci la riga nel Treeview e calcola con il motore prezzi solo questa riga
+        item = self.inserisci_posizione(Posizione.da_dict(riga))
+        self.segna_da_ricalcolare(item)
+        self.ricalcola_righe_modificate()
+        values = self.posizioni[item].formattati()
         
-        # Aggiorna la numerazione delle posizioni (sempre progressiva)
-        for i, item in enumerate(self.tree.get_children(), start=1):
-            vals = list(self.tree.item(item, "values"))
-            vals[0] = i
-            self.tree.item(item, values=vals)
+        # Valori inseriti: la riga intera viene convertita in testo solo con il debug attivo
+        log.debug("aggiungi_riga: valori %s", values)
         
-        # Aggiorna il contatore posizione e il campo Pos. nel frame di inserimento
-        self.pos_counter = len(self.tree.get_children()) + 1
-        self.pos_label.config(text=str(self.pos_counter))
+        # Inserendo in coda la numerazione delle altre righe non cambia: aggiorna solo il contatore
+        self.aggiorna_contatore_posizione()
         
-        # Salvataggio dei dati nel file preventivo.py (append)
-        try:
-            with open("preventivo.py", "a") as f:
-                f.write(f"# Riga inserita: pos={pos}, nr_pezzi='{nr_pezzi}', serramento='{serramento}', modello='{modello}', modello_grata_combinato='{modello_grata_combinato}', colore='{colore}', l_mm='{l_mm}', h_mm='{h_mm}', tipo_telaio='{tipo_telaio}', bunk='{bunk}', dmcp='{dmcp}', defender='{defender}', dist='{dist}', tipo_dist='{tipo_dist}', l_dist='{l_dist}', h_dist='{h_dist}', tipo_controtelaio='{tipo_controtelaio}', anta_giro='{anta_giro}', mrib='{mrib}', numero_ante='{numero_ante}', apertura='{apertura}', tipologia='{tipologia}', descrizione_tipologia='{descrizione_tipologia}', n_cerniere='{n_cerniere}', extra_lavorazione='{extra_lavorazione}', multiplo='{multiplo}', costo_multiplo='{costo_multiplo}', minimi_1='{minimi_1}', minimi_2='{minimi_2}', minimi_3='{minimi_3}', minimi_4='{minimi_4}', minimi_5='{minimi_5}', presenza_serratura='{presenza_serratura}', numero_staffette='{numero_staffette}'\n")
-                f.write(f"dati_posizioni.append({{ 'pos': {pos}, 'nr_pezzi': '{nr_pezzi}', 'serramento': '{serramento}', 'modello': '{modello}', 'modello_grata_combinato': '{modello_grata_combinato}', 'colore': '{colore}', 'l_mm': '{l_mm}', 'h_mm': '{h_mm}', 'tipo_telaio': '{tipo_telaio}', 'bunk': '{bunk}', 'dmcp': '{dmcp}', 'defender': '{defender}', 'dist': '{dist}', 'tipo_dist': '{tipo_dist}', 'l_dist': '{l_dist}', 'h_dist': '{h_dist}', 'tipo_controtelaio': '{tipo_controtelaio}', 'anta_giro': '{anta_giro}', 'mrib': '{mrib}', 'NUMERO ANTE': '{numero_ante}', 'APERTURA': '{apertura}', 'TIPOLOGIA': '{tipologia}', 'DESCRIZIONE TIPOLOGIA': '{descrizione_tipologia}', 'N. CERNIERE': '{n_cerniere}', 'EXTRA LAVORAZIONE': '{extra_lavorazione}', 'MULTIPLO': '{multiplo}', 'COSTO MULTIPLO': '{costo_multiplo}', 'MINIMI 1': '{minimi_1}', 'MINIMI 2': '{minimi_2}', 'MINIMI 3': '{minimi_3}', 'MINIMI 4': '{minimi_4}', 'MINIMI 5': '{minimi_5}', 'Presenza serratura': '{presenza_serratura}', 'Numero staffette': '{numero_staffette}', 'Sconto 1': '{sconto_1}', 'Sconto 2': '{sconto_2}', 'Sconto 3': '{sconto_3}', 'Sconto in decimali': '{sconto_decimali}', 'Dicitura sconto': '{dicitura_sconto}', 'Prezzo_listino': '{prezzo_listino}', 'MqR': '{mqr}', 'MIR': '{mir}', 'Tabella_minimi': '{tabella_minimi}', 'Unita_di_misura': '{unita_di_misura}', 'Min_fatt_pz': '{min_fatt_pz}', 'Mq_fatt_pz': '{mq_fatt_pz_str}', 'Mq_totali_fatt': '{mq_totali_fatt_str}', 'Ml_totali_fatt': '{ml_totali_fatt_str}', 'Costo_scontato_Mq': '{values[-4]}', 'Prezzo_listino_unitario': '{values[-3]}', 'Costo_serramento_listino_posizione': '{values[-2]}', 'Costo_serramento_scontato_posizione': '{values[-1]}'}})\n")
-        except Exception as e:
-            print("Errore durante il salvataggio nel file preventivo.py:", e)
+        # Registra l'inserimento nel giornale delle posizioni
+        self._registra("inserisci", item, self.posizioni[item].valori())
         
         # Pulisci i campi di input
         self.nr_pezzi_entry.delete(0, tk.END)
@@ -1302,8 +861,6 @@ class PosizioniFrame(ttk.Frame):
         
         # Aggiorna l'oggetto preventivo
         self.salva_in_preventivo()
-        # Aggiorna tutti i campi controtelaio per tutte le righe
-        self.aggiorna_tutti_campi_controtelaio_treeview()
 
     def elimina_riga_selezionata(self):
         """
@@ -1316,23 +873,18 @@ class PosizioniFrame(ttk.Frame):
         
         # Chiedi conferma prima di eliminare
         if messagebox.askyesno("Conferma", "Sei sicuro di voler eliminare la riga selezionata?"):
-            # Ottieni tutte le righe del Treeview
-            all_items = self.tree.get_children()
-            
-            # Trova l'indice della riga selezionata
-            selected_index = all_items.index(selected_item[0])
+            # Trova l'indice della riga selezionata nell'ordine della tabella
+            selected_index = self.tabella.indice(selected_item[0])
             
             # Elimina la riga selezionata
-            self.tree.delete(selected_item)
-            
-            # Rinumera tutte le righe in modo sequenziale
-            for i, item in enumerate(self.tree.get_children(), start=1):
-                values = list(self.tree.item(item)["values"])
-                values[0] = i  # Aggiorna il campo Pos.
-                self.tree.item(item, values=values)
+            self.tabella.elimina(selected_item[0])
+            self.posizioni.pop(selected_item[0], None)
+            self.tag_posizioni.pop(selected_item[0], None)
+            self.versioni_posizioni.pop(selected_item[0], None)
+            self._registra("elimina", selected_item[0])
             
-            # Aggiorna il contatore della posizione e il campo Pos. nel frame di inserimento
-            self.aggiorna_contatore_posizione()
+            # Rinumera solo le righe successive a quella eliminata (aggiorna anche il contatore)
+            self.rinumera_posizioni(selected_index)
             
             # Aggiorna l'oggetto preventivo
             self.salva_in_preventivo()
@@ -1348,7 +900,7 @@ class PosizioniFrame(ttk.Frame):
         
         # Prendi il primo elemento selezionato
         item = selected_items[0]
-        values = self.tree.item(item, "values")
+        values = self.posizioni[item].formattati()
         
         # Apri la finestra di dialogo per la modifica
         self.show_edit_dialog(item, values)
@@ -1393,7 +945,7 @@ class PosizioniFrame(ttk.Frame):
         row = 0
         
         # Crea i campi di input per i valori modificabili
-        for i, col in enumerate(self.colonne[:19]):  # Solo i primi 19 campi sono modificabili
+        for i, col in enumerate(COLONNE_INPUT):  # Solo i campi inseriti dall'utente sono modificabili
             if col in ["Pos.", "Mq_fatt_pz", "Mq_totali_fatt", "Ml_totali_fatt"]:
                 continue
                 
@@ -1413,10 +965,10 @@ class PosizioniFrame(ttk.Frame):
                 
                 # Popola i valori del combobox in base al campo
                 if col == "Serramento" and self.dataframe is not None:
-                    entry['values'] = sorted(list(self.dataframe["TIPOLOGIA COMPLETA DI APERTURA"].unique()))
-                elif col == "Modello" and 'listino' in globals():
-                    entry['values'] = sorted(list(listino["MODELLO"].unique()))
-                elif col == "Modello grata combinato" and 'modello_grata_combinato' in globals():
+                    entry['values'] = sorted(indice_elementi.chiavi())
+                elif col == "Modello":
+                    entry['values'] = sorted(indice_listino.chiavi())
+                elif col == "Modello grata combinato" and isinstance(modello_grata_combinato, pd.DataFrame):
                     entry['values'] = sorted(list(modello_grata_combinato.iloc[:, 0].unique()))
                 elif col == "Colore":
                     entry['values'] = ["STANDARD RAL", "EFFETTO LEGNO", "GREZZO"]
@@ -1454,10 +1006,9 @@ class PosizioniFrame(ttk.Frame):
                 if col == "Serramento":
                     def on_serramento_selected(event=None, entries=entries, item=item):
                         serramento = entries["Serramento"].get()
-                        print(f"[DEBUG] Cambio serramento in dialog: {serramento!r}")
-                        # Trova la riga corrispondente nel DataFrame
-                        row = self.dataframe[self.dataframe["TIPOLOGIA COMPLETA DI APERTURA"] == serramento]
-                        print(f"[DEBUG] Colonne disponibili nella riga: {row.columns}")
+                        log.debug("Cambio serramento in dialog: %r", serramento)
+                        # Ricerca O(1) nell'indice del catalogo elementi
+                        row = indice_elementi.riga(serramento)
                         minimi_map = {
                             "MIN.1": ["MINIMI 1 (protezione singola)", "MINIMI 1", "Minimi 1", "MINIMI_1"],
                             "MIN.2": ["MINIMI 2 (snodo)", "MINIMI 2", "Minimi 2", "MINIMI_2"],
@@ -1465,13 +1016,13 @@ class PosizioniFrame(ttk.Frame):
                             "MIN.4": ["MINIMI 4", "Minimi 4", "MINIMI_4"],
                             "MIN.5": ["MINIMI 5", "Minimi 5", "MINIMI_5"],
                         }
-                        if not row.empty:
+                        if row is not None:
                             for min_col, possibili in minimi_map.items():
                                 valore = ""
                                 for col_df in possibili:
-                                    if col_df in row.columns:
-                                        valore = row.iloc[0][col_df]
-                                        print(f"[DEBUG] Mapping {col_df} -> {min_col}: {valore}")
+                                    if col_df in row:
+                                        valore = indice_elementi.valore(serramento, col_df)
+                                        log.debug("Mapping %s -> %s: %s", col_df, min_col, valore)
                                         break
                                 if min_col in entries:
                                     entries[min_col].config(text=str(valore))
@@ -1561,8 +1112,8 @@ class PosizioniFrame(ttk.Frame):
             entries[field_name] = label
             
             # Se il campo esiste nei valori correnti, imposta il valore
-            if field_name in self.colonne:
-                idx = self.colonne.index(field_name)
+            idx = INDICI.get(field_name)
+            if idx is not None:
                 if idx < len(values) and values[idx]:
                     label.config(text=values[idx])
         
@@ -1587,76 +1138,34 @@ class PosizioniFrame(ttk.Frame):
     def load_serramento_image(self, serramento_name):
         """
         Carica l'immagine del serramento dalla cartella risorse/serramenti.
+        Se l'immagine non è già in cache viene decodificata in background: intanto si mostra un segnaposto,
+        e il risultato viene scartato se nel frattempo è stato scelto un altro serramento.
         
         :param serramento_name: Nome del serramento
         """
+        self._serramento_immagine = serramento_name
         try:
-            # Normalizza il nome del serramento per il nome del file
-            # Rimuovi spazi e caratteri speciali, converti in minuscolo
-            import re
-            normalized_name = re.sub(r'[^a-zA-Z0-9]', '_', serramento_name.lower())
-            
-            # Percorsi possibili per l'immagine
-            possible_extensions = ['.png', '.jpg', '.jpeg', '.gif']
-            image_path = None
-            
-            for ext in possible_extensions:
-                path = os.path.join("risorse", "serramenti", f"{normalized_name}{ext}")
-                if os.path.exists(path):
-                    image_path = path
-                    break
-            
-            # Se non troviamo un'immagine con il nome normalizzato, cerchiamo qualsiasi immagine che contenga parte del nome
-            if not image_path:
-                for filename in os.listdir(os.path.join("risorse", "serramenti")):
-                    if any(filename.lower().endswith(ext) for ext in possible_extensions):
-                        # Verifica se il nome del file contiene parte del nome del serramento
-                        name_parts = normalized_name.split('_')
-                        for part in name_parts:
-                            if len(part) > 3 and part in filename.lower():  # Solo parti significative (più di 3 caratteri)
-                                image_path = os.path.join("risorse", "serramenti", filename)
-                                break
-                        if image_path:
-                            break
-            
-            # Se abbiamo trovato un'immagine, la carichiamo
-            if image_path and os.path.exists(image_path):
-                # Carica l'immagine con PIL
-                img = Image.open(image_path)
-                
-                # Ridimensiona l'immagine mantenendo le proporzioni
-                max_width = 400
-                max_height = 400
-                width, height = img.size
-                
-                # Calcola le nuove dimensioni mantenendo le proporzioni
-                if width > height:
-                    new_width = max_width
-                    new_height = int(height * (max_width / width))
-                else:
-                    new_height = max_height
-                    new_width = int(width * (max_height / height))
-                
-                img = img.resize((new_width, new_height), Image.LANCZOS)
-                
-                # Converti in formato Tkinter
-                photo = ImageTk.PhotoImage(img)
-                
-                # Aggiorna l'etichetta con l'immagine
-                self.image_label.config(image=photo)
-                self.image_label.image = photo  # Mantieni un riferimento per evitare il garbage collection
-                
-                # Aggiorna il testo dell'etichetta
-                self.image_label.config(text="")
-            else:
-                # Se non troviamo l'immagine, mostriamo un messaggio
+            pronta = archivio_predefinito().richiedi_foto(serramento_name, self, self._mostra_immagine_serramento)
+            if not pronta:
                 self.image_label.config(image="")
-                self.image_label.config(text=f"Immagine non trovata per:\n{serramento_name}")
-        
+                self.image_label.config(text=f"Caricamento immagine...\n{serramento_name}")
         except Exception as e:
-            print(f"Errore nel caricamento dell'immagine: {e}")
+            log.error("Errore nel caricamento dell'immagine: %s", e)
             self.image_label.config(image="")
             self.image_label.config(text=f"Errore nel caricamento dell'immagine:\n{str(e)}")
+
+    def _mostra_immagine_serramento(self, serramento_name, photo):
+        """Mostra l'immagine pronta, solo se è ancora quella del serramento selezionato e la finestra è aperta."""
+        if serramento_name != getattr(self, '_serramento_immagine', None) or not self.image_label.winfo_exists():
+            return
+        if photo is not None:
+            # Aggiorna l'etichetta con l'immagine
+            self.image_label.config(image=photo, text="")
+            self.image_label.image = photo  # Mantieni un riferimento per evitare il garbage collection
+        else:
+            # Se non troviamo l'immagine, mostriamo un messaggio
+            self.image_label.config(image="")
+            self.image_label.config(text=f"Immagine non trovata per:\n{serramento_name}")
         
     def on_edit_modello_selected(self, entries):
         """Gestisce la selezione del modello nella finestra di modifica."""
@@ -1769,29 +1278,12 @@ class PosizioniFrame(ttk.Frame):
         Aggiorna i campi aggiuntivi nella finestra di modifica in base al serramento selezionato.
         """
         try:
-            values = self.tree.item(item, "values")
-            serramento = values[2] if len(values) > 2 else ""
-            
-            # Verifica se il DataFrame è stato caricato correttamente
-            if self.dataframe is None or self.dataframe.empty:
-                print("DataFrame non caricato o vuoto")
-                return
-                
-            # Trova il nome corretto della colonna del serramento
-            serramento_column = None
-            for col in self.dataframe.columns:
-                if "SERRAMENTO" in str(col).upper():
-                    serramento_column = col
-                    break
-            
-            if serramento_column is None:
-                print("Colonna SERRAMENTO non trovata nel DataFrame")
-                return
+            serramento = self.posizioni[item]["Serramento"] or ""
             
-            # Trova la riga corrispondente nel DataFrame
-            row = self.dataframe[self.dataframe[serramento_column] == serramento]
-            if row.empty:
-                print(f"Nessuna riga trovata per il serramento: {serramento}")
+            # Ricerca O(1) nell'indice del catalogo elementi
+            row = indice_elementi.riga(serramento)
+            if row is None:
+                log.warning("Nessuna riga trovata per il serramento: %s", serramento)
                 return
             
             # Mappa dei nomi delle colonne del DataFrame ai nomi abbreviati
@@ -1817,15 +1309,15 @@ class PosizioniFrame(ttk.Frame):
             # Aggiorna i campi con i nuovi valori
             for df_col, abbrev in column_mapping.items():
                 try:
-                    if df_col in row.columns:
-                        value = row[df_col].iloc[0]
+                    if df_col in row:
+                        value = indice_elementi.valore(serramento, df_col)
                         if abbrev in entries:
                             entries[abbrev].config(text=str(value))
                 except Exception as e:
-                    print(f"Errore nell'aggiornamento del campo {df_col}: {e}")
+                    log.error("Errore nell'aggiornamento del campo %s: %s", df_col, e)
                     
         except Exception as e:
-            print(f"Errore in update_edit_dialog_fields: {e}")
+            log.error("Errore in update_edit_dialog_fields: %s", e)
 
     def save_edited_row(self, dialog, item, entries):
         """
@@ -1837,7 +1329,7 @@ class PosizioniFrame(ttk.Frame):
         """
         try:
             # Ottieni i valori correnti della riga
-            current_values = list(self.tree.item(item, "values"))
+            current_values = self.posizioni[item].formattati()
             
             # Crea una nuova lista per i valori aggiornati
             new_values = []
@@ -1861,643 +1353,22 @@ class PosizioniFrame(ttk.Frame):
                     # Se la colonna non ha un widget corrispondente, mantieni il valore corrente
                     new_values.append(current_values[i] if i < len(current_values) else "")
             
-            # --- FIX: Ripristina MIN.1, MIN.2, MIN.3 se vuoti ---
-            for min_col in ["MIN.1", "MIN.2", "MIN.3"]:
-                idx = self.colonne.index(min_col)
-                if idx < len(new_values) and (not new_values[idx] or new_values[idx] == ""):
-                    new_values[idx] = current_values[idx] if idx < len(current_values) else ""
-            
-            # --- AGGIORNAMENTO AUTOMATICO MqR e MIR SE MODIFICATI L (mm) o H (mm) ---
-            try:
-                l_index = self.colonne.index("L (mm)")
-                h_index = self.colonne.index("H (mm)")
-                mqr_index = self.colonne.index("MqR")
-                mir_index = self.colonne.index("MIR")
-                tabella_minimi_index = self.colonne.index("Tabella_minimi")
-                l_mm_str = new_values[l_index] if l_index < len(new_values) else ""
-                h_mm_str = new_values[h_index] if h_index < len(new_values) else ""
-                modello_index = self.colonne.index("Modello")
-                modello_val = new_values[modello_index] if modello_index < len(new_values) else ""
-                l_val = float(str(l_mm_str).replace(",", ".")) if l_mm_str else 0.0
-                h_val = float(str(h_mm_str).replace(",", ".")) if h_mm_str else 0.0
-                mqr = f"{round(l_val * h_val * 0.000001, 2):.2f}".replace('.', ',')
-                mir = f"{round((l_val + 2 * h_val) * 0.001, 2):.2f}".replace('.', ',')
-                # Aggiorna i valori calcolati
-                if mqr_index < len(new_values):
-                    new_values[mqr_index] = mqr
-                if mir_index < len(new_values):
-                    new_values[mir_index] = mir
-                # Aggiorna Tabella_minimi
-                tabella_minimi = ""
-                try:
-                    if modello_val:
-                        minimi_row = listino.loc[listino["MODELLO"] == modello_val]
-                        if not minimi_row.empty:
-                            # Prova a recuperare la colonna corretta tra le possibili varianti
-                            possible_minimi_cols = [
-                                "Minimi",
-                                "MINIMI 1 (protezione singola)",
-                                "MINIMI 1",
-                                "MINIMI",
-                                "Minimi 1",
-                                "MINIMI_1",
-                            ]
-                            found = False
-                            for col in possible_minimi_cols:
-                                if col in minimi_row.columns:
-                                    tabella_minimi = str(minimi_row.iloc[0][col])
-                                    found = True
-                                    break
-                            if not found:
-                                # Debug: colonna non trovata
-                                print(f"[DEBUG] Nessuna colonna minimi trovata tra {possible_minimi_cols} per modello {modello_val}")
-                                tabella_minimi = ""
-                        else:
-                            print(f"[DEBUG] Nessuna riga in listino per modello: {modello_val}")
-                except Exception as e:
-                    print(f"[DEBUG] Errore durante il recupero di Tabella_minimi: {e}")
-                    tabella_minimi = ""
-                if tabella_minimi_index < len(new_values):
-                    new_values[tabella_minimi_index] = tabella_minimi
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di MqR e MIR: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO COSTO AL ML CONTROTELAIO SINGOLO ---
-            try:
-                tipo_controtelaio_index = self.colonne.index("Tipologia controtelaio")
-                costo_ml_controtelaio_singolo_index = self.colonne.index("Costo al ml controtelaio singolo")
-                tipo_controtelaio_val = new_values[tipo_controtelaio_index] if tipo_controtelaio_index < len(new_values) else ""
-                costo_ml_controtelaio_singolo = ""
-                if tipo_controtelaio_val:
-                    row = controtelaio[controtelaio["CONTROTELAIO"] == tipo_controtelaio_val]
-                    if not row.empty:
-                        costo_ml_controtelaio_singolo = row.iloc[0]["COSTO"]
-                if costo_ml_controtelaio_singolo_index < len(new_values):
-                    new_values[costo_ml_controtelaio_singolo_index] = costo_ml_controtelaio_singolo
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di costo_ml_controtelaio_singolo: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO VERIFICA CONTROTELAIO ---
-            try:
-                verifica_controtelaio_index = self.colonne.index("Verifica controtelaio")
-                # Nuova logica: 1 solo se Tipologia controtelaio non è vuota e diversa da 0
-                if tipo_controtelaio_val and tipo_controtelaio_val != "0":
-                    verifica_controtelaio = "1"
-                else:
-                    verifica_controtelaio = ""
-                if verifica_controtelaio_index < len(new_values):
-                    new_values[verifica_controtelaio_index] = verifica_controtelaio
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di verifica_controtelaio: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO TIPOLOGIA ML/NR. PEZZI ---
-            try:
-                tipologia_ml_nr_pezzi_index = self.colonne.index("Tipologia ml/nr. Pezzi")
-                tipologia_ml_nr_pezzi = ""
-                if tipo_controtelaio_val:
-                    row = controtelaio[controtelaio["CONTROTELAIO"] == tipo_controtelaio_val]
-                    if not row.empty:
-                        tipologia_ml_nr_pezzi = str(row.iloc[0]["Ml / nr. Pezzi"])
-                if tipologia_ml_nr_pezzi_index < len(new_values):
-                    new_values[tipologia_ml_nr_pezzi_index] = tipologia_ml_nr_pezzi
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di tipologia_ml_nr_pezzi: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO FATTORE MOLTIPLICATORE ML/NR. PEZZI ---
-            try:
-                fattore_moltiplicatore_index = self.colonne.index("Fattore moltiplicatore ml/nr. Pezzi")
-                verifica_controtelaio_index = self.colonne.index("Verifica controtelaio")
-                tipologia_ml_nr_pezzi_index = self.colonne.index("Tipologia ml/nr. Pezzi")
-                ml_totali_fatt_index = self.colonne.index("Ml_totali_fatt")
-                nr_pezzi_index = self.colonne.index("nr. pezzi")
-
-                verifica_controtelaio_val = new_values[verifica_controtelaio_index] if verifica_controtelaio_index < len(new_values) else ""
-                tipologia_ml_nr_pezzi_val = new_values[tipologia_ml_nr_pezzi_index] if tipologia_ml_nr_pezzi_index < len(new_values) else ""
-                ml_totali_fatt_val = new_values[ml_totali_fatt_index] if ml_totali_fatt_index < len(new_values) else ""
-                nr_pezzi_val = new_values[nr_pezzi_index] if nr_pezzi_index < len(new_values) else ""
-
-                # Converti i valori in stringhe e rimuovi eventuali spazi
-                verifica_controtelaio_val = str(verifica_controtelaio_val).strip()
-                tipologia_ml_nr_pezzi_val = str(tipologia_ml_nr_pezzi_val).strip()
-                ml_totali_fatt_val = str(ml_totali_fatt_val).strip()
-                nr_pezzi_val = str(nr_pezzi_val).strip()
-
-                # Debug per verificare i valori prima del calcolo
-                print(f"[DEBUG] Verifica controtelaio (raw): {verifica_controtelaio_val}")
-                print(f"[DEBUG] Tipologia ml/nr. Pezzi (raw): {tipologia_ml_nr_pezzi_val}")
-                print(f"[DEBUG] Ml_totali_fatt (raw): {ml_totali_fatt_val}")
-                print(f"[DEBUG] nr. pezzi (raw): {nr_pezzi_val}")
-
-                # Implementazione della formula richiesta
-                if verifica_controtelaio_val == "1" and tipologia_ml_nr_pezzi_val == "1":
-                    # Se entrambe le condizioni sono vere, usa Ml_totali_fatt
-                    if ml_totali_fatt_val and ml_totali_fatt_val != "0":
-                        try:
-                            # Prova a convertire in float per verificare se è un numero valido
-                            float(ml_totali_fatt_val)
-                            fattore_moltiplicatore = ml_totali_fatt_val
-                            print(f"[DEBUG] Condizioni soddisfatte: usando Ml_totali_fatt = {ml_totali_fatt_val}")
-                        except ValueError:
-                            fattore_moltiplicatore = nr_pezzi_val
-                            print(f"[DEBUG] Ml_totali_fatt non è un numero valido: usando nr. pezzi = {nr_pezzi_val}")
-                    else:
-                        fattore_moltiplicatore = nr_pezzi_val
-                        print(f"[DEBUG] Ml_totali_fatt vuoto o zero: usando nr. pezzi = {nr_pezzi_val}")
-                else:
-                    fattore_moltiplicatore = nr_pezzi_val
-                    print(f"[DEBUG] Condizioni non soddisfatte: usando nr. pezzi = {nr_pezzi_val}")
-
-                # Aggiorna il valore nel dizionario
-                if fattore_moltiplicatore_index < len(new_values):
-                    new_values[fattore_moltiplicatore_index] = fattore_moltiplicatore
-
-                # Debug per verificare il risultato finale
-                print(f"[DEBUG] Fattore moltiplicatore risultante: {fattore_moltiplicatore}")
-
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di fattore_moltiplicatore: {e}")
-                import traceback
-                print(f"[DEBUG] Stack trace: {traceback.format_exc()}")
-
-            # --- AGGIORNAMENTO AUTOMATICO COSTO LISTINO PER POSIZIONE CONTROTELAIO ---
-            try:
-                costo_listino_posizione_index = self.colonne.index("Costo listino per posizione controtelaio")
-                costo_listino_posizione = costo_ml_controtelaio_singolo
-                if costo_listino_posizione_index < len(new_values):
-                    new_values[costo_listino_posizione_index] = costo_listino_posizione
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di costo_listino_posizione: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO COSTO SCONTATO CONTROTELAIO POSIZIONE ---
-            try:
-                costo_scontato_posizione_index = self.colonne.index("Costo scontato controtelaio posizione")
-                costo_scontato_posizione = costo_ml_controtelaio_singolo
-                if costo_scontato_posizione_index < len(new_values):
-                    new_values[costo_scontato_posizione_index] = costo_scontato_posizione
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di costo_scontato_posizione: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO N. CONTROTELAI SINGOLI ---
-            try:
-                n_controtelai_singoli_index = self.colonne.index("N. Controtelai singoli")
-                n_controtelai_singoli = "0"
-                try:
-                    nr_pezzi_val = values[self.colonne.index("nr. pezzi")] if "nr. pezzi" in self.colonne else ""
-                    if tipo_controtelaio == "C. SINGOLO":
-                        n_controtelai_singoli = str(nr_pezzi_val)
-                except Exception as e:
-                    print(f"[DEBUG] Errore nel calcolo del numero controtelai singoli: {e}")
-                    n_controtelai_singoli = "0"
-                if n_controtelai_singoli_index < len(new_values):
-                    new_values[n_controtelai_singoli_index] = n_controtelai_singoli
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di n_controtelai_singoli: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO ML CONTROTELAIO SINGOLO ---
-            try:
-                ml_controtelaio_singolo_index = self.colonne.index("ML Controtelaio singolo")
-                ml_controtelaio_singolo = mir if tipo_controtelaio == "C. SINGOLO" else ""
-                if ml_controtelaio_singolo_index < len(new_values):
-                    new_values[ml_controtelaio_singolo_index] = ml_controtelaio_singolo
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di ml_controtelaio_singolo: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO COSTO CONTROTELAIO SINGOLO ---
-            try:
-                costo_controtelaio_singolo_index = self.colonne.index("Costo Controtelaio singolo")
-                costo_controtelaio_singolo = costo_ml_controtelaio_singolo if tipo_controtelaio == "C. SINGOLO" else ""
-                if costo_controtelaio_singolo_index < len(new_values):
-                    new_values[costo_controtelaio_singolo_index] = costo_controtelaio_singolo
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di costo_controtelaio_singolo: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO N. CONTROTELAI DOPPI ---
-            try:
-                n_controtelai_doppi_index = self.colonne.index("N. Controtelai doppi")
-                n_controtelai_doppi = "1" if tipo_controtelaio == "C. DOPPIO" else "0"
-                if n_controtelai_doppi_index < len(new_values):
-                    new_values[n_controtelai_doppi_index] = n_controtelai_doppi
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di n_controtelai_doppi: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO ML CONTROTELAIO DOPPIO ---
-            try:
-                ml_controtelaio_doppio_index = self.colonne.index("ML Controtelaio doppio")
-                ml_controtelaio_doppio = mir if tipo_controtelaio == "C. DOPPIO" else ""
-                if ml_controtelaio_doppio_index < len(new_values):
-                    new_values[ml_controtelaio_doppio_index] = ml_controtelaio_doppio
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di ml_controtelaio_doppio: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO COSTO CONTROTELAIO DOPPIO ---
-            try:
-                costo_controtelaio_doppio_index = self.colonne.index("Costo Controtelaio doppio")
-                costo_controtelaio_doppio = costo_ml_controtelaio_singolo if tipo_controtelaio == "C. DOPPIO" else ""
-                if costo_controtelaio_doppio_index < len(new_values):
-                    new_values[costo_controtelaio_doppio_index] = costo_controtelaio_doppio
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di costo_controtelaio_doppio: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO N. CONTROTELAIO TERMICO TIP A ---
-            try:
-                n_controtelaio_termico_a_index = self.colonne.index("N. Controtelaio termico TIP A")
-                n_controtelaio_termico_a = "1" if tipo_controtelaio == "C. TERMICO TIP A" else "0"
-                if n_controtelaio_termico_a_index < len(new_values):
-                    new_values[n_controtelaio_termico_a_index] = n_controtelaio_termico_a
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di n_controtelaio_termico_a: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO COSTO LISTINO CONTROTELAIO TERMICO TIP A ---
-            try:
-                costo_listino_termico_a_index = self.colonne.index("Costo listino controtelaio termico TIP A")
-                costo_listino_termico_a = costo_ml_controtelaio_singolo if tipo_controtelaio == "C. TERMICO TIP A" else ""
-                if costo_listino_termico_a_index < len(new_values):
-                    new_values[costo_listino_termico_a_index] = costo_listino_termico_a
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di costo_listino_termico_a: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO N. CONTROTELAIO TERMICO TIP B ---
-            try:
-                n_controtelaio_termico_b_index = self.colonne.index("N. Controtelaio termico TIP B")
-                n_controtelaio_termico_b = "1" if tipo_controtelaio == "C. TERMICO TIP B" else "0"
-                if n_controtelaio_termico_b_index < len(new_values):
-                    new_values[n_controtelaio_termico_b_index] = n_controtelaio_termico_b
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di n_controtelaio_termico_b: {e}")
-
-            # --- AGGIORNAMENTO AUTOMATICO COSTO LISTINO CONTROTELAIO TERMICO TIP B ---
-            try:
-                costo_listino_termico_b_index = self.colonne.index("Costo listino controtelaio termico TIP B")
-                costo_listino_termico_b = costo_ml_controtelaio_singolo if tipo_controtelaio == "C. TERMICO TIP B" else ""
-                if costo_listino_termico_b_index < len(new_values):
-                    new_values[costo_listino_termico_b_index] = costo_listino_termico_b
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di costo_listino_termico_b: {e}")
-
-            # --- FINE AGGIORNAMENTO AUTOMATICO CONTROTELAI ---
-            
-            # --- AGGIORNAMENTO AUTOMATICO SCONTI ---
-            try:
-                s1_index = self.colonne.index("Sconto 1")
-                s2_index = self.colonne.index("Sconto 2")
-                s3_index = self.colonne.index("Sconto 3")
-                sdec_index = self.colonne.index("Sconto in decimali")
-                ds_index = self.colonne.index("Dicitura sconto")
-                if self.preventivo and hasattr(self.preventivo, 'dati_b1'):
-                    dati_b1 = self.preventivo.dati_b1
-                    def get_sconto_value(dati_b1, *keys):
-                        for k in keys:
-                            if k in dati_b1:
-                                return dati_b1[k]
-                        return ""
-                    new_values[s1_index] = get_sconto_value(dati_b1, 'Sconto 1', 'Sconto1')
-                    new_values[s2_index] = get_sconto_value(dati_b1, 'Sconto 2', 'Sconto2')
-                    new_values[s3_index] = get_sconto_value(dati_b1, 'Sconto 3', 'Sconto3')
-                    new_values[sdec_index] = get_sconto_value(dati_b1, 'Sconto in decimali', 'Sconto_in_decimali')
-                    new_values[ds_index] = get_sconto_value(dati_b1, 'Dicitura sconto', 'Dicitura_sconto')
-            except Exception as e:
-                print(f"[DEBUG] Errore aggiornamento automatico sconti: {e}")
-            # --- FINE AGGIORNAMENTO AUTOMATICO SCONTI ---
-            
-            # --- AGGIORNAMENTO AUTOMATICO PREZZO_LISTINO ---
-            try:
-                modello_index = self.colonne.index("Modello")
-                colore_index = self.colonne.index("Colore")
-                prezzo_listino_index = self.colonne.index("Prezzo_listino")
-                modello = new_values[modello_index] if modello_index < len(new_values) else ""
-                colore = new_values[colore_index] if colore_index < len(new_values) else ""
-                prezzo_listino = ""
-                if modello and colore:
-                    row = listino[listino['MODELLO'] == modello]
-                    if not row.empty and colore in listino.columns:
-                        prezzo = row.iloc[0][colore]
-                        if pd.notnull(prezzo):
-                            try:
-                                prezzo_float = float(prezzo)
-                                prezzo_listino = f"€ {prezzo_float:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-                            except Exception:
-                                prezzo_listino = f"€ {prezzo},00"
-                new_values[prezzo_listino_index] = prezzo_listino
-            except Exception as e:
-                print(f"[DEBUG] Errore aggiornamento automatico Prezzo_listino: {e}")
-            # --- FINE AGGIORNAMENTO AUTOMATICO PREZZO_LISTINO ---
-            
-            # --- AGGIORNAMENTO AUTOMATICO MIN_FATT_PZ ---
-            try:
-                tabella_minimi_index = self.colonne.index("Tabella_minimi")
-                min1_index = self.colonne.index("MIN.1")
-                min2_index = self.colonne.index("MIN.2")
-                min3_index = self.colonne.index("MIN.3")
-                min4_index = self.colonne.index("MIN.4")
-                min5_index = self.colonne.index("MIN.5")
-                min_fatt_pz_index = self.colonne.index("Min_fatt_pz")
-                tabella_val = str(new_values[tabella_minimi_index]).strip()
-                print(f"[DEBUG] tabella_minimi: '{tabella_val}'")
-                try:
-                    tab_min = int(tabella_val)
-                except Exception:
-                    tab_min = None
-                min_val = ""
-                print(f"[DEBUG] MIN.1: {new_values[min1_index]}, MIN.2: {new_values[min2_index]}, MIN.3: {new_values[min3_index]}, MIN.4: {new_values[min4_index]}, MIN.5: {new_values[min5_index]}")
-                if tab_min == 1:
-                    min_val = new_values[min1_index]
-                elif tab_min == 2:
-                    min_val = new_values[min2_index]
-                elif tab_min == 3:
-                    min_val = new_values[min3_index]
-                elif tab_min == 4:
-                    min_val = new_values[min4_index]
-                elif tab_min == 5:
-                    min_val = new_values[min5_index]
-                print(f"[DEBUG] min_fatt_pz calcolato: {min_val}")
-                new_values[min_fatt_pz_index] = min_val
-            except Exception:
-                new_values[min_fatt_pz_index] = ""
-            # --- FINE AGGIORNAMENTO AUTOMATICO MIN_FATT_PZ ---
-            
-            # --- AGGIORNAMENTO AUTOMATICO Mq_fatt_pz ---
-            try:
-                mqr_index = self.colonne.index("MqR")
-                min_fatt_pz_index = self.colonne.index("Min_fatt_pz")
-                mq_fatt_pz_index = self.colonne.index("Mq_fatt_pz")
-                mqr_val = new_values[mqr_index] if mqr_index < len(new_values) else ""
-                min_fatt_pz_val = new_values[min_fatt_pz_index] if min_fatt_pz_index < len(new_values) else ""
-                mqr_float = float(mqr_val.replace(",", ".")) if mqr_val else 0.0
-                min_fatt_pz_float = float(min_fatt_pz_val.replace(",", ".")) if min_fatt_pz_val else 0.0
-                mq_fatt_pz = max(mqr_float, min_fatt_pz_float)
-                new_values[mq_fatt_pz_index] = f"{mq_fatt_pz:.2f}".replace('.', ',')
-            except Exception:
-                new_values[mq_fatt_pz_index] = ""
-            # --- FINE AGGIORNAMENTO AUTOMATICO Mq_fatt_pz ---
-            
-            # --- AGGIORNAMENTO AUTOMATICO Mq_totali_fatt ---
-            try:
-                mq_fatt_pz_index = self.colonne.index("Mq_fatt_pz")
-                nr_pezzi_index = self.colonne.index("nr. pezzi")
-                mq_totali_fatt_index = self.colonne.index("Mq_totali_fatt")
-                mq_fatt_pz_val = new_values[mq_fatt_pz_index] if mq_fatt_pz_index < len(new_values) else ""
-                nr_pezzi_val = new_values[nr_pezzi_index] if nr_pezzi_index < len(new_values) else ""
-                mq_fatt_pz_float = float(mq_fatt_pz_val.replace(",", ".")) if mq_fatt_pz_val else 0.0
-                nr_pezzi_float = float(nr_pezzi_val.replace(",", ".")) if nr_pezzi_val else 0.0
-                mq_totali_fatt = mq_fatt_pz_float * nr_pezzi_float
-                new_values[mq_totali_fatt_index] = f"{mq_totali_fatt:.2f}".replace('.', ',')
-            except Exception:
-                new_values[mq_totali_fatt_index] = ""
-            # --- FINE AGGIORNAMENTO AUTOMATICO Mq_totali_fatt ---
-            
-            # --- AGGIORNAMENTO AUTOMATICO Ml_totali_fatt ---
-            try:
-                mir_index = self.colonne.index("MIR")
-                nr_pezzi_index = self.colonne.index("nr. pezzi")
-                ml_totali_fatt_index = self.colonne.index("Ml_totali_fatt")
-                mir_val = new_values[mir_index] if mir_index < len(new_values) else ""
-                nr_pezzi_val = new_values[nr_pezzi_index] if nr_pezzi_index < len(new_values) else ""
-                mir_float = float(mir_val.replace(",", ".")) if mir_val else 0.0
-                nr_pezzi_float = float(nr_pezzi_val.replace(",", ".")) if nr_pezzi_val else 0.0
-                ml_totali_fatt = mir_float * nr_pezzi_float
-                new_values[ml_totali_fatt_index] = f"{ml_totali_fatt:.2f}".replace('.', ',')
-            except Exception:
-                new_values[ml_totali_fatt_index] = ""
-            # --- FINE AGGIORNAMENTO AUTOMATICO Ml_totali_fatt ---
-            
-            # --- AGGIORNAMENTO AUTOMATICO COLONNE CALCOLATE ---
-            try:
-                prezzo_listino_index = self.colonne.index("Prezzo_listino")
-                sconto_decimali_index = self.colonne.index("Sconto in decimali")
-                mq_fatt_pz_index = self.colonne.index("Mq_fatt_pz")
-                mq_totali_fatt_index = self.colonne.index("Mq_totali_fatt")
-                costo_scontato_mq_index = self.colonne.index("Costo_scontato_Mq")
-                prezzo_listino_unitario_index = self.colonne.index("Prezzo_listino_unitario")
-                costo_serramento_listino_posizione_index = self.colonne.index("Costo_serramento_listino_posizione")
-                costo_serramento_scontato_posizione_index = self.colonne.index("Costo_serramento_scontato_posizione")
-
-                prezzo_listino_val = new_values[prezzo_listino_index] if prezzo_listino_index < len(new_values) else ""
-                if isinstance(prezzo_listino_val, str):
-                    # Prendi solo la parte numerica (gestione "€" e formati)
-                    import re
-                    match = re.search(r"([\d.,]+)", prezzo_listino_val)
-                    if match:
-                        prezzo_listino_val = match.group(1).replace(".", "").replace(",", ".")
-                    else:
-                        prezzo_listino_val = "0"
-                try:
-                    prezzo_listino_float = float(prezzo_listino_val)
-                except Exception:
-                    prezzo_listino_float = 0.0
-                sconto_decimali_val = new_values[sconto_decimali_index] if sconto_decimali_index < len(new_values) else "0"
-                sconto_decimali_val = sconto_decimali_val.strip().replace("%", "")
-                sconto_decimali_val = sconto_decimali_val.replace(",", ".")
-                try:
-                    sconto_decimali_float = float(sconto_decimali_val)
-                    if sconto_decimali_float > 1:
-                        sconto_decimali_float = sconto_decimali_float / 100.0
-                except Exception:
-                    sconto_decimali_float = 0.0
-                logging.debug("SCONTO_DECIMALI ORIGINALE: '%s' -> float: %s", new_values[sconto_decimali_index], sconto_decimali_float)
-                mq_fatt_pz_val = new_values[mq_fatt_pz_index] if mq_fatt_pz_index < len(new_values) else ""
-                mq_fatt_pz_val = mq_fatt_pz_val.replace(",", ".") if isinstance(mq_fatt_pz_val, str) else "0"
-                try:
-                    mq_fatt_pz_float = float(mq_fatt_pz_val)
-                except Exception:
-                    mq_fatt_pz_float = 0.0
-                mq_totali_fatt_val = new_values[mq_totali_fatt_index] if mq_totali_fatt_index < len(new_values) else ""
-                mq_totali_fatt_val = mq_totali_fatt_val.replace(",", ".") if isinstance(mq_totali_fatt_val, str) else "0"
-                try:
-                    mq_totali_fatt_float = float(mq_totali_fatt_val)
-                except Exception:
-                    mq_totali_fatt_float = 0.0
-
-                costo_scontato_mq = prezzo_listino_float * (1 - sconto_decimali_float)
-                prezzo_listino_unitario = prezzo_listino_float * mq_fatt_pz_float
-                costo_serramento_listino_posizione = prezzo_listino_float * mq_totali_fatt_float
-                costo_serramento_scontato_posizione = costo_scontato_mq * mq_totali_fatt_float
-
-                def euro(val):
-                    return f"€ {val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") if val else ""
-                if costo_scontato_mq_index < len(new_values):
-                    new_values[costo_scontato_mq_index] = euro(costo_scontato_mq)
-                if prezzo_listino_unitario_index < len(new_values):
-                    new_values[prezzo_listino_unitario_index] = euro(prezzo_listino_unitario)
-                if costo_serramento_listino_posizione_index < len(new_values):
-                    new_values[costo_serramento_listino_posizione_index] = euro(costo_serramento_listino_posizione)
-                if costo_serramento_scontato_posizione_index < len(new_values):
-                    new_values[costo_serramento_scontato_posizione_index] = euro(costo_serramento_scontato_posizione)
-            except Exception as e:
-                print(f"[DEBUG] Errore colonne calcolate: {e}")
-                if 'costo_scontato_mq_index' in locals() and costo_scontato_mq_index < len(new_values):
-                    new_values[costo_scontato_mq_index] = ""
-                if 'prezzo_listino_unitario_index' in locals() and prezzo_listino_unitario_index < len(new_values):
-                    new_values[prezzo_listino_unitario_index] = ""
-                if 'costo_serramento_listino_posizione_index' in locals() and costo_serramento_listino_posizione_index < len(new_values):
-                    new_values[costo_serramento_listino_posizione_index] = ""
-                if 'costo_serramento_scontato_posizione_index' in locals() and costo_serramento_scontato_posizione_index < len(new_values):
-                    new_values[costo_serramento_scontato_posizione_index] = ""
-            
-            # --- AGGIORNAMENTO AUTOMATICO CAMPI DISTANZIALI/IMBOTTI ---
-            try:
-                # Indici dei campi
-                dist_index = self.colonne.index("Dist.")
-                tipo_dist_index = self.colonne.index("Tipo dist.")
-                distanziali_imbotti_index = self.colonne.index("Distanziali/Imbotti")
-                tipo_distanziali_imbotti_index = self.colonne.index("Tipo distanziali/imbotti")
-                dicitura_distanziale_imbotte_index = self.colonne.index("Dicitura distanziale/imbotte")
-                colore_index = self.colonne.index("Colore")
-                colore_dist_imb_index = self.colonne.index("Colore dist/imb")
-
-                # Calcolo "Distanziali/Imbotti" = SE(O([Dist.]=="",[Dist.]=="NO"),0,1)
-                dist_val = new_values[dist_index] if dist_index < len(new_values) else ""
-                distanziali_imbotti = "0"
-                if dist_val and dist_val != "NO":
-                    distanziali_imbotti = "1"
-                if distanziali_imbotti_index < len(new_values):
-                    new_values[distanziali_imbotti_index] = distanziali_imbotti
-                
-                # Calcolo "Tipo distanziali/imbotti" = SE([@[Tipo dist.]]="IMBOTTE";2;SE([@[Tipo dist.]]="SALDATO";3;1))
-                tipo_dist_val = new_values[tipo_dist_index] if tipo_dist_index < len(new_values) else ""
-                tipo_distanziali_imbotti = "1"  # Valore predefinito
-                if tipo_dist_val == "IMBOTTE":
-                    tipo_distanziali_imbotti = "2"
-                elif tipo_dist_val == "SALDATO":
-                    tipo_distanziali_imbotti = "3"
-                if tipo_distanziali_imbotti_index < len(new_values):
-                    new_values[tipo_distanziali_imbotti_index] = tipo_distanziali_imbotti
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento dei campi distanziali/imbotti: {e}")
-            
-            # --- AGGIORNAMENTO AUTOMATICO N. DISTANZIALI A 3 LATI ---
-            try:
-                n_distanziali_a_3_lati_index = self.colonne.index("N. distanziali a 3 lati")
-                nr_pezzi_index = self.colonne.index("nr. pezzi")
-                dist_index = self.colonne.index("Dist.")
-                
-                nr_pezzi_val = new_values[nr_pezzi_index] if nr_pezzi_index < len(new_values) else ""
-                dist_val = new_values[dist_index] if dist_index < len(new_values) else ""
-                
-                n_distanziali_a_3_lati = ""
-                # Calcolo "N. distanziali a 3 lati" = SE([@[Distanziali/Imbotti]]=1;[@[nr. pezzi]]*3;"")
-                # Dove Distanziali/Imbotti = 1 se Dist. è valorizzato e diverso da "NO"
-                if dist_val and dist_val != "NO":
-                    try:
-                        n_pezzi_val = float(str(nr_pezzi_val).replace(",", ".")) if nr_pezzi_val else 0
-                        n_distanziali_a_3_lati = str(int(n_pezzi_val * 3))
-                    except (ValueError, TypeError):
-                        n_distanziali_a_3_lati = ""
-                
-                if n_distanziali_a_3_lati_index < len(new_values):
-                    new_values[n_distanziali_a_3_lati_index] = n_distanziali_a_3_lati
-                    print(f"[DEBUG] N. distanziali a 3 lati aggiornato a: {n_distanziali_a_3_lati}")
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di N. distanziali a 3 lati: {e}")
-                
-            # --- AGGIORNAMENTO AUTOMATICO DICITURA DISTANZIALE/IMBOTTE ---
-            try:
-                dicitura_distanziale_imbotte_index = self.colonne.index("Dicitura distanziale/imbotte")
-                tipo_distanziali_imbotti_index = self.colonne.index("Tipo distanziali/imbotti")
-                
-                tipo_distanziali_imbotti = new_values[tipo_distanziali_imbotti_index] if tipo_distanziali_imbotti_index < len(new_values) else ""
-                
-                # Calcolo "Dicitura distanziale/imbotte" = SE([@[Tipo distanziali/imbotti]]=3;"DS - SALDATO";SE([@[Tipo distanziali/imbotti]]=2;"I - IMBOTTE";""))
-                dicitura_distanziale_imbotte = ""
-                if tipo_distanziali_imbotti == "3":
-                    dicitura_distanziale_imbotte = "DS - SALDATO"
-                elif tipo_distanziali_imbotti == "2":
-                    dicitura_distanziale_imbotte = "I - IMBOTTE"
-                
-                if dicitura_distanziale_imbotte_index < len(new_values):
-                    new_values[dicitura_distanziale_imbotte_index] = dicitura_distanziale_imbotte
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di Dicitura distanziale/imbotte: {e}")
-                
-            # --- LOGICA COLORE DIST/IMB anche in modifica ---
-            try:
-                colore_index = self.colonne.index("Colore")
-                colore_dist_imb_index = self.colonne.index("Colore dist/imb")
-                
-                colore_val = new_values[colore_index] if colore_index < len(new_values) else ""
-                colore_dist_imb = ""
-                if colore_val == "STANDARD RAL":
-                    colore_dist_imb = "1"
-                elif colore_val == "EFFETTO LEGNO":
-                    colore_dist_imb = "2"
-                elif colore_val == "GREZZO":
-                    colore_dist_imb = "3"
-                elif colore_val == "EXTRA MAZZETTA":
-                    colore_dist_imb = "4"
-                if colore_dist_imb_index < len(new_values):
-                    new_values[colore_dist_imb_index] = colore_dist_imb
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento di Colore dist/imb: {e}")
-            # --- FINE LOGICA COLORE DIST/IMB ---
-            
-            # --- AGGIORNAMENTO AUTOMATICO CAMPI DA N.ANTE A DICITURA SCONTO E UNITA_DI_MISURA ---
-            try:
-                # N.ANTE, AP., TIP., DESCR.TIP, N.CERN., XLAV, MULT., COSTO MLT, MIN.1-5, P.SERR., N.STAFF.
-                # (già gestiti da entries, ma se vuoti e disponibili nel DataFrame, aggiorna)
-                modello_index = self.colonne.index("Modello")
-                serramento_index = self.colonne.index("Serramento")
-                modello_val = new_values[modello_index] if modello_index < len(new_values) else ""
-                serramento_val = new_values[serramento_index] if serramento_index < len(new_values) else ""
-                if self.dataframe is not None and serramento_val:
-                    riga = self.dataframe[self.dataframe.iloc[:, 0] == serramento_val]
-                    if not riga.empty:
-                        mapping = {
-                            "NUMERO ANTE": "N.ANTE",
-                            "APERTURA": "AP.",
-                            "TIPOLOGIA": "TIP.",
-                            "DESCRIZIONE TIPOLOGIA": "DESCR.TIP",
-                            "N. CERNIERE": "N.CERN.",
-                            "EXTRA LAVORAZIONE": "XLAV",
-                            "MULTIPLO": "MULT.",
-                            "COSTO MULTIPLO": "COSTO MLT",
-                            "MINIMI 1": "MIN.1",
-                            "MINIMI 2": "MIN.2",
-                            "MINIMI 3": "MIN.3",
-                            "MINIMI 4": "MIN.4",
-                            "MINIMI 5": "MIN.5",
-                            "Presenza serratura": "P.SERR.",
-                            "Numero staffette": "N.STAFF."
-                        }
-                        for df_col, col_name in mapping.items():
-                            idx = self.colonne.index(col_name)
-                            if idx < len(new_values) and (not new_values[idx] or new_values[idx] == ""):
-                                try:
-                                    value = riga[df_col].iloc[0]
-                                    print(f"[DEBUG] Mapping {df_col} -> {col_name}: {value}")
-                                    new_values[idx] = str(value)
-                                except Exception:
-                                    pass
-                # Unita_di_misura
-                unita_idx = self.colonne.index("Unita_di_misura")
-                unita_di_misura = ""
-                try:
-                    if modello_val:
-                        riga_listino = listino[listino['MODELLO'] == modello_val]
-                        if not riga_listino.empty:
-                            for col in riga_listino.columns:
-                                if col.lower().replace('à','a').replace(' ','_') == 'unita_di_misura':
-                                    unita_di_misura = riga_listino.iloc[0][col]
-                                    break
-                except Exception as e:
-                    unita_di_misura = f"Errore: {e}"
-                if unita_idx < len(new_values):
-                    new_values[unita_idx] = unita_di_misura
-            except Exception as e:
-                print(f"[DEBUG] Errore aggiornamento automatico campi da N.ANTE a Unita_di_misura: {e}")
-            # --- FINE AGGIORNAMENTO ---
-            
-            # --- DEBUG LOG: valori prima di aggiornare la riga in save_edited_row ---
-            print("[DEBUG save_edited_row] new_values prima dell'update:", new_values)
+            log.debug("save_edited_row: nuovi valori prima dell'aggiornamento %s", new_values)
             
-            # Aggiorna la riga nel Treeview
-            self.tree.item(item, values=new_values)
+            # Ricalcola la riga solo se è cambiato almeno un campo da cui dipendono i derivati
+            corrente = self.posizioni[item]
+            nuova = Posizione.da_testi(new_values)
+            if any(nuova[col] != corrente[col] for col in COLONNE_SORGENTE):
+                self.aggiorna_posizione(item, nuova)
+                self.segna_da_ricalcolare(item)
+                self.ricalcola_righe_modificate()
+                self._registra("modifica", item, self.posizioni[item].valori())
             
             # Chiudi la finestra di dialogo
             dialog.destroy()
             
             # Aggiorna l'oggetto preventivo
             self.salva_in_preventivo()
-            # Aggiorna tutti i campi controtelaio per tutte le righe
-            self.aggiorna_tutti_campi_controtelaio_treeview()
             
         except Exception as e:
             messagebox.showerror("Errore", f"Si è verificato un errore durante il salvataggio: {str(e)}")
@@ -2521,122 +1392,115 @@ class PosizioniFrame(ttk.Frame):
             # Mostra il menu contestuale nella posizione del click
             self.context_menu.post(event.x_root, event.y_root)
 
-    def load_data_from_preventivo(self):
-        """
-        Carica i dati dal file preventivo.py se esiste.
-        """
-        try:
-            # Verifica se il file preventivo.py esiste
-            if os.path.exists("preventivo.py"):
-                # Importa il modulo preventivo
-                import importlib.util
-                spec = importlib.util.spec_from_file_location("preventivo", "preventivo.py")
-                preventivo = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(preventivo)
-                
-                # Verifica se la variabile dati_posizioni esiste nel modulo
-                if hasattr(preventivo, "dati_posizioni"):
-                    # Trova il valore massimo di pos per impostare il contatore
-                    max_pos = 0
-                    
-                    # Carica i dati nel Treeview
-                    for dati in preventivo.dati_posizioni:
-                        values = [
-                            dati.get('pos', ''),
-                            dati.get('nr_pezzi', ''),
-                            dati.get('serramento', ''),
-                            dati.get('modello', ''),
-                            dati.get('modello_grata_combinato', ''),
-                            dati.get('colore', ''),
-                            dati.get('l_mm', ''),
-                            dati.get('h_mm', ''),
-                            dati.get('tipo_telaio', ''),
-                            dati.get('bunk', ''),
-                            dati.get('dmcp', ''),
-                            dati.get('defender', ''),
-                            dati.get('dist', ''),
-                            dati.get('tipo_dist', ''),
-                            dati.get('l_dist', ''),
-                            dati.get('h_dist', ''),
-                            dati.get('tipo_controtelaio', ''),
-                            dati.get('anta_giro', ''),
-                            dati.get('mrib', ''),
-                            dati.get('NUMERO ANTE', ''),
-                            dati.get('APERTURA', ''),
-                            dati.get('TIPOLOGIA', ''),
-                            dati.get('DESCRIZIONE TIPOLOGIA', ''),
-                            dati.get('N. CERNIERE', ''),
-                            dati.get('EXTRA LAVORAZIONE', ''),
-                            dati.get('MULTIPLO', ''),
-                            dati.get('COSTO MULTIPLO', ''),
-                            dati.get('MINIMI 1', ''),
-                            dati.get('MINIMI 2', ''),
-                            dati.get('MINIMI 3', ''),
-                            dati.get('MINIMI 4', ''),
-                            dati.get('MINIMI 5', ''),
-                            dati.get('Presenza serratura', ''),
-                            dati.get('Numero staffette', ''),
-                            dati.get('Sconto 1', ''),
-                            dati.get('Sconto 2', ''),
-                            dati.get('Sconto 3', ''),
-                            dati.get('Sconto in decimali', ''),
-                            dati.get('Dicitura sconto', ''),
-                            dati.get('Prezzo_listino', ''),
-                            dati.get('MqR', ''),
-                            dati.get('MIR', ''),
-                            dati.get('Tabella_minimi', ''),
-                            dati.get('Unita_di_misura', ''),
-                            dati.get('Min_fatt_pz', ''),
-                            dati.get('Mq_fatt_pz', ''),
-                            dati.get('Mq_totali_fatt', ''),
-                            dati.get('Ml_totali_fatt', ''),
-                            dati.get('Costo_scontato_Mq', ''),
-                            dati.get('Prezzo_listino_unitario', ''),
-                            dati.get('Costo_serramento_listino_posizione', ''),
-                            dati.get('Costo_serramento_scontato_posizione', '')
-                        ]
-                        
-                        # Assicura che la lista abbia esattamente len(self.colonne) elementi
-                        if len(values) < len(self.colonne):
-                            values.extend([""] * (len(self.colonne) - len(values)))
-                        elif len(values) > len(self.colonne):
-                            values = values[:len(self.colonne)]
-                        self.tree.insert("", "end", values=values)
-                        
-                        # Aggiorna il valore massimo di pos
-                        pos = dati.get('pos', 0)
-                        if isinstance(pos, (int, float)) and pos > max_pos:
-                            max_pos = pos
-                    
-                    # Imposta il contatore della posizione
-                    self.pos_counter = max_pos + 1
-                    self.pos_label.config(text=str(self.pos_counter))
-        except Exception as e:
-            print(f"Errore durante il caricamento dei dati dal file preventivo.py: {e}")
-            
     def aggiorna_da_preventivo(self):
         """Aggiorna la tabella delle posizioni leggendo i dati dal preventivo centrale."""
         if hasattr(self, 'tree'):
-            self.tree.delete(*self.tree.get_children())
+            self.tabella.svuota()
+            self.posizioni.clear()
+            self.tag_posizioni.clear()
+            self.versioni_posizioni.clear()
             if self.preventivo and hasattr(self.preventivo, 'posizioni') and self.preventivo.posizioni:
+                # Le posizioni possono essere record Posizione oppure dict letti dal file JSON
                 for posizione in self.preventivo.posizioni:
-                    values = [posizione.get(col, "") for col in self.colonne]
-                    if len(values) < len(self.colonne):
-                        values.extend([""] * (len(self.colonne) - len(values)))
-                    elif len(values) > len(self.colonne):
-                        values = values[:len(self.colonne)]
-                    self.tree.insert("", "end", values=values)
+                    self.inserisci_posizione(Posizione.da_dict(posizione))
                 self.aggiorna_contatore_posizione()
+            self.registra_stato()
+
+    def _chiave_giornale(self):
+        """Chiave del giornale: percorso del file del preventivo, altrimenti numero di protocollo."""
+        percorso = getattr(self.app, 'percorso_preventivo_corrente', None) if self.app else None
+        if percorso:
+            return f"file:{os.path.normcase(os.path.abspath(percorso))}"
+        for chiave_dati in ('dati_b2', 'dati_b1'):
+            dati = getattr(self.preventivo, chiave_dati, None) or {}
+            protocollo = str(dati.get('numero_protocollo') or dati.get('Numero_protocollo') or '').strip()
+            if protocollo:
+                return f"protocollo:{protocollo}"
+        # Preventivo nuovo senza protocollo: un giornale rimasto da una sessione interrotta si ripropone
+        return "nuovo"
+
+    def aggiorna_chiave_giornale(self):
+        """Dopo un salvataggio con nome il giornale passa alla chiave del nuovo file."""
+        chiave = self._chiave_giornale()
+        if chiave == self.giornale.chiave:
+            return
+        self.chiudi_giornale()
+        self.giornale = GiornalePosizioni(chiave, self.cartella_giornale)
+        self.registra_stato()
+
+    def leggi_giornale(self):
+        """Rilegge il giornale delle posizioni: lista di coppie (id, valori), vuota se non c'è nulla da ripristinare."""
+        try:
+            return self.giornale.leggi()
+        except Exception as e:
+            log.error("Errore nella lettura del giornale posizioni: %s", e)
+            return []
+
+    def ripristina_da_giornale(self, righe):
+        """Ricostruisce la tabella dalle righe rilette dal giornale (vedi leggi_giornale)."""
+        self.tabella.svuota()
+        self.posizioni.clear()
+        self.tag_posizioni.clear()
+        self.versioni_posizioni.clear()
+        for _, valori in righe:
+            self.inserisci_posizione(Posizione(valori))
+        self.rinumera_posizioni()
+        self.registra_stato()
+        self.salva_in_preventivo()
+
+    def registra_stato(self):
+        """Compatta il giornale in un'istantanea delle posizioni correnti."""
+        try:
+            self.giornale.compatta([(item, self.posizioni[item].valori()) for item in self.tabella.righe])
+        except Exception as e:
+            log.error("Errore nella compattazione del giornale posizioni: %s", e)
+
+    def _registra(self, operazione, *args):
+        """Aggiunge un'operazione (inserisci, modifica, elimina) al giornale, compattandolo quando è cresciuto troppo."""
+        try:
+            getattr(self.giornale, operazione)(*args)
+            if self.giornale.deve_compattare():
+                self.registra_stato()
+        except Exception as e:
+            log.error("Errore nella scrittura del giornale posizioni: %s", e)
+
+    def chiudi_giornale(self):
+        """Chiusura regolare della sessione: il giornale non serve più e viene svuotato."""
+        try:
+            self.giornale.azzera()
+        except Exception as e:
+            log.error("Errore nella chiusura del giornale posizioni: %s", e)
+
+    def inserisci_posizione(self, posizione, indice="end"):
+        """Registra una Posizione come nuova riga della tabella (in coda o alla posizione `indice`)."""
+        item = self.tabella.inserisci(indice)
+        self.posizioni[item] = posizione
+        self.tag_posizioni[item] = self._tag_gruppi(posizione)
+        self._nuova_versione(item)
+        return item
+
+    def aggiorna_posizione(self, item, posizione):
+        """Sostituisce la Posizione associata a una riga e ne aggiorna la vista (se la riga è visibile)."""
+        self.posizioni[item] = posizione
+        self.tag_posizioni[item] = self._tag_gruppi(posizione)
+        self._nuova_versione(item)
+        self.tabella.aggiorna_riga(item)
+
+    def _nuova_versione(self, item):
+        """Segna il record della riga come cambiato (vedi versioni_posizioni)."""
+        self._ultima_versione += 1
+        self.versioni_posizioni[item] = self._ultima_versione
+
+    def _tag_gruppi(self, posizione):
+        """Tag dei gruppi di colonne (vedi GRUPPI_TAG) in cui la riga ha almeno un valore."""
+        valori = posizione.formattati()
+        return tuple(gruppo for gruppo, (inizio, fine) in GRUPPI_TAG.items() if any(valori[inizio:fine + 1]))
 
     def get_all_posizioni(self):
-        """Restituisce tutte le posizioni attualmente inserite nella tabella come lista di dict."""
-        posizioni = []
-        if hasattr(self, 'tree'):
-            for item in self.tree.get_children():
-                valori = self.tree.item(item, 'values')
-                posizione_dict = {col: valori[idx] if idx < len(valori) else "" for idx, col in enumerate(self.colonne)}
-                posizioni.append(posizione_dict)
-        return posizioni
+        """Restituisce tutte le posizioni della tabella, nell'ordine delle righe, come record Posizione."""
+        if not hasattr(self, 'tabella'):
+            return []
+        return [self.posizioni[item] for item in self.tabella.righe]
 
     def salva_in_preventivo(self):
         """Aggiorna l'oggetto preventivo con i dati attuali della tabella."""
@@ -2659,10 +1523,9 @@ class PosizioniFrame(ttk.Frame):
         """Salva il preventivo corrente tramite l'app principale."""
         if self.app and hasattr(self.app, '_salva_preventivo'):
             try:
+                # Il salvataggio prosegue in background: l'esito compare nella barra di stato
                 result = self.app._salva_preventivo()
-                if result:
-                    messagebox.showinfo("Salvataggio riuscito", "Preventivo salvato correttamente.")
-                else:
+                if not result:
                     messagebox.showerror("Errore", "Errore durante il salvataggio del preventivo.")
             except Exception as e:
                 messagebox.showerror("Errore", f"Errore durante il salvataggio del preventivo: {str(e)}")
@@ -2708,7 +1571,7 @@ class PosizioniFrame(ttk.Frame):
 
     def duplica_riga_selezionata(self):
         """
-        Duplica la riga attualmente selezionata nel Treeview, inserendo la copia subito dopo la riga madre e rinumerando tutte le righe per mantenere la coerenza della colonna Pos.
+        Duplica la riga attualmente selezionata nel Treeview, inserendo la copia subito dopo la riga madre e rinumerando le righe successive per mantenere la coerenza della colonna Pos.
         """
         selected = self.tree.selection()
         if not selected:
@@ -2716,30 +1579,41 @@ class PosizioniFrame(ttk.Frame):
             return
         
         item = selected[0]
-        values = list(self.tree.item(item, 'values'))
-        all_items = self.tree.get_children()
-        idx = all_items.index(item)
+        posizione = self.posizioni[item]
+        idx = self.tabella.indice(item)
         # Inserisci la riga duplicata subito dopo la riga madre
-        self.tree.insert('', idx + 1, values=values)
-        # Rinumera tutte le righe in modo sequenziale
-        for i, item_id in enumerate(self.tree.get_children(), start=1):
-            vals = list(self.tree.item(item_id, "values"))
-            vals[0] = i
-            self.tree.item(item_id, values=vals)
-        self.aggiorna_contatore_posizione()
+        copia = self.inserisci_posizione(posizione.copia(), idx + 1)
+        if self.calcoli.in_corso():
+            # La riga madre sta per ricevere i valori del calcolo in corso, la copia no: la si calcola subito
+            self.segna_da_ricalcolare(copia)
+            self.ricalcola_righe_modificate()
+        # Rinumera solo la copia e le righe successive
+        self.rinumera_posizioni(idx + 1)
+        self._registra("inserisci", copia, self.posizioni[copia].valori(), idx + 1)
         self.salva_in_preventivo()
 
-    def aggiorna_contatore_posizione(self):
-        """Aggiorna il contatore posizione in base al massimo valore di Pos. presente nel Treeview."""
-        max_pos = 0
-        for item in self.tree.get_children():
-            try:
-                pos = int(self.tree.item(item)["values"][0])
-                if pos > max_pos:
-                    max_pos = pos
-            except Exception:
+    def rinumera_posizioni(self, da_indice=0):
+        """
+        Riallinea la colonna Pos. all'ordine delle righe a partire dalla riga `da_indice` (0 = tutte).
+        Aggiorna il campo Pos. dei record interessati e, per le sole righe materializzate nel
+        Treeview, la cella Pos. con un unico script Tcl invece di riscrivere l'intera tupla di valori.
+        """
+        percorso = str(self.tree)
+        materializzate = set(self.tree.get_children())
+        comandi = []
+        for pos, item in enumerate(self.tabella.righe[da_indice:], start=da_indice + 1):
+            if self.posizioni[item]["Pos."] == pos:
                 continue
-        self.pos_counter = max_pos + 1
+            self.posizioni[item]["Pos."] = pos
+            if item in materializzate:
+                comandi.append(f"{percorso} set {{{item}}} {{Pos.}} {pos}")
+        if comandi:
+            self.tree.tk.eval("\n".join(comandi))
+        self.aggiorna_contatore_posizione()
+
+    def aggiorna_contatore_posizione(self):
+        """Aggiorna il contatore posizione: le posizioni sono numerate in base all'ordine delle righe."""
+        self.pos_counter = len(self.tabella) + 1
         self.pos_label.config(text=str(self.pos_counter))
 
     def update_pos_label(self):
@@ -2748,60 +1622,34 @@ class PosizioniFrame(ttk.Frame):
 
     def aggiorna_tutti_gli_sconti_treeview(self):
         """
-        Aggiorna tutti i campi sconto di tutte le righe del Treeview con i valori attuali di self.preventivo.dati_b1.
+        Applica a tutte le posizioni gli sconti attuali di self.preventivo.dati_b1: campi sconto e costi
+        scontati vengono ricalcolati in un solo passaggio del motore prezzi (in background se le righe
+        sono molte), poi la vista si aggiorna una volta.
         """
-        def format_percent(val):
-            try:
-                v = str(val).replace('%', '').replace(',', '.').strip()
-                if v == '' or v.lower() == 'nan':
-                    return ''
-                v = float(v)
-                return f"{v:.2f} %".replace('.', ',')
-            except Exception:
-                return str(val)
-        def format_dicitura_sconto(dicitura):
-            def repl(match):
-                try:
-                    v = float(match.group(1).replace(',', '.'))
-                    return f"{v:.2f} %".replace('.', ',')
-                except Exception:
-                    return match.group()
-            # Sostituisce ogni numero (intero o decimale) non già seguito da % con la formattazione corretta
-            return re.sub(r'\b\d+[\.,]?\d*\b(?!\s*%)', repl, str(dicitura))
         if not (self.preventivo and hasattr(self.preventivo, 'dati_b1')):
-            print("[DEBUG aggiorna_tutti_gli_sconti_treeview] Nessun dati_b1 presente nel preventivo.")
+            log.debug("aggiorna_tutti_gli_sconti_treeview: nessun dati_b1 presente nel preventivo")
             return
-        dati_b1 = self.preventivo.dati_b1
-        def get_sconto_value(dati_b1, *keys):
-            for k in keys:
-                if k in dati_b1:
-                    return dati_b1[k]
-            return ""
-        sconto_1 = format_percent(get_sconto_value(dati_b1, 'Sconto 1', 'Sconto1'))
-        sconto_2 = format_percent(get_sconto_value(dati_b1, 'Sconto 2', 'Sconto2'))
-        sconto_3 = format_percent(get_sconto_value(dati_b1, 'Sconto 3', 'Sconto3'))
-        sconto_decimali = format_percent(get_sconto_value(dati_b1, 'Sconto in decimali', 'Sconto_in_decimali'))
-        dicitura_sconto = format_dicitura_sconto(get_sconto_value(dati_b1, 'Dicitura sconto', 'Dicitura_sconto'))
-        print(f"[DEBUG aggiorna_tutti_gli_sconti_treeview] Nuovi valori: S1={sconto_1}, S2={sconto_2}, S3={sconto_3}, Sdec={sconto_decimali}, Dic={dicitura_sconto}")
-        for item in self.tree.get_children():
-            values = list(self.tree.item(item, "values"))
-            try:
-                s1_index = self.colonne.index("Sconto 1")
-                s2_index = self.colonne.index("Sconto 2")
-                s3_index = self.colonne.index("Sconto 3")
-                sdec_index = self.colonne.index("Sconto in decimali")
-                ds_index = self.colonne.index("Dicitura sconto")
-                values[s1_index] = sconto_1
-                values[s2_index] = sconto_2
-                values[s3_index] = sconto_3
-                values[sdec_index] = sconto_decimali
-                values[ds_index] = dicitura_sconto
-                self.tree.item(item, values=values)
-            except Exception as e:
-                print(f"[DEBUG aggiorna_tutti_gli_sconti_treeview] Errore aggiornando item {item}: {e}")
-        print("[DEBUG aggiorna_tutti_gli_sconti_treeview] Aggiornamento completato.")
+        if self.calcoli.in_corso("ricalcolo"):
+            # Il ricalcolo completo in corso usa gli sconti vecchi: si riparte con quelli nuovi
+            self.ricalcola_tutto()
+            return
+        items = list(self.tabella.righe)
+        if items:
+            self._calcola("sconti", sconti_valori, items, self._applica_sconti)
         self.restore_treeview_column_widths()
 
+    def _applica_sconti(self, items, originali, risultato, versioni):
+        """Applica i campi sconto calcolati da sconti_valori alle righe non modificate nel frattempo."""
+        colonne, righe = risultato
+        nuove = []
+        for originale, valori in zip(originali, righe):
+            posizione = originale.copia()
+            for col, valore in zip(colonne, valori):
+                posizione[col] = valore
+            nuove.append(posizione)
+        self._sostituisci_posizioni(items, versioni, nuove, aggiorna_tag=False)
+        log.debug("aggiorna_tutti_gli_sconti_treeview: aggiornamento completato")
+
     def save_treeview_column_widths(self):
         """Salva le larghezze delle colonne del Treeview in un attributo."""
         if not hasattr(self, '_treeview_col_widths'):
@@ -2826,12 +1674,16 @@ class PosizioniFrame(ttk.Frame):
                     self.tree.column(col, width=width, minwidth=min_width, stretch=False)
                 except Exception:
                     pass
+            if hasattr(self, 'intestazioni'):
+                self.intestazioni.invalida()
 
     def bind_treeview_column_resize(self):
         """Associa il salvataggio delle larghezze colonne dopo ogni ridimensionamento."""
         def on_release(event):
             # Salva le larghezze delle colonne
             self.save_treeview_column_widths()
+            if hasattr(self, 'intestazioni'):
+                self.intestazioni.invalida()
             
             # Definisci colonne che possono essere più strette
             colonne_strette = ["Pos.", "nr. pezzi", "L (mm)", "H (mm)", "Defender", "Dist.", "M.rib."]
@@ -2851,260 +1703,129 @@ class PosizioniFrame(ttk.Frame):
                 
         self.tree.bind('<ButtonRelease-1>', on_release)
 
-    def aggiorna_tutti_campi_controtelaio_treeview(self):
-        """Aggiorna tutti i campi relativi al controtelaio nel treeview."""
-        for item in self.tree.get_children():
-            try:
-                values = self.tree.item(item)['values']
-                if not values:
-                    continue
-
-                # Ottieni i valori necessari
-                tipo_controtelaio = values[self.colonne.index("Tipologia controtelaio")] if "Tipologia controtelaio" in self.colonne else ""
-                nr_pezzi = values[self.colonne.index("nr. pezzi")] if "nr. pezzi" in self.colonne else ""
-                mir = values[self.colonne.index("Ml_totali_fatt")] if "Ml_totali_fatt" in self.colonne else ""
-                costo_ml_controtelaio_singolo = values[self.colonne.index("Costo al ml controtelaio singolo")] if "Costo al ml controtelaio singolo" in self.colonne else ""
-
-                def set_val(col, val):
-                    try:
-                        col_index = self.colonne.index(col)
-                        if col_index < len(values):
-                            values[col_index] = val
-                    except Exception as e:
-                        print(f"[DEBUG] Errore nell'aggiornamento di {col}: {e}")
-
-                # Calcolo Tipologia ml/nr. Pezzi
-                tipologia_ml_nr_pezzi = ""
-                try:
-                    if tipo_controtelaio:
-                        row = controtelaio[controtelaio["CONTROTELAIO"] == tipo_controtelaio]
-                        if not row.empty:
-                            tipologia_ml_nr_pezzi = str(row.iloc[0]["Ml / nr. Pezzi"])
-                except Exception as e:
-                    print(f"[DEBUG] Errore nel calcolo della tipologia ml/nr. pezzi: {e}")
-                    tipologia_ml_nr_pezzi = ""
-
-                set_val("Tipologia ml/nr. Pezzi", tipologia_ml_nr_pezzi)
-
-                # Calcolo Fattore moltiplicatore ml/nr. Pezzi
-                fattore_moltiplicatore = "1"
-                try:
-                    if tipo_controtelaio and tipo_controtelaio != "0":
-                        if tipologia_ml_nr_pezzi == "1":
-                            fattore_moltiplicatore = "1"
-                        elif tipologia_ml_nr_pezzi == "2":
-                            try:
-                                ml_totali = float(mir.replace(",", ".")) if mir else 0
-                                nr_pezzi_val = float(nr_pezzi.replace(",", ".")) if nr_pezzi else 0
-                                if nr_pezzi_val > 0:
-                                    fattore_moltiplicatore = str(round(ml_totali / nr_pezzi_val, 2))
-                                else:
-                                    fattore_moltiplicatore = "1"
-                            except ValueError:
-                                print("[DEBUG] Ml_totali_fatt non è un numero valido: usando nr. pezzi = 1")
-                                fattore_moltiplicatore = "1"
-                    else:
-                        fattore_moltiplicatore = "1"
-                except Exception as e:
-                    print(f"[DEBUG] Errore nel calcolo del fattore moltiplicatore: {e}")
-                    fattore_moltiplicatore = "1"
-
-                set_val("Fattore moltiplicatore ml/nr. Pezzi", fattore_moltiplicatore)
-
-                # Calcolo N. Controtelai singoli
-                n_controtelai_singoli = "0"
-                try:
-                    if tipo_controtelaio == "C. SINGOLO":
-                        n_controtelai_singoli = str(nr_pezzi)
-                except Exception as e:
-                    print(f"[DEBUG] Errore nel calcolo del numero controtelai singoli: {e}")
-                    n_controtelai_singoli = "0"
-
-                set_val("N. Controtelai singoli", n_controtelai_singoli)
-
-                # ML Controtelaio singolo
-                ml_controtelaio_singolo = "0"
-                try:
-                    if tipo_controtelaio == "C. SINGOLO":
-                        ml_controtelaio_singolo = mir if mir else "0"
-                except Exception as e:
-                    print(f"[DEBUG] Errore nell'aggiornamento di ml_controtelaio_singolo: {e}")
-                    ml_controtelaio_singolo = "0"
-
-                set_val("ML Controtelaio singolo", ml_controtelaio_singolo)
-
-                # Costo Controtelaio singolo
-                costo_controtelaio_singolo = "0"
-                try:
-                    if tipo_controtelaio == "C. SINGOLO":
-                        try:
-                            # Converti i valori in float, gestendo la formattazione italiana
-                            costo_ml = float(str(costo_ml_controtelaio_singolo).replace("€", "").replace(".", "").replace(",", ".").strip()) if costo_ml_controtelaio_singolo else 0
-                            ml = float(str(ml_controtelaio_singolo).replace(",", ".").strip()) if ml_controtelaio_singolo else 0
-                            # Calcola il costo totale
-                            costo_totale = costo_ml * ml
-                            # Formatta il risultato in euro
-                            costo_controtelaio_singolo = f"€ {costo_totale:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-                        except ValueError as ve:
-                            print(f"[DEBUG] Errore nella conversione dei valori numerici: {ve}")
-                            costo_controtelaio_singolo = "€ 0,00"
-                except Exception as e:
-                    print(f"[DEBUG] Errore nell'aggiornamento di costo_controtelaio_singolo: {e}")
-                    costo_controtelaio_singolo = "€ 0,00"
-
-                set_val("Costo Controtelaio singolo", costo_controtelaio_singolo)
-
-                # N. Controtelai doppi
-                n_controtelai_doppi = "0"
-                try:
-                    if tipo_controtelaio == "C. DOPPIO":
-                        n_controtelai_doppi = str(nr_pezzi)
-                except Exception as e:
-                    print(f"[DEBUG] Errore nell'aggiornamento di n_controtelai_doppi: {e}")
-                    n_controtelai_doppi = "0"
-
-                set_val("N. Controtelai doppi", n_controtelai_doppi)
-
-                # ML Controtelaio doppio
-                ml_controtelaio_doppio = "0"
-                try:
-                    if tipo_controtelaio == "C. DOPPIO":
-                        ml_controtelaio_doppio = mir if mir else "0"
-                except Exception as e:
-                    print(f"[DEBUG] Errore nell'aggiornamento di ml_controtelaio_doppio: {e}")
-                    ml_controtelaio_doppio = "0"
-
-                set_val("ML Controtelaio doppio", ml_controtelaio_doppio)
-
-                # Costo Controtelaio doppio
-                costo_controtelaio_doppio = ""
-                try:
-                    if tipo_controtelaio == "C. DOPPIO":
-                        costo_controtelaio_doppio = costo_ml_controtelaio_singolo
-                except Exception as e:
-                    print(f"[DEBUG] Errore nell'aggiornamento di costo_controtelaio_doppio: {e}")
-
-                set_val("Costo Controtelaio doppio", costo_controtelaio_doppio)
-
-                # N. Controtelaio termico TIP A
-                n_controtelaio_termico_a = "0"
-                try:
-                    if tipo_controtelaio == "C. TERMICO TIP A":
-                        n_controtelaio_termico_a = "1"
-                except Exception as e:
-                    print(f"[DEBUG] Errore nell'aggiornamento di n_controtelaio_termico_a: {e}")
-
-                set_val("N. Controtelaio termico TIP A", n_controtelaio_termico_a)
+    def segna_da_ricalcolare(self, *items):
+        """Segna le righe del treeview i cui campi derivati vanno ricalcolati al prossimo aggiornamento."""
+        self.righe_da_ricalcolare.update(items)
 
-                # Costo listino controtelaio termico TIP A
-                costo_listino_termico_a = ""
-                try:
-                    if tipo_controtelaio == "C. TERMICO TIP A":
-                        costo_listino_termico_a = costo_ml_controtelaio_singolo
-                except Exception as e:
-                    print(f"[DEBUG] Errore nell'aggiornamento di costo_listino_termico_a: {e}")
+    def ricalcola_righe_modificate(self):
+        """
+        Ricalcola con il motore prezzi solo le righe segnate come modificate.
+        Il costo è proporzionale al numero di righe modificate, non alla dimensione della tabella.
+        """
+        items = [item for item in self.righe_da_ricalcolare if item in self.posizioni]
+        self.righe_da_ricalcolare.clear()
+        if items:
+            self._ricalcola_righe(items)
 
-                set_val("Costo listino controtelaio termico TIP A", costo_listino_termico_a)
+    def ricalcola_tutto(self):
+        """
+        Ricalcola i campi derivati (prezzi, sconti, distanziali, controtelai) di tutte le righe del treeview.
+        Con molte righe il calcolo avviene in background; un nuovo ricalcolo sostituisce quello in corso.
+        """
+        self.righe_da_ricalcolare.clear()
+        items = list(self.tabella.righe)
+        if items:
+            # Il ricalcolo completo comprende anche gli sconti
+            self.calcoli.annulla("sconti")
+            self._calcola("ricalcolo", ricalcola_valori, items, self._applica_ricalcolo)
+
+    def _applica_ricalcolo(self, items, originali, risultato, versioni):
+        self._sostituisci_posizioni(items, versioni, [Posizione(valori) for valori in risultato])
+
+    def _ricalcola_righe(self, items):
+        """Calcola in un solo passaggio del motore prezzi le righe indicate e ne aggiorna i record e la vista."""
+        righe = [self.posizioni[item] for item in items]
+        try:
+            risultato = calcola_posizioni(righe, sconti=self._sconti_preventivo())
+            for item, posizione in zip(items, posizioni_da_risultato(risultato)):
+                self.aggiorna_posizione(item, posizione)
+        except Exception as e:
+            log.error("Errore nel ricalcolo delle righe: %s", e)
 
-                # N. Controtelaio termico TIP B
-                n_controtelaio_termico_b = "0"
-                try:
-                    if tipo_controtelaio == "C. TERMICO TIP B":
-                        n_controtelaio_termico_b = "1"
-                except Exception as e:
-                    print(f"[DEBUG] Errore nell'aggiornamento di n_controtelaio_termico_b: {e}")
+    def _sconti_preventivo(self):
+        """Copia di dati_b1 del preventivo (None se non c'è), da passare al motore prezzi."""
+        dati_b1 = getattr(self.preventivo, 'dati_b1', None) if self.preventivo else None
+        return dict(dati_b1) if isinstance(dati_b1, dict) else dati_b1
 
-                set_val("N. Controtelaio termico TIP B", n_controtelaio_termico_b)
+    def _calcola(self, chiave, funzione, items, applica):
+        """
+        Esegue funzione(valori, sconti) sull'istantanea delle righe indicate e passa il risultato ad
+        applica(items, originali, risultato, versioni): subito se le righe sono poche, altrimenti sul
+        thread di lavoro di self.calcoli (un nuovo lavoro con la stessa chiave sostituisce quello in
+        corso). `versioni` sono le versioni delle righe al momento dell'istantanea.
+        """
+        originali = [self.posizioni[item] for item in items]
+        versioni = [self.versioni_posizioni.get(item) for item in items]
+        argomenti = ([posizione.valori() for posizione in originali], self._sconti_preventivo())
 
-                # Costo listino controtelaio termico TIP B
-                costo_listino_termico_b = ""
-                try:
-                    if tipo_controtelaio == "C. TERMICO TIP B":
-                        costo_listino_termico_b = costo_ml_controtelaio_singolo
-                except Exception as e:
-                    print(f"[DEBUG] Errore nell'aggiornamento di costo_listino_termico_b: {e}")
+        def al_termine(risultato, errore):
+            if errore is not None:
+                log.error("Errore nel calcolo %s delle righe: %s", chiave, errore)
+            else:
+                applica(items, originali, risultato, versioni)
 
-                set_val("Costo listino controtelaio termico TIP B", costo_listino_termico_b)
+        if len(items) <= RIGHE_SINCRONE:
+            try:
+                risultato = funzione(*argomenti)
+            except Exception as e:
+                al_termine(None, e)
+            else:
+                al_termine(risultato, None)
+        else:
+            self.calcoli.esegui(chiave, funzione, argomenti, al_termine, righe=len(items))
 
-                # Aggiorna i valori nel treeview
-                self.tree.item(item, values=values)
+    def _sostituisci_posizioni(self, items, versioni, nuove, aggiorna_tag=True):
+        """
+        Sostituisce i record con quelli calcolati, saltando le righe eliminate o modificate mentre il
+        calcolo era in corso (la loro versione non è più quella dell'istantanea), poi aggiorna la vista
+        una volta. Il Pos. corrente della riga prevale su quello dell'istantanea (rinumerazioni nel frattempo);
+        le righe modificate vengono ricalcolate di nuovo, così tutte usano gli stessi sconti e listino.
+        """
+        sostituite = 0
+        for item, versione, posizione in zip(items, versioni, nuove):
+            if item not in self.posizioni:
+                continue
+            if self.versioni_posizioni.get(item) != versione:
+                self.segna_da_ricalcolare(item)
+                continue
+            posizione["Pos."] = self.posizioni[item]["Pos."]
+            self.posizioni[item] = posizione
+            if aggiorna_tag:
+                self.tag_posizioni[item] = self._tag_gruppi(posizione)
+            self._nuova_versione(item)
+            sostituite += 1
+        ricalcolate = bool(self.righe_da_ricalcolare)
+        if ricalcolate:
+            self.ricalcola_righe_modificate()
+        if sostituite:
+            self.tabella.aggiorna_visibili()
+        if sostituite or ricalcolate:
+            self.registra_stato()
+            self.salva_in_preventivo()
 
-            except Exception as e:
-                print(f"[DEBUG] Errore nell'aggiornamento dei campi controtelaio: {e}")
+    def _mostra_avanzamento_calcoli(self, lavori_in_corso):
+        """Mostra l'indicatore mentre ci sono ricalcoli in background, lo nasconde quando sono finiti."""
+        if lavori_in_corso and not self.calcolo_progress.winfo_manager():
+            self.calcolo_progress.pack(side="left", padx=5)
+            self.calcolo_label.pack(side="left")
+            self.calcolo_progress.start(15)
+        elif not lavori_in_corso and self.calcolo_progress.winfo_manager():
+            self.calcolo_progress.stop()
+            self.calcolo_progress.pack_forget()
+            self.calcolo_label.pack_forget()
+
+    def destroy(self):
+        # I risultati dei calcoli in corso non hanno più una tabella a cui tornare
+        self.calcoli.chiudi()
+        self.giornale.chiudi()
+        super().destroy()
 
     def on_header_scroll(self, *args):
         """Gestisce lo scrolling degli header sincronizzandolo con il treeview."""
         self.tree.xview(*args)
-        self.draw_custom_headers()
+        self.intestazioni.scorri()
 
     def draw_custom_headers(self):
-        """Disegna gli header personalizzati per i gruppi di colonne."""
-        try:
-            # Ottieni le dimensioni del treeview
-            treeview_width = self.tree.winfo_width()
-            if treeview_width <= 0:
-                treeview_width = 1455  # Larghezza di default
-            
-            # Calcola la larghezza totale delle colonne
-            total_width = 0
-            column_widths = []
-            for col in self.tree['columns']:
-                width = self.tree.column(col)['width']
-                column_widths.append(width)
-                total_width += width
-            
-            # Imposta la larghezza del canvas uguale a quella del treeview
-            self.header_canvas.configure(width=treeview_width)
-            
-            # Calcola l'offset di scrolling dal treeview
-            xview = self.tree.xview()
-            scroll_offset = int(xview[0] * total_width)
-            
-            # Pulisci gli header esistenti
-            self.header_canvas.delete("all")
-            
-            # Disegna gli header per ogni gruppo
-            for group_name, group_info in self.group_headers.items():
-                # Calcola le coordinate x basate sulle larghezze effettive delle colonne
-                x_start = sum(column_widths[:group_info['start_col']-1])
-                x_end = sum(column_widths[:group_info['end_col']])
-                
-                # Applica l'offset di scrolling
-                x_start -= scroll_offset
-                x_end -= scroll_offset
-                
-                # Disegna l'header solo se è visibile
-                if x_end > 0 and x_start < treeview_width:
-                    # Crea il rettangolo dell'header
-                    self.header_canvas.create_rectangle(
-                        x_start, 0, x_end, 30,
-                        fill=group_info['bg_color'],
-                        outline="#999999",
-                        tags=("header", f"header_{group_name}")
-                    )
-                    
-                    # Aggiungi il testo
-                    self.header_canvas.create_text(
-                        (x_start + x_end) / 2, 15,
-                        text=group_name,
-                        fill=group_info['text_color'],
-                        font=("Arial", 10, "bold"),
-                        tags=("header", f"text_{group_name}")
-                    )
-            
-            # Aggiorna il canvas
-            self.header_canvas.update_idletasks()
-            
-        except Exception as e:
-            print(f"Errore nel disegno degli header: {str(e)}")
-            import traceback
-            traceback.print_exc()
-
-
-
-
-
-
-
-
-
+        """Richiede il ridisegno degli header dei gruppi di colonne (accorpato al prossimo ciclo inattivo)."""
+        if hasattr(self, 'intestazioni'):
+            self.intestazioni.invalida()
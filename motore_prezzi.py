@@ -0,0 +1,382 @@
+"""
+Motore di calcolo dei prezzi delle posizioni.
+
+Calcola in un unico passaggio vettoriale (pandas/NumPy) tutte le colonne derivate
+della tabella posizioni a partire dai campi inseriti dall'utente. Non dipende da
+Tkinter: il PosizioniFrame si limita a chiamarlo, ma può essere usato anche da
+script o da riga di comando senza display.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+from indice_catalogo import IndiceCatalogo
+from prestazioni import misura
+from schema_posizioni import (  # noqa: F401 - riesportati per chi li importa dal motore
+    COLONNE, COLONNE_INPUT, FORMATI, formatta_euro, formatta_valore, numero_da_testo,
+)
+
+# Campi ricavati dal catalogo "elementi" in base al serramento (colonne candidate in ordine di preferenza)
+CAMPI_SERRAMENTO = {
+    "N.ANTE": ["NUMERO ANTE"],
+    "AP.": ["APERTURA"],
+    "TIP.": ["TIPOLOGIA"],
+    "DESCR.TIP": ["DESCRIZIONE TIPOLOGIA"],
+    "N.CERN.": ["N. CERNIERE"],
+    "XLAV": ["EXTRA LAVORAZIONE"],
+    "MULT.": ["MULTIPLO"],
+    "COSTO MLT": ["COSTO MULTIPLO"],
+    "MIN.1": ["MINIMI 1 (protezione singola)", "MINIMI 1", "Minimi 1", "MINIMI_1"],
+    "MIN.2": ["MINIMI 2 (snodo)", "MINIMI 2", "Minimi 2", "MINIMI_2"],
+    "MIN.3": ["MINIMI 3 (combinati)", "MINIMI 3", "Minimi 3", "MINIMI_3"],
+    "MIN.4": ["MINIMI 4", "Minimi 4", "MINIMI_4"],
+    "MIN.5": ["MINIMI 5", "Minimi 5", "MINIMI_5"],
+    "P.SERR.": ["Presenza serratura"],
+    "N.STAFF.": ["Numero staffette"],
+}
+
+# Colonne da cui dipendono i campi calcolati di una posizione (oltre agli sconti del preventivo):
+# se nessuna di queste cambia non serve ricalcolare la riga
+COLONNE_SORGENTE = COLONNE_INPUT + list(CAMPI_SERRAMENTO)
+
+# Colonne del listino che contengono la tabella dei minimi
+COLONNE_TABELLA_MINIMI = ["Minimi", "MINIMI 1 (protezione singola)", "MINIMI 1", "MINIMI", "Minimi 1", "MINIMI_1"]
+
+# Chiavi di dati_b1 da cui leggere gli sconti del preventivo
+CHIAVI_SCONTI = {
+    "Sconto 1": ("Sconto 1", "Sconto1"),
+    "Sconto 2": ("Sconto 2", "Sconto2"),
+    "Sconto 3": ("Sconto 3", "Sconto3"),
+    "Sconto in decimali": ("Sconto in decimali", "Sconto_in_decimali"),
+    "Dicitura sconto": ("Dicitura sconto", "Dicitura_sconto"),
+}
+
+# Colonne aggiornate da applica_sconti quando cambiano gli sconti del preventivo
+COLONNE_SCONTO = list(CHIAVI_SCONTI) + [
+    "Costo_scontato_Mq", "Costo_serramento_scontato_posizione", "Costo scontato controtelaio posizione",
+]
+
+CODICI_COLORE = {"STANDARD RAL": 1, "EFFETTO LEGNO": 2, "GREZZO": 3, "EXTRA MAZZETTA": 4}
+
+
+def sconto_decimale(valore):
+    """Normalizza lo sconto in decimali: "35 %", "35" e "0,35" valgono tutti 0.35."""
+    sconto = numero_da_testo(valore) or 0.0
+    return sconto / 100.0 if sconto > 1 else sconto
+
+
+def formatta_percentuale(valore):
+    """Formatta una percentuale come "35,00 %" (vuoto se il valore è vuoto)."""
+    try:
+        testo = str(valore).replace('%', '').replace(',', '.').strip()
+        if testo == '' or testo.lower() == 'nan':
+            return ''
+        return f"{float(testo):.2f} %".replace('.', ',')
+    except ValueError:
+        return str(valore)
+
+
+def formatta_dicitura_sconto(dicitura):
+    """Formatta come percentuali i numeri della dicitura sconto non già seguiti da %."""
+    def sostituisci(match):
+        try:
+            return f"{float(match.group(1).replace(',', '.')):.2f} %".replace('.', ',')
+        except (IndexError, ValueError):
+            return match.group()
+    return re.sub(r'\b\d+[\.,]?\d*\b(?!\s*%)', sostituisci, str(dicitura))
+
+
+def leggi_sconti(dati_b1):
+    """Estrae i campi sconto dal dizionario dati_b1 del preventivo, già formattati per la tabella."""
+    sconti = {}
+    for colonna, chiavi in CHIAVI_SCONTI.items():
+        sconti[colonna] = next((dati_b1[k] for k in chiavi if k in dati_b1), "")
+    for colonna in ("Sconto 1", "Sconto 2", "Sconto 3", "Sconto in decimali"):
+        sconti[colonna] = formatta_percentuale(sconti[colonna])
+    sconti["Dicitura sconto"] = formatta_dicitura_sconto(sconti["Dicitura sconto"])
+    return sconti
+
+
+def _catalogo_predefinito():
+    """Importa gli indici dei cataloghi standard solo quando servono, per non legare il motore al pacchetto data."""
+    import catalogo
+    return catalogo.indice_listino, catalogo.indice_elementi, catalogo.indice_controtelaio
+
+
+def _indice(catalogo, chiave):
+    """Accetta un IndiceCatalogo oppure un DataFrame (indicizzato al volo sulla colonna chiave)."""
+    if isinstance(catalogo, IndiceCatalogo):
+        return catalogo
+    return IndiceCatalogo(catalogo, chiave)
+
+
+def _colonne_input(posizioni):
+    """
+    Restituisce il numero di posizioni e una funzione colonna -> lista di valori.
+    Accetta un DataFrame oppure una lista di dict; le colonne mancanti valgono "".
+    """
+    if isinstance(posizioni, pd.DataFrame):
+        n = len(posizioni)
+        return n, lambda col: posizioni[col].tolist() if col in posizioni.columns else [""] * n
+    righe = list(posizioni)
+    return len(righe), lambda col: [riga.get(col, "") for riga in righe]
+
+
+def _array(valori):
+    """Array object 1D con gli stessi elementi della lista (senza che NumPy provi a espanderli)."""
+    oggetti = np.empty(len(valori), dtype=object)
+    oggetti[:] = list(valori)
+    return oggetti
+
+
+def _vuoto(valore):
+    return valore is None or (isinstance(valore, str) and valore == "") or \
+        (not isinstance(valore, str) and pd.isna(valore))
+
+
+def _numeri(valori):
+    """Applica numero_da_testo a un'intera colonna: array float con NaN dove il valore non è numerico."""
+    numeri = [numero_da_testo(v) for v in valori]
+    return np.array([np.nan if v is None else v for v in numeri], dtype=float)
+
+
+def _testi(valori):
+    """Normalizza una colonna di testo: valori mancanti diventano stringa vuota."""
+    return _array(["" if _vuoto(v) else str(v).strip() for v in valori])
+
+
+def _oggetti(valori):
+    """Converte un array float in array object con None al posto di NaN."""
+    valori = np.asarray(valori, dtype=float)
+    oggetti = valori.astype(object)
+    oggetti[np.isnan(valori)] = None
+    return oggetti
+
+
+def _interi(valori, maschera=None):
+    """Converte in array object di int; dove `maschera` è falsa il valore è None."""
+    interi = np.nan_to_num(np.asarray(valori, dtype=float)).astype(int).astype(object)
+    if maschera is not None:
+        interi[~maschera] = None
+    return interi
+
+
+def _presenti(oggetti):
+    return np.array([v is not None for v in oggetti], dtype=bool)
+
+
+def _prima_colonna(indice, candidate):
+    """Prima colonna del catalogo esistente fra le candidate, oppure None."""
+    return next((col for col in candidate if col in indice.colonne), None)
+
+
+@misura("motore.calcola_posizioni")
+def calcola_posizioni(posizioni, sconti=None, listino=None, elementi=None, controtelaio=None):
+    """
+    Calcola tutte le colonne della tabella posizioni per un lotto di posizioni.
+
+    :param posizioni: DataFrame (o lista di dict) con almeno le colonne di input; i campi del
+        serramento già presenti vengono mantenuti se il serramento non è a catalogo
+    :param sconti: dizionario dati_b1 del preventivo; se None restano gli sconti già presenti
+    :param listino, elementi, controtelaio: cataloghi (IndiceCatalogo o DataFrame); se omessi si usano
+        gli indici del modulo catalogo
+    :return: DataFrame tipizzato con tutte le COLONNE, una riga per posizione
+    """
+    if listino is None or elementi is None or controtelaio is None:
+        predefiniti = _catalogo_predefinito()
+        listino = predefiniti[0] if listino is None else listino
+        elementi = predefiniti[1] if elementi is None else elementi
+        controtelaio = predefiniti[2] if controtelaio is None else controtelaio
+    listino = _indice(listino, "MODELLO")
+    elementi = _indice(elementi, "TIPOLOGIA COMPLETA DI APERTURA")
+    controtelaio = _indice(controtelaio, "CONTROTELAIO")
+
+    n, colonna = _colonne_input(posizioni)
+    out = {}
+    numeri = {}
+
+    # --- Campi inseriti dall'utente ---
+    for col in COLONNE_INPUT:
+        if FORMATI[col] == "testo":
+            out[col] = _testi(colonna(col))
+        else:
+            numeri[col] = _numeri(colonna(col))
+            out[col] = _oggetti(numeri[col])
+    pos = numeri["Pos."]
+    out["Pos."] = _interi(np.where(np.isnan(pos), np.arange(1, n + 1), pos))
+
+    nr_pezzi = np.nan_to_num(numeri["nr. pezzi"])
+    l_val = np.nan_to_num(numeri["L (mm)"])
+    h_val = np.nan_to_num(numeri["H (mm)"])
+    modello = out["Modello"]
+    colore = out["Colore"]
+    serramento = out["Serramento"]
+    tipo_controtelaio = out["Tipologia controtelaio"]
+
+    # --- Campi del serramento (catalogo elementi) ---
+    for col, candidate in CAMPI_SERRAMENTO.items():
+        attuale = _array([None if _vuoto(v) else v for v in colonna(col)])
+        col_catalogo = _prima_colonna(elementi, candidate)
+        if col_catalogo is not None:
+            da_catalogo = elementi.colonna(serramento, col_catalogo)
+            attuale = np.where(_presenti(da_catalogo), da_catalogo, attuale)
+        out[col] = attuale
+
+    # --- Sconti del preventivo ---
+    valori_sconti = leggi_sconti(sconti) if sconti is not None else None
+    for col in CHIAVI_SCONTI:
+        if valori_sconti is not None:
+            out[col] = _array([valori_sconti[col]] * n)
+        else:
+            out[col] = _testi(colonna(col))
+    if valori_sconti is not None:
+        sconto = sconto_decimale(valori_sconti["Sconto in decimali"])
+    else:
+        sconto = np.array([sconto_decimale(v) for v in out["Sconto in decimali"]], dtype=float)
+
+    # --- Listino: prezzo, tabella minimi, unità di misura ---
+    prezzo = np.full(n, np.nan)
+    for nome_colore in set(colore):
+        if nome_colore and nome_colore in listino.colonne:
+            maschera = colore == nome_colore
+            prezzo[maschera] = _numeri(listino.colonna(modello[maschera], nome_colore))
+    out["Prezzo_listino"] = _oggetti(prezzo)
+    prezzo = np.nan_to_num(prezzo)
+
+    col_minimi = _prima_colonna(listino, COLONNE_TABELLA_MINIMI)
+    out["Tabella_minimi"] = _testi(listino.colonna(modello, col_minimi)) if col_minimi else _array([""] * n)
+    col_unita = next((c for c in listino.colonne
+                      if str(c).lower().replace("à", "a").replace(" ", "_") == "unita_di_misura"), None)
+    out["Unita_di_misura"] = listino.colonna(modello, col_unita) if col_unita else _array([None] * n)
+
+    # --- Superfici e metri lineari ---
+    mqr = np.round(l_val * h_val * 0.000001, 2)
+    mir = np.round((l_val + 2 * h_val) * 0.001, 2)
+    out["MqR"] = _oggetti(mqr)
+    out["MIR"] = _oggetti(mir)
+
+    numero_tabella = _numeri(out["Tabella_minimi"])
+    min_fatt_pz = _array([None] * n)
+    for k in range(1, 6):
+        maschera = numero_tabella == k
+        min_fatt_pz[maschera] = out[f"MIN.{k}"][maschera]
+    out["Min_fatt_pz"] = min_fatt_pz
+    mq_fatt_pz = np.round(np.maximum(mqr, np.nan_to_num(_numeri(min_fatt_pz))), 2)
+    mq_totali_fatt = np.round(mq_fatt_pz * nr_pezzi, 2)
+    ml_totali_fatt = np.round(mir * nr_pezzi, 2)
+    out["Mq_fatt_pz"] = _oggetti(mq_fatt_pz)
+    out["Mq_totali_fatt"] = _oggetti(mq_totali_fatt)
+    out["Ml_totali_fatt"] = _oggetti(ml_totali_fatt)
+
+    # --- Costi serramento ---
+    out["Prezzo_listino_unitario"] = _oggetti(prezzo * mq_fatt_pz)
+    out["Costo_serramento_listino_posizione"] = _oggetti(prezzo * mq_totali_fatt)
+
+    # --- Distanziali / imbotti ---
+    dist = out["Dist."]
+    tipo_dist = out["Tipo dist."]
+    con_distanziali = (dist != "") & (dist != "NO")
+    tipo_distanziali = np.select([tipo_dist == "IMBOTTE", tipo_dist == "SALDATO"], [2, 3], 1)
+    out["Distanziali/Imbotti"] = _interi(con_distanziali)
+    out["Tipo distanziali/imbotti"] = _interi(tipo_distanziali)
+    out["Dicitura distanziale/imbotte"] = np.select(
+        [tipo_distanziali == 3, tipo_distanziali == 2], ["DS - SALDATO", "I - IMBOTTE"], "").astype(object)
+    out["Colore dist/imb"] = _array([CODICI_COLORE.get(c) for c in colore])
+    for col in ("Ml Distanziali", "Ml Imbotti", "Tip. dist/imb",
+                "Ml Distanziali Standard Ral", "Ml Distanziali Effetto legno", "Ml Distanziali grezzo",
+                "Ml imbotti Standard Ral", "Ml imbotti Effetto legno", "Ml imbotti grezzo",
+                "Costo al Ml", "Costo List Dist", "Costo List Imb", "Somma Cost listino dist + imbotte",
+                "Costo scontato somma dist/imb posizione", "Ml totali Dist/imb"):
+        out[col] = _array([""] * n)
+    out["N. distanziali a 3 lati"] = _interi(nr_pezzi * 3, con_distanziali)
+
+    # --- Controtelai ---
+    nessuno = np.full(n, np.nan)
+    costo_ml = _numeri(controtelaio.colonna(tipo_controtelaio, "COSTO")) if "COSTO" in controtelaio.colonne else nessuno
+    tipologia = _numeri(controtelaio.colonna(tipo_controtelaio, "Ml / nr. Pezzi")) \
+        if "Ml / nr. Pezzi" in controtelaio.colonne else nessuno
+    verifica = (tipo_controtelaio != "") & (tipo_controtelaio != "0")
+    out["Costo al ml controtelaio singolo"] = _oggetti(costo_ml)
+    out["Verifica controtelaio"] = _interi(np.ones(n), verifica)
+    out["Tipologia ml/nr. Pezzi"] = _oggetti(tipologia)
+
+    # Fattore visualizzato: 1 per i controtelai a metro, ml per pezzo per quelli a numero
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ml_per_pezzo = np.round(ml_totali_fatt / np.where(nr_pezzi > 0, nr_pezzi, np.nan), 2)
+    fattore = np.where(verifica & (tipologia == 2) & ~np.isnan(ml_per_pezzo), ml_per_pezzo, 1.0)
+    out["Fattore moltiplicatore ml/nr. Pezzi"] = _oggetti(fattore)
+
+    # Costo di listino: a metro lineare se il controtelaio è a ml, altrimenti a pezzo
+    quantita = np.where(verifica & (tipologia == 1), ml_totali_fatt, nr_pezzi)
+    costo_listino_ct = np.where(~np.isnan(costo_ml) & (costo_ml != 0), costo_ml * quantita, np.nan)
+    out["Costo listino per posizione controtelaio"] = _oggetti(costo_listino_ct)
+
+    # --- Costi scontati (stessa formula usata da applica_sconti) ---
+    out.update(_costi_scontati(prezzo, mq_totali_fatt, costo_listino_ct, sconto))
+
+    singolo = tipo_controtelaio == "C. SINGOLO"
+    doppio = tipo_controtelaio == "C. DOPPIO"
+    termico_a = tipo_controtelaio == "C. TERMICO TIP A"
+    termico_b = tipo_controtelaio == "C. TERMICO TIP B"
+    out["N. Controtelai singoli"] = _oggetti(np.where(singolo, nr_pezzi, 0.0))
+    out["ML Controtelaio singolo"] = _oggetti(np.where(singolo, ml_totali_fatt, 0.0))
+    out["Costo Controtelaio singolo"] = _oggetti(np.where(singolo, np.nan_to_num(costo_ml) * ml_totali_fatt, np.nan))
+    out["N. Controtelai doppi"] = _oggetti(np.where(doppio, nr_pezzi, 0.0))
+    out["ML Controtelaio doppio"] = _oggetti(np.where(doppio, ml_totali_fatt, 0.0))
+    out["Costo Controtelaio doppio"] = _oggetti(np.where(doppio, costo_ml, np.nan))
+    out["N. Controtelaio termico TIP A"] = _interi(termico_a)
+    out["Costo listino controtelaio termico TIP A"] = _oggetti(np.where(termico_a, costo_ml, np.nan))
+    out["N. Controtelaio termico TIP B"] = _interi(termico_b)
+    out["Costo listino controtelaio termico TIP B"] = _oggetti(np.where(termico_b, costo_ml, np.nan))
+
+    return pd.DataFrame(out, columns=COLONNE)
+
+
+def _costi_scontati(prezzo, mq_totali_fatt, costo_listino_ct, sconto):
+    """Colonne che dipendono dallo sconto, dato il prezzo di listino e lo sconto in decimali."""
+    costo_scontato_mq = prezzo * (1 - sconto)
+    return {
+        "Costo_scontato_Mq": _oggetti(costo_scontato_mq),
+        "Costo_serramento_scontato_posizione": _oggetti(costo_scontato_mq * mq_totali_fatt),
+        "Costo scontato controtelaio posizione": _oggetti(costo_listino_ct * (1 - sconto)),
+    }
+
+
+@misura("motore.applica_sconti")
+def applica_sconti(posizioni, sconti):
+    """
+    Applica gli sconti del preventivo a un lotto di posizioni già calcolate, in un solo passaggio
+    vettoriale: aggiorna i campi sconto e i costi che ne dipendono senza ricalcolare il resto.
+
+    :param posizioni: DataFrame, lista di dict o di Posizione con le colonne già calcolate
+    :param sconti: dizionario dati_b1 del preventivo
+    :return: DataFrame con le sole COLONNE_SCONTO, una riga per posizione
+    """
+    n, colonna = _colonne_input(posizioni)
+    valori_sconti = leggi_sconti(sconti)
+    sconto = sconto_decimale(valori_sconti["Sconto in decimali"])
+    out = {col: _array([valori_sconti[col]] * n) for col in CHIAVI_SCONTI}
+    out.update(_costi_scontati(np.nan_to_num(_numeri(colonna("Prezzo_listino"))),
+                               np.nan_to_num(_numeri(colonna("Mq_totali_fatt"))),
+                               _numeri(colonna("Costo listino per posizione controtelaio")),
+                               sconto))
+    return pd.DataFrame(out, columns=COLONNE_SCONTO)
+
+
+def formatta_posizioni(risultato):
+    """Converte il DataFrame tipizzato di calcola_posizioni in liste di stringhe pronte per il Treeview."""
+    colonne = [[formatta_valore(v, FORMATI[col]) for v in risultato[col].tolist()] for col in COLONNE]
+    return [list(riga) for riga in zip(*colonne)]
+
+
+def calcola_posizione(valori, sconti=None, **cataloghi):
+    """
+    Calcola una singola posizione.
+
+    :param valori: dict colonna -> valore (oppure lista nell'ordine di COLONNE)
+    :return: lista dei valori formattati nell'ordine di COLONNE
+    """
+    if not isinstance(valori, dict):
+        valori = dict(zip(COLONNE, valori))
+    return formatta_posizioni(calcola_posizioni([valori], sconti=sconti, **cataloghi))[0]
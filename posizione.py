@@ -0,0 +1,110 @@
+"""
+Record tipizzato di una posizione del preventivo.
+
+Una Posizione conserva i valori già convertiti (int/float per le colonne numeriche,
+str per quelle di testo, None per le celle vuote) nell'ordine di COLONNE. È la fonte
+di verità della tabella posizioni: il Treeview è solo una vista che formatta i valori
+al momento della visualizzazione, e i calcoli non devono più rileggere stringhe come
+"€ 1.234,56" o "1,25".
+"""
+from schema_posizioni import COLONNE, FORMATI, FORMATI_PER_INDICE, INDICI, formatta_valore, numero_da_testo
+
+
+def valore_tipizzato(valore, formato):
+    """Converte un valore (tipicamente la stringa mostrata nel Treeview) nel tipo previsto dal formato."""
+    if valore is None or (isinstance(valore, float) and valore != valore):
+        return None
+    if isinstance(valore, str):
+        valore = valore.strip()
+        if valore == "":
+            return None
+    if formato == "testo":
+        return valore if isinstance(valore, str) else str(valore)
+    numero = numero_da_testo(valore)
+    if numero is None:
+        # Valore non numerico in una colonna numerica: lo si conserva com'è
+        return valore
+    if formato == "intero":
+        return int(numero)
+    return numero
+
+
+class Posizione:
+    """Una riga della tabella posizioni con i valori tipizzati nell'ordine di COLONNE."""
+
+    __slots__ = ("_valori",)
+
+    def __init__(self, valori=None):
+        """
+        :param valori: valori già tipizzati nell'ordine di COLONNE (mancanti = None)
+        """
+        valori = list(valori) if valori is not None else []
+        valori.extend([None] * (len(COLONNE) - len(valori)))
+        self._valori = valori[:len(COLONNE)]
+
+    @classmethod
+    def da_testi(cls, valori):
+        """Crea una Posizione dai valori testuali del Treeview (lista nell'ordine di COLONNE)."""
+        return cls([valore_tipizzato(v, formato) for formato, v in zip(FORMATI_PER_INDICE, valori)])
+
+    @classmethod
+    def da_dict(cls, dati):
+        """Crea una Posizione da un dict colonna -> valore (es. una posizione letta dal preventivo JSON)."""
+        if isinstance(dati, Posizione):
+            return cls(dati._valori)
+        return cls([valore_tipizzato(dati.get(col), formato) for col, formato in zip(COLONNE, FORMATI_PER_INDICE)])
+
+    def __getitem__(self, colonna):
+        return self._valori[INDICI[colonna]]
+
+    def __setitem__(self, colonna, valore):
+        indice = INDICI[colonna]
+        self._valori[indice] = valore_tipizzato(valore, FORMATI_PER_INDICE[indice])
+
+    def __eq__(self, altra):
+        return isinstance(altra, Posizione) and self._valori == altra._valori
+
+    def __repr__(self):
+        return f"Posizione(pos={self['Pos.']!r}, serramento={self['Serramento']!r})"
+
+    def get(self, colonna, default=None):
+        """Come dict.get: `default` solo se la colonna non esiste."""
+        indice = INDICI.get(colonna)
+        return default if indice is None else self._valori[indice]
+
+    def keys(self):
+        return list(COLONNE)
+
+    def valori(self):
+        """Copia dei valori tipizzati nell'ordine di COLONNE."""
+        return list(self._valori)
+
+    def copia(self):
+        return Posizione(self._valori)
+
+    def formattati(self):
+        """Valori formattati per il Treeview, nell'ordine di COLONNE."""
+        return [formatta_valore(v, formato) for formato, v in zip(FORMATI_PER_INDICE, self._valori)]
+
+    def to_dict(self):
+        """Dict colonna -> valore formattato, nello stesso formato dei preventivi JSON esistenti."""
+        return dict(zip(COLONNE, self.formattati()))
+
+
+def posizioni_da_risultato(risultato):
+    """Converte il DataFrame tipizzato di motore_prezzi.calcola_posizioni in una lista di Posizione."""
+    colonne = []
+    for col in COLONNE:
+        valori = risultato[col].tolist()
+        if FORMATI[col] == "testo":
+            # Le celle di testo possono arrivare dal catalogo come numeri: si uniformano a str/None
+            valori = [valore_tipizzato(v, "testo") for v in valori]
+        colonne.append(valori)
+    return [Posizione(riga) for riga in zip(*colonne)]
+
+
+def json_default(oggetto):
+    """Hook per json.dump: serializza le Posizione come dict di valori formattati."""
+    if isinstance(oggetto, Posizione):
+        return oggetto.to_dict()
+    raise TypeError(f"Oggetto di tipo {type(oggetto).__name__} non serializzabile in JSON")
@@ -0,0 +1,130 @@
+"""
+Misura dei tempi delle operazioni principali (ricerche nei cataloghi, motore prezzi,
+aggiornamento del Treeview, ridisegno delle intestazioni, salvataggio e apertura).
+
+    with misura("salvataggio"):
+        ...
+
+    @misura("motore.calcola_posizioni")
+    def calcola_posizioni(...):
+        ...
+
+Per ogni operazione si tengono numero di chiamate, tempo totale, minimo, massimo e un
+istogramma a fasce di durata; conta() registra solo un contatore, per le chiamate troppo
+frequenti e brevi per valere una misura (es. le singole ricerche O(1) nei cataloghi).
+Le misure possono arrivare da qualsiasi thread. Costano due letture di perf_counter e
+un lock, quindi restano sempre attive; i dati si vedono dalla finestra di diagnostica
+(Aiuto > Diagnostica prestazioni) e si possono salvare in JSON.
+"""
+import json
+import threading
+import time
+from contextlib import ContextDecorator
+from datetime import datetime
+
+# Limiti superiori (secondi) delle fasce dell'istogramma; l'ultima fascia raccoglie il resto
+FASCE = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+_lock = threading.Lock()
+_operazioni = {}
+_contatori = {}
+
+
+def _etichetta_fascia(indice):
+    if indice == len(FASCE):
+        return f">{_durata_testo(FASCE[-1])}"
+    return f"<{_durata_testo(FASCE[indice])}"
+
+
+def _durata_testo(secondi):
+    return f"{secondi * 1000:g} ms" if secondi < 1 else f"{secondi:g} s"
+
+
+def registra(nome, secondi):
+    """Aggiunge una durata (secondi) alle statistiche dell'operazione `nome`."""
+    fascia = next((i for i, limite in enumerate(FASCE) if secondi < limite), len(FASCE))
+    with _lock:
+        dati = _operazioni.get(nome)
+        if dati is None:
+            dati = _operazioni[nome] = {"conteggio": 0, "totale": 0.0, "minimo": secondi, "massimo": secondi,
+                                        "istogramma": [0] * (len(FASCE) + 1)}
+        dati["conteggio"] += 1
+        dati["totale"] += secondi
+        dati["minimo"] = min(dati["minimo"], secondi)
+        dati["massimo"] = max(dati["massimo"], secondi)
+        dati["istogramma"][fascia] += 1
+
+
+def conta(nome, quanti=1):
+    """Incrementa il contatore `nome`."""
+    with _lock:
+        _contatori[nome] = _contatori.get(nome, 0) + quanti
+
+
+class Misura(ContextDecorator):
+    """Misura la durata di un blocco with o di ogni chiamata della funzione decorata (vedi misura)."""
+
+    def __init__(self, nome):
+        self.nome = nome
+        self._locale = threading.local()
+
+    def __enter__(self):
+        # Un inizio per thread (e per livello di annidamento): la stessa istanza può decorare una funzione
+        # chiamata da più thread o ricorsivamente
+        inizi = getattr(self._locale, "inizi", None)
+        if inizi is None:
+            inizi = self._locale.inizi = []
+        inizi.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        self.durata = time.perf_counter() - self._locale.inizi.pop()
+        registra(self.nome, self.durata)
+        return False
+
+
+def misura(nome):
+    """Context manager e decoratore che registra la durata sotto `nome`; dopo il with la durata è in .durata."""
+    return Misura(nome)
+
+
+def percentile(dati, frazione):
+    """Stima del percentile dall'istogramma: il limite superiore della fascia che lo contiene."""
+    soglia = dati["conteggio"] * frazione
+    cumulato = 0
+    for indice, numero in enumerate(dati["istogramma"]):
+        cumulato += numero
+        if numero and cumulato >= soglia:
+            return min(FASCE[indice], dati["massimo"]) if indice < len(FASCE) else dati["massimo"]
+    return dati["massimo"]
+
+
+def statistiche():
+    """
+    Copia delle statistiche raccolte:
+    {"operazioni": {nome: {conteggio, totale, medio, minimo, massimo, p50, p95, istogramma}}, "contatori": {...}}
+    I tempi sono in secondi; l'istogramma è un dict etichetta della fascia -> numero di chiamate.
+    """
+    with _lock:
+        operazioni = {nome: dict(dati, istogramma=list(dati["istogramma"])) for nome, dati in _operazioni.items()}
+        contatori = dict(_contatori)
+    for dati in operazioni.values():
+        dati["medio"] = dati["totale"] / dati["conteggio"]
+        dati["p50"] = percentile(dati, 0.5)
+        dati["p95"] = percentile(dati, 0.95)
+        dati["istogramma"] = {_etichetta_fascia(i): n for i, n in enumerate(dati["istogramma"]) if n}
+    return {"operazioni": operazioni, "contatori": contatori}
+
+
+def azzera():
+    """Dimentica tutte le misure e i contatori."""
+    with _lock:
+        _operazioni.clear()
+        _contatori.clear()
+
+
+def salva(percorso):
+    """Scrive le statistiche correnti in un file JSON."""
+    contenuto = dict(statistiche(), data=datetime.now().isoformat(timespec="seconds"))
+    with open(percorso, "w", encoding="utf-8") as f:
+        json.dump(contenuto, f, ensure_ascii=False, indent=2)
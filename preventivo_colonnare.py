@@ -0,0 +1,149 @@
+"""
+Formato colonnare dei preventivi (.prevz).
+
+Un file .prevz è uno zip con:
+    intestazione.json   formato, versione, colonne, numero di posizioni, riepilogo dei totali
+                        e tutti i dati del preventivo tranne le posizioni
+    colonne/<k>.json    valori tipizzati della colonna k di COLONNE per tutte le posizioni
+
+Ogni colonna è salvata una sola volta (niente nomi ripetuti per ogni riga, niente stringhe
+formattate) e compressa con deflate. All'apertura si legge solo l'intestazione: le
+colonne vengono decompresse la prima volta che servono (vedi PosizioniColonnari).
+"""
+import json
+import zipfile
+from collections.abc import Sequence
+from io import BytesIO
+
+from posizione import Posizione, json_default
+from schema_posizioni import COLONNE, INDICI, numero_da_testo
+
+ESTENSIONE = ".prevz"
+FORMATO = "preventivo_colonnare"
+VERSIONE = 1
+
+NOME_INTESTAZIONE = "intestazione.json"
+
+# Data fissa dei membri dello zip: stesso contenuto -> stessi byte (e stesso hash di salvataggio)
+DATA_MEMBRI = (1980, 1, 1, 0, 0, 0)
+
+# Colonne sommate nel riepilogo dell'intestazione
+COLONNE_RIEPILOGO = {
+    "pezzi": "nr. pezzi",
+    "totale_serramenti_scontato": "Costo_serramento_scontato_posizione",
+    "totale_distanziali_scontato": "Costo scontato somma dist/imb posizione",
+    "totale_controtelai_scontato": "Costo scontato controtelaio posizione",
+}
+
+
+def _nome_colonna(indice):
+    return f"colonne/{indice}.json"
+
+
+def _somma(valori):
+    totale = 0.0
+    for valore in valori:
+        numero = numero_da_testo(valore) if valore is not None else None
+        if numero is not None:
+            totale += numero
+    return totale
+
+
+def _scrivi_membro(archivio, nome, dati):
+    info = zipfile.ZipInfo(nome, date_time=DATA_MEMBRI)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    archivio.writestr(info, json.dumps(dati, ensure_ascii=False, separators=(",", ":"), default=json_default))
+
+
+def serializza(dati):
+    """
+    Converte il dict di un preventivo (Preventivo.to_dict()) nei byte di un file .prevz.
+    Le posizioni possono essere record Posizione o dict colonna -> valore formattato.
+    """
+    dati = dict(dati)
+    posizioni = [Posizione.da_dict(p) for p in (dati.pop("posizioni", None) or [])]
+    colonne = list(zip(*(p.valori() for p in posizioni))) if posizioni else [()] * len(COLONNE)
+    intestazione = {
+        "formato": FORMATO,
+        "versione": VERSIONE,
+        "colonne": COLONNE,
+        "numero_posizioni": len(posizioni),
+        "riepilogo": {chiave: _somma(colonne[INDICI[col]]) for chiave, col in COLONNE_RIEPILOGO.items()},
+        "dati": dati,
+    }
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archivio:
+        _scrivi_membro(archivio, NOME_INTESTAZIONE, intestazione)
+        for indice, valori in enumerate(colonne):
+            _scrivi_membro(archivio, _nome_colonna(indice), list(valori))
+    return buffer.getvalue()
+
+
+def leggi_intestazione(percorso):
+    """Legge solo l'intestazione di un file .prevz (numero di posizioni, riepilogo, dati generali)."""
+    with zipfile.ZipFile(percorso) as archivio:
+        intestazione = json.loads(archivio.read(NOME_INTESTAZIONE).decode("utf-8"))
+    if intestazione.get("formato") != FORMATO:
+        raise ValueError(f"{percorso} non è un preventivo in formato colonnare")
+    if intestazione.get("versione", 0) > VERSIONE:
+        raise ValueError(f"Versione {intestazione['versione']} del formato colonnare non supportata")
+    return intestazione
+
+
+class PosizioniColonnari(Sequence):
+    """Sequenza di Posizione letta da un file .prevz, che decomprime le colonne solo quando servono."""
+
+    def __init__(self, percorso, intestazione):
+        self.percorso = percorso
+        self._numero = intestazione["numero_posizioni"]
+        # Le colonne salvate possono essere in un ordine diverso da quello corrente di COLONNE
+        self._indici_file = {col: k for k, col in enumerate(intestazione["colonne"])}
+        self._colonne = {}
+
+    def __len__(self):
+        return self._numero
+
+    def colonna(self, nome):
+        """Valori tipizzati della colonna `nome` per tutte le posizioni (None se la colonna manca nel file)."""
+        if nome not in self._colonne:
+            indice = self._indici_file.get(nome)
+            if indice is None:
+                self._colonne[nome] = [None] * self._numero
+            else:
+                with zipfile.ZipFile(self.percorso) as archivio:
+                    self._colonne[nome] = json.loads(archivio.read(_nome_colonna(indice)).decode("utf-8"))
+        return self._colonne[nome]
+
+    def _carica_tutte(self):
+        mancanti = [col for col in COLONNE if col not in self._colonne and col in self._indici_file]
+        if mancanti:
+            with zipfile.ZipFile(self.percorso) as archivio:
+                for col in mancanti:
+                    membro = _nome_colonna(self._indici_file[col])
+                    self._colonne[col] = json.loads(archivio.read(membro).decode("utf-8"))
+        return [self.colonna(col) for col in COLONNE]
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [self[i] for i in range(*indice.indices(self._numero))]
+        if indice < 0:
+            indice += self._numero
+        if not 0 <= indice < self._numero:
+            raise IndexError("indice di posizione fuori intervallo")
+        return Posizione([self.colonna(col)[indice] for col in COLONNE])
+
+    def __iter__(self):
+        colonne = self._carica_tutte()
+        for valori in zip(*colonne):
+            yield Posizione(valori)
+
+
+def carica(percorso):
+    """
+    Apre un file .prevz e restituisce il dict del preventivo, pronto per Preventivo.from_dict.
+    Le posizioni sono una PosizioniColonnari: le colonne si leggono dal file al primo accesso.
+    """
+    intestazione = leggi_intestazione(percorso)
+    dati = dict(intestazione.get("dati", {}))
+    dati["posizioni"] = PosizioniColonnari(percorso, intestazione)
+    return dati
@@ -0,0 +1,78 @@
+"""
+Profilazione su richiesta dell'applicazione (cProfile).
+
+La profilazione si avvia e si ferma dal menu Aiuto, oppure copre l'avvio con
+`python main.py --profila-avvio`. Il profilo viene scritto in formato pstats (.prof,
+leggibile con pstats, snakeviz o simili) insieme a un riepilogo testuale delle funzioni
+più costose, così l'utente può rimandare entrambi i file a chi deve analizzarli.
+
+cProfile misura solo le chiamate del thread che lo avvia, cioè il thread principale di
+Tk: è lì che un rallentamento blocca la finestra. I lavori in background (salvataggio,
+calcoli, immagini) non compaiono nel profilo, che lo dichiara nel riepilogo testuale;
+le loro durate sono in prestazioni.py.
+"""
+import cProfile
+import os
+import pstats
+from datetime import datetime
+
+CARTELLA_PROFILI = os.path.join("risorse", "profili")
+
+# Numero di funzioni elencate nel riepilogo testuale
+RIGHE_RIEPILOGO = 60
+
+INTESTAZIONE_RIEPILOGO = (
+    "Profilo del solo thread principale (Tk): i thread e i processi di lavoro (calcoli, salvataggio,\n"
+    "immagini) non sono compresi; i loro tempi sono in Aiuto > Diagnostica prestazioni.\n\n"
+)
+
+
+def percorso_profilo(percorso_preventivo=None, prefisso="profilo"):
+    """
+    File del profilo: accanto al preventivo aperto (stesso nome con suffisso e data), altrimenti
+    in risorse/profili.
+    """
+    data = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if percorso_preventivo:
+        radice = os.path.splitext(percorso_preventivo)[0]
+        return f"{radice}_{prefisso}_{data}.prof"
+    return os.path.join(CARTELLA_PROFILI, f"{prefisso}_{data}.prof")
+
+
+class Profilatore:
+    """Avvia e ferma cProfile e salva il profilo raccolto."""
+
+    def __init__(self):
+        self._profilo = None
+
+    @property
+    def attivo(self):
+        return self._profilo is not None
+
+    def avvia(self):
+        """Avvia la profilazione (ValueError se un altro profilatore è già attivo nel processo)."""
+        if self._profilo is not None:
+            return
+        profilo = cProfile.Profile()
+        profilo.enable()
+        self._profilo = profilo
+
+    def ferma(self, percorso):
+        """
+        Ferma la profilazione e salva il profilo in `percorso` (.prof) e il riepilogo accanto (.txt).
+
+        :return: percorso del file .prof, oppure None se la profilazione non era attiva
+        """
+        profilo, self._profilo = self._profilo, None
+        if profilo is None:
+            return None
+        profilo.disable()
+        cartella = os.path.dirname(percorso)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        profilo.dump_stats(percorso)
+        with open(os.path.splitext(percorso)[0] + ".txt", "w", encoding="utf-8") as f:
+            f.write(INTESTAZIONE_RIEPILOGO)
+            statistiche = pstats.Stats(profilo, stream=f)
+            statistiche.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(RIGHE_RIEPILOGO)
+        return percorso
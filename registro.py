@@ -0,0 +1,62 @@
+"""
+Registro (logging) dell'applicazione.
+
+Tutti i moduli usano logger con nome sotto "gestionale" (es. "gestionale.posizioni")
+e passano gli argomenti separati dal messaggio (logger.debug("valori: %s", valori)):
+la stringa viene costruita solo se il livello è attivo, quindi in produzione le righe
+di debug non costano la conversione in testo di intere posizioni. Il livello si può
+cambiare mentre l'applicazione è in esecuzione (imposta_debug) e i messaggi vanno in
+un file a rotazione.
+"""
+import logging
+import os
+from logging.handlers import RotatingFileHandler
+
+NOME_RADICE = "gestionale"
+PERCORSO_LOG = os.path.join("risorse", "log", "gestionale.log")
+DIMENSIONE_MASSIMA_LOG = 1024 * 1024
+NUMERO_BACKUP_LOG = 5
+FORMATO_LOG = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+# Variabile d'ambiente che attiva il debug fin dall'avvio (es. GESTIONALE_DEBUG=1)
+VARIABILE_DEBUG = "GESTIONALE_DEBUG"
+
+_configurato = False
+
+
+def configura_log(percorso=PERCORSO_LOG, debug=None):
+    """
+    Collega alla radice "gestionale" un file di log a rotazione e imposta il livello
+    (DEBUG se `debug` è vero o se è impostata GESTIONALE_DEBUG, altrimenti INFO).
+    Chiamate successive cambiano solo il livello.
+    """
+    global _configurato
+    if debug is None:
+        debug = os.environ.get(VARIABILE_DEBUG, "").strip().lower() in ("1", "true", "si", "sì", "yes")
+    radice = logging.getLogger(NOME_RADICE)
+    if not _configurato:
+        cartella = os.path.dirname(percorso)
+        try:
+            if cartella:
+                os.makedirs(cartella, exist_ok=True)
+            gestore = RotatingFileHandler(
+                percorso, maxBytes=DIMENSIONE_MASSIMA_LOG, backupCount=NUMERO_BACKUP_LOG, encoding="utf-8"
+            )
+        except OSError as e:
+            print(f"Impossibile aprire il file di log {percorso}: {e}")
+            gestore = logging.StreamHandler()
+        gestore.setFormatter(logging.Formatter(FORMATO_LOG))
+        radice.addHandler(gestore)
+        radice.propagate = False
+        _configurato = True
+    imposta_debug(debug)
+    return radice
+
+
+def imposta_debug(attivo):
+    """Attiva o disattiva i messaggi di debug mentre l'applicazione è in esecuzione."""
+    logging.getLogger(NOME_RADICE).setLevel(logging.DEBUG if attivo else logging.INFO)
+
+
+def debug_attivo():
+    return logging.getLogger(NOME_RADICE).isEnabledFor(logging.DEBUG)
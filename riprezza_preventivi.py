@@ -0,0 +1,182 @@
+"""
+Riprezzamento in blocco dei preventivi salvati, da riga di comando.
+
+Quando cambia il listino (data/dataframe.py e i workbook in data/), ogni posizione di
+ogni preventivo della cartella viene ricalcolata con il motore prezzi usato dalla
+finestra posizioni (stessa funzione del pulsante "Ricalcola tutto", con gli sconti
+dati_b1 del preventivo), e il file aggiornato viene scritto nello stesso formato
+(JSON o .prevz). Con --destinazione anche i preventivi invariati vengono copiati, così
+la cartella di destinazione è completa. I file sono elaborati in parallelo da un pool
+di processi: i cataloghi si caricano prima nel processo principale, che scrive la
+cache di catalogo.py se serve, e poi una volta in ogni processo all'avvio del pool.
+
+Il rapporto CSV elenca, per ogni posizione cambiata, le colonne con il valore prima e
+dopo; a fine elaborazione si stampa un riepilogo con i totali.
+
+    python riprezza_preventivi.py preventivi --destinazione preventivi_riprezzati
+    python riprezza_preventivi.py preventivi --sovrascrivi
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import preventivo_colonnare
+from calcoli_posizioni import ricalcola_valori
+from indice_preventivi import COLONNE_TOTALE, ESTENSIONI_PREVENTIVO
+from posizione import Posizione
+from salvataggio_preventivo import scrivi_atomico, serializza
+from schema_posizioni import COLONNE, FORMATI_PER_INDICE, formatta_euro, formatta_valore, numero_da_testo
+
+CARTELLA_PREVENTIVI = "preventivi"
+NOME_RAPPORTO = "rapporto_riprezzamento.csv"
+INTESTAZIONE_RAPPORTO = ["File", "Pos.", "Serramento", "Colonna", "Prima", "Dopo"]
+
+
+def _leggi(percorso):
+    if percorso.lower().endswith(preventivo_colonnare.ESTENSIONE):
+        return preventivo_colonnare.carica(percorso)
+    with open(percorso, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _totale(posizioni):
+    return sum(numero_da_testo(p[col]) or 0.0 for p in posizioni for col in COLONNE_TOTALE)
+
+
+def _inizializza_processo():
+    """Avvio di ogni processo del pool: cataloghi caricati subito (dalla cache scritta dal processo principale)."""
+    import catalogo
+    catalogo.carica_cataloghi()
+
+
+def riprezza_file(percorso, destinazione):
+    """
+    Ricalcola tutte le posizioni del preventivo in `percorso` e scrive il file in `destinazione` se
+    qualcosa è cambiato oppure se la destinazione è un altro file (copia del preventivo invariato).
+    Eseguita nei processi del pool.
+
+    :return: dict con file, esito ("aggiornato", "copiato" se invariato ma scritto in destinazione,
+        "invariato" o "errore"), posizioni, differenze (righe del rapporto), totale_prima, totale_dopo
+        ed errore
+    """
+    risultato = {"file": percorso, "esito": "invariato", "posizioni": 0, "differenze": [],
+                 "totale_prima": 0.0, "totale_dopo": 0.0, "errore": None}
+    try:
+        dati = _leggi(percorso)
+        prima = [Posizione.da_dict(p) for p in dati.get("posizioni") or []]
+        risultato["posizioni"] = len(prima)
+        sconti = dati.get("dati_b1") if isinstance(dati.get("dati_b1"), dict) else None
+        dopo = [Posizione(valori) for valori in ricalcola_valori([p.valori() for p in prima], sconti)] if prima else []
+        nome = os.path.basename(percorso)
+        for vecchia, nuova in zip(prima, dopo):
+            for col, formato, valore_prima, valore_dopo in zip(COLONNE, FORMATI_PER_INDICE,
+                                                                vecchia.valori(), nuova.valori()):
+                # Confronto sui valori visualizzati: le differenze di arrotondamento non contano
+                testo_prima = formatta_valore(valore_prima, formato)
+                testo_dopo = formatta_valore(valore_dopo, formato)
+                if testo_prima != testo_dopo:
+                    risultato["differenze"].append(
+                        [nome, nuova["Pos."], nuova["Serramento"], col, testo_prima, testo_dopo])
+        risultato["totale_prima"] = _totale(prima)
+        risultato["totale_dopo"] = _totale(dopo)
+        if risultato["differenze"] or destinazione != percorso:
+            dati = dict(dati, posizioni=dopo)
+            scrivi_atomico(destinazione, serializza(destinazione, dati))
+        if risultato["differenze"]:
+            risultato["esito"] = "aggiornato"
+        elif destinazione != percorso:
+            risultato["esito"] = "copiato"
+    except Exception as e:
+        risultato["esito"] = "errore"
+        risultato["errore"] = f"{type(e).__name__}: {e}"
+    return risultato
+
+
+def elenca_preventivi(cartella):
+    """File preventivo (JSON e .prevz) della cartella, in ordine di nome."""
+    return sorted(
+        voce.path for voce in os.scandir(cartella)
+        if voce.is_file() and voce.name.lower().endswith(ESTENSIONI_PREVENTIVO)
+    )
+
+
+def riprezza_cartella(cartella, destinazione=None, processi=None, percorso_rapporto=None):
+    """
+    Riprezza tutti i preventivi di `cartella` con un pool di processi.
+
+    :param destinazione: cartella dei file aggiornati (None = sovrascrive i file originali)
+    :param processi: numero di processi (None = tutti i core)
+    :param percorso_rapporto: CSV delle differenze (predefinito: NOME_RAPPORTO nella cartella di destinazione)
+    :return: lista dei risultati di riprezza_file, nell'ordine dei file
+    """
+    file = elenca_preventivi(cartella)
+    cartella_uscita = destinazione or cartella
+    os.makedirs(cartella_uscita, exist_ok=True)
+    percorso_rapporto = percorso_rapporto or os.path.join(cartella_uscita, NOME_RAPPORTO)
+    risultati = {}
+    # Un solo caricamento dai sorgenti, qui: i processi del pool trovano la cache già scritta
+    _inizializza_processo()
+    with ProcessPoolExecutor(max_workers=processi, initializer=_inizializza_processo) as esecutore:
+        futuri = {
+            esecutore.submit(riprezza_file, percorso, os.path.join(cartella_uscita, os.path.basename(percorso))): percorso
+            for percorso in file
+        }
+        for numero, futuro in enumerate(as_completed(futuri), start=1):
+            risultato = futuro.result()
+            risultati[futuri[futuro]] = risultato
+            if risultato["esito"] == "errore":
+                print(f"[{numero}/{len(file)}] Errore in {os.path.basename(risultato['file'])}: {risultato['errore']}",
+                      file=sys.stderr)
+            elif numero % 100 == 0 or numero == len(file):
+                print(f"[{numero}/{len(file)}] preventivi elaborati", file=sys.stderr)
+    ordinati = [risultati[percorso] for percorso in file]
+    with open(percorso_rapporto, "w", encoding="utf-8-sig", newline="") as f:
+        scrittore = csv.writer(f, delimiter=";")
+        scrittore.writerow(INTESTAZIONE_RAPPORTO)
+        for risultato in ordinati:
+            scrittore.writerows(risultato["differenze"])
+            if risultato["esito"] == "errore":
+                scrittore.writerow([os.path.basename(risultato["file"]), "", "", "ERRORE", "", risultato["errore"]])
+    return ordinati
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Ricalcola con il listino corrente tutte le posizioni dei preventivi salvati.")
+    parser.add_argument("cartella", nargs="?", default=CARTELLA_PREVENTIVI,
+                        help="cartella dei preventivi (predefinito: preventivi)")
+    uscita = parser.add_mutually_exclusive_group()
+    uscita.add_argument("--destinazione", help="cartella in cui scrivere i preventivi aggiornati")
+    uscita.add_argument("--sovrascrivi", action="store_true", help="aggiorna i file originali")
+    parser.add_argument("--processi", type=int, help="numero di processi (predefinito: tutti i core)")
+    parser.add_argument("--rapporto", help=f"file CSV delle differenze (predefinito: {NOME_RAPPORTO} nella destinazione)")
+    args = parser.parse_args(argv)
+
+    destinazione = args.destinazione
+    if not args.sovrascrivi and not destinazione:
+        destinazione = os.path.join(args.cartella, f"riprezzati_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+    inizio = time.perf_counter()
+    risultati = riprezza_cartella(args.cartella, destinazione, args.processi, args.rapporto)
+    durata = time.perf_counter() - inizio
+
+    aggiornati = sum(r["esito"] == "aggiornato" for r in risultati)
+    copiati = sum(r["esito"] == "copiato" for r in risultati)
+    errori = sum(r["esito"] == "errore" for r in risultati)
+    posizioni = sum(r["posizioni"] for r in risultati)
+    totale_prima = sum(r["totale_prima"] for r in risultati if r["esito"] != "errore")
+    totale_dopo = sum(r["totale_dopo"] for r in risultati if r["esito"] != "errore")
+    print(f"Preventivi: {len(risultati)} ({aggiornati} aggiornati, {copiati} invariati copiati in destinazione, "
+          f"{errori} con errori), posizioni: {posizioni}, tempo: {durata:.1f} s")
+    print(f"Totale scontato: {formatta_euro(totale_prima)} -> {formatta_euro(totale_dopo)}")
+    print(f"Preventivi aggiornati in: {destinazione or args.cartella}")
+    return 1 if errori else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
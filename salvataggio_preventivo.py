@@ -0,0 +1,203 @@
+"""
+Salvataggio dei preventivi in background.
+
+Sul thread di Tk si prende solo un'istantanea dei dati (copie di dict, liste e record
+Posizione, senza formattare nulla); serializzazione (JSON o .prevz colonnare), hash e scrittura
+avvengono su un thread di lavoro. Il file viene scritto su un temporaneo nella stessa
+cartella e poi sostituito con os.replace, quindi un'interruzione non lascia mai un
+preventivo scritto a metà. Se il contenuto serializzato ha lo stesso hash dell'ultimo
+salvataggio dello stesso file, la scrittura viene saltata.
+
+Il salvataggio automatico non tocca il file dell'utente: scrive una copia di recupero
+accanto al preventivo (<file>.autosave, nello stesso formato del file), solo se il contenuto
+differisce dall'ultimo salvataggio esplicito. La copia viene eliminata al salvataggio
+esplicito o alla chiusura regolare e proposta all'apertura se è più recente del file.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from collections.abc import Sequence
+
+import preventivo_colonnare
+from posizione import Posizione, json_default
+from prestazioni import misura
+
+# Ogni quanto (ms) il thread di Tk controlla se ci sono salvataggi conclusi da notificare
+INTERVALLO_CONTROLLO_MS = 100
+
+# Suffisso della copia di recupero scritta dal salvataggio automatico
+ESTENSIONE_AUTOSALVATAGGIO = ".autosave"
+
+log = logging.getLogger("gestionale.salvataggio")
+
+
+def istantanea(dati):
+    """Copia i contenitori e i record Posizione di `dati`, così il thread di lavoro non vede modifiche successive."""
+    if isinstance(dati, dict):
+        return {chiave: istantanea(valore) for chiave, valore in dati.items()}
+    if isinstance(dati, Sequence) and not isinstance(dati, (str, bytes)):
+        # Liste, tuple e sequenze lazy (es. le posizioni di un .prevz appena aperto)
+        return [istantanea(valore) for valore in dati]
+    if isinstance(dati, Posizione):
+        return dati.copia()
+    return dati
+
+
+def percorso_autosalvataggio(percorso):
+    """Copia di recupero del preventivo in `percorso`."""
+    return percorso + ESTENSIONE_AUTOSALVATAGGIO
+
+
+def percorso_formato(percorso):
+    """Percorso da cui si ricava il formato del file: per una copia di recupero, quello del preventivo."""
+    if percorso.endswith(ESTENSIONE_AUTOSALVATAGGIO):
+        return percorso[:-len(ESTENSIONE_AUTOSALVATAGGIO)]
+    return percorso
+
+
+def autosalvataggio_recente(percorso):
+    """
+    Percorso della copia di recupero se esiste, è più recente del preventivo e ha un contenuto diverso,
+    altrimenti None (una copia identica al file viene eliminata).
+    """
+    recupero = percorso_autosalvataggio(percorso)
+    try:
+        if os.path.getmtime(recupero) <= os.path.getmtime(percorso):
+            return None
+        with open(recupero, "rb") as f_recupero, open(percorso, "rb") as f_preventivo:
+            identici = f_recupero.read() == f_preventivo.read()
+    except OSError:
+        return None
+    if identici:
+        elimina_autosalvataggio(percorso)
+        return None
+    return recupero
+
+
+def elimina_autosalvataggio(percorso):
+    """Elimina la copia di recupero del preventivo in `percorso`, se c'è."""
+    try:
+        os.remove(percorso_autosalvataggio(percorso))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        log.warning("Impossibile eliminare il salvataggio automatico di %s: %s", percorso, e)
+
+
+def serializza(percorso, dati):
+    """Byte del file da scrivere: formato colonnare per i .prevz, JSON indentato per tutti gli altri."""
+    if percorso_formato(percorso).lower().endswith(preventivo_colonnare.ESTENSIONE):
+        return preventivo_colonnare.serializza(dati)
+    return json.dumps(dati, ensure_ascii=False, indent=4, default=json_default).encode("utf-8")
+
+
+def scrivi_atomico(percorso, contenuto):
+    """Scrive `contenuto` (bytes) su un file temporaneo accanto a `percorso` e lo rinomina al suo posto."""
+    cartella = os.path.dirname(percorso)
+    if cartella:
+        os.makedirs(cartella, exist_ok=True)
+    temporaneo = percorso + ".tmp"
+    with open(temporaneo, "wb") as f:
+        f.write(contenuto)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporaneo, percorso)
+
+
+class SalvataggioPreventivo:
+    """Coda di salvataggi su un thread di lavoro, con notifica dell'esito sul thread di Tk."""
+
+    def __init__(self, widget):
+        """
+        :param widget: widget Tk usato per riportare gli esiti sul thread principale (after)
+        """
+        self.widget = widget
+        self._richieste = queue.Queue()
+        self._esiti = queue.Queue()
+        self._in_attesa = {}
+        self._hash_salvati = {}
+        self._lock = threading.Lock()
+        self._inattivo = threading.Event()
+        self._inattivo.set()
+        self._controllo_programmato = None
+        self._thread = threading.Thread(target=self._lavora, name="salvataggio_preventivo", daemon=True)
+        self._thread.start()
+
+    def salva(self, percorso, dati, al_termine=None, riferimento=None):
+        """
+        Accoda il salvataggio di `dati` in `percorso`. Va chiamato dal thread di Tk.
+        Se per lo stesso file c'è già un salvataggio in coda, viene sostituito da questo.
+
+        :param al_termine: funzione opzionale (percorso, esito, errore) chiamata sul thread di Tk;
+            esito è "salvato", "invariato" oppure "errore"
+        :param riferimento: per le copie di recupero, il file del preventivo: se il contenuto coincide
+            con il suo ultimo salvataggio la copia non serve e viene eliminata (esito "invariato")
+        """
+        with misura("preventivo.istantanea"):
+            richiesta = (istantanea(dati), al_termine, riferimento)
+        with self._lock:
+            gia_in_coda = percorso in self._in_attesa
+            self._in_attesa[percorso] = richiesta
+            self._inattivo.clear()
+        if not gia_in_coda:
+            self._richieste.put(percorso)
+        self._programma_controllo()
+
+    def attendi(self, timeout=None):
+        """Blocca finché tutti i salvataggi in coda sono conclusi (es. prima di chiudere l'applicazione)."""
+        concluso = self._inattivo.wait(timeout)
+        self._notifica_esiti()
+        return concluso
+
+    def _lavora(self):
+        while True:
+            percorso = self._richieste.get()
+            with self._lock:
+                dati, al_termine, riferimento = self._in_attesa.pop(percorso)
+            try:
+                with misura("preventivo.serializzazione"):
+                    contenuto = serializza(percorso, dati)
+                impronta = hashlib.sha256(contenuto).hexdigest()
+                if riferimento is not None and self._hash_salvati.get(riferimento) == impronta:
+                    if os.path.exists(percorso):
+                        os.remove(percorso)
+                    self._hash_salvati.pop(percorso, None)
+                    esito = ("invariato", None)
+                elif self._hash_salvati.get(percorso) == impronta and os.path.exists(percorso):
+                    esito = ("invariato", None)
+                else:
+                    with misura("preventivo.scrittura"):
+                        scrivi_atomico(percorso, contenuto)
+                    self._hash_salvati[percorso] = impronta
+                    esito = ("salvato", None)
+            except Exception as e:
+                esito = ("errore", e)
+            self._esiti.put((percorso, al_termine) + esito)
+            with self._lock:
+                if not self._in_attesa:
+                    self._inattivo.set()
+
+    def _programma_controllo(self):
+        if self._controllo_programmato is None:
+            self._controllo_programmato = self.widget.after(INTERVALLO_CONTROLLO_MS, self._controlla)
+
+    def _controlla(self):
+        self._controllo_programmato = None
+        self._notifica_esiti()
+        if not self._inattivo.is_set() or not self._esiti.empty():
+            self._programma_controllo()
+
+    def _notifica_esiti(self):
+        while True:
+            try:
+                percorso, al_termine, esito, errore = self._esiti.get_nowait()
+            except queue.Empty:
+                return
+            if al_termine is not None:
+                try:
+                    al_termine(percorso, esito, errore)
+                except Exception:
+                    log.exception("Errore nella notifica del salvataggio di %s", percorso)
@@ -0,0 +1,146 @@
+"""
+Schema della tabella posizioni.
+
+Nomi delle colonne, indice di ciascuna colonna, gruppi di colonne (con i colori delle
+intestazioni), formato e formattatori dei valori: tutto è definito qui una sola volta,
+così il resto del codice indirizza le colonne per indice costante invece di cercarle
+nella lista con .index().
+"""
+from numbers import Number
+
+# Colonne della tabella posizioni, nell'ordine di visualizzazione
+COLONNE = [
+    "Pos.", "nr. pezzi", "Serramento", "Modello", "Modello grata combinato",
+    "Colore", "L (mm)", "H (mm)", "Tipo telaio", "BUNK", "Dmcp / Scp",
+    "Defender", "Dist.", "Tipo dist.", "L (mm) dist.", "H (mm) dist.",
+    "Tipologia controtelaio", "Anta a giro posizione", "M.rib.",
+    "N.ANTE", "AP.", "TIP.", "DESCR.TIP", "N.CERN.", "XLAV", "MULT.",
+    "COSTO MLT", "MIN.1", "MIN.2", "MIN.3", "MIN.4", "MIN.5",
+    "P.SERR.", "N.STAFF.",
+    "Sconto 1", "Sconto 2", "Sconto 3", "Sconto in decimali", "Dicitura sconto",
+    "Prezzo_listino",
+    "MqR", "MIR", "Tabella_minimi", "Unita_di_misura", "Min_fatt_pz", "Mq_fatt_pz",
+    "Mq_totali_fatt", "Ml_totali_fatt",
+    "Costo_scontato_Mq", "Prezzo_listino_unitario", "Costo_serramento_listino_posizione", "Costo_serramento_scontato_posizione",
+    "Distanziali/Imbotti", "Tipo distanziali/imbotti", "Dicitura distanziale/imbotte",
+    "Ml Distanziali", "Ml Imbotti", "Colore dist/imb", "Tip. dist/imb",
+    "Ml Distanziali Standard Ral", "Ml Distanziali Effetto legno", "Ml Distanziali grezzo",
+    "Ml imbotti Standard Ral", "Ml imbotti Effetto legno", "Ml imbotti grezzo",
+    "Costo al Ml", "Costo List Dist", "Costo List Imb", "Somma Cost listino dist + imbotte",
+    "Costo scontato somma dist/imb posizione", "N. distanziali a 3 lati", "Ml totali Dist/imb",
+    "Costo al ml controtelaio singolo", "Verifica controtelaio", "Tipologia ml/nr. Pezzi",
+    "Fattore moltiplicatore ml/nr. Pezzi", "Costo listino per posizione controtelaio",
+    "Costo scontato controtelaio posizione", "N. Controtelai singoli", "ML Controtelaio singolo",
+    "Costo Controtelaio singolo", "N. Controtelai doppi", "ML Controtelaio doppio",
+    "Costo Controtelaio doppio", "N. Controtelaio termico TIP A",
+    "Costo listino controtelaio termico TIP A", "N. Controtelaio termico TIP B",
+    "Costo listino controtelaio termico TIP B"
+]
+
+# Le prime 19 colonne sono quelle inserite dall'utente
+COLONNE_INPUT = COLONNE[:19]
+
+# Formato di ciascuna colonna: determina come il valore tipizzato viene letto e visualizzato.
+# "testo" = stringa, "intero" = int, "numero" = float senza decimali superflui,
+# "decimale" = float a 2 decimali, "euro" = importo, "euro_o_vuoto" = importo, vuoto se zero
+FORMATI = {col: "testo" for col in COLONNE}
+FORMATI.update({
+    "Pos.": "intero",
+    "nr. pezzi": "numero", "L (mm)": "numero", "H (mm)": "numero",
+    "L (mm) dist.": "numero", "H (mm) dist.": "numero",
+    "Prezzo_listino": "euro",
+    "MqR": "decimale", "MIR": "decimale",
+    "Mq_fatt_pz": "decimale", "Mq_totali_fatt": "decimale", "Ml_totali_fatt": "decimale",
+    "Costo_scontato_Mq": "euro_o_vuoto", "Prezzo_listino_unitario": "euro_o_vuoto",
+    "Costo_serramento_listino_posizione": "euro_o_vuoto", "Costo_serramento_scontato_posizione": "euro_o_vuoto",
+    "Distanziali/Imbotti": "intero", "Tipo distanziali/imbotti": "intero", "Colore dist/imb": "intero",
+    "N. distanziali a 3 lati": "intero",
+    "Costo al ml controtelaio singolo": "euro", "Verifica controtelaio": "intero",
+    "Tipologia ml/nr. Pezzi": "intero", "Fattore moltiplicatore ml/nr. Pezzi": "numero",
+    "Costo listino per posizione controtelaio": "euro", "Costo scontato controtelaio posizione": "euro",
+    "N. Controtelai singoli": "numero", "ML Controtelaio singolo": "decimale",
+    "Costo Controtelaio singolo": "euro", "N. Controtelai doppi": "numero",
+    "ML Controtelaio doppio": "decimale", "Costo Controtelaio doppio": "euro",
+    "N. Controtelaio termico TIP A": "intero", "Costo listino controtelaio termico TIP A": "euro",
+    "N. Controtelaio termico TIP B": "intero", "Costo listino controtelaio termico TIP B": "euro",
+})
+
+# Indice di ciascuna colonna (costruito una volta, ricerca O(1))
+INDICI = {col: i for i, col in enumerate(COLONNE)}
+
+# Indici delle colonne usate più spesso
+IDX_POS = INDICI["Pos."]
+IDX_SERRAMENTO = INDICI["Serramento"]
+
+# Formato di ciascuna colonna nell'ordine di COLONNE
+FORMATI_PER_INDICE = [FORMATI[col] for col in COLONNE]
+
+# Colonne numeriche (tutte quelle con un formato diverso da "testo")
+COLONNE_NUMERICHE = frozenset(col for col, formato in FORMATI.items() if formato != "testo")
+
+# Gruppi di colonne, nell'ordine di visualizzazione: prima e ultima colonna, tag delle righe e colori
+GRUPPI = {
+    "Righe inserite": {"prima": "Pos.", "ultima": "M.rib.", "tag": "righe_inserite",
+                       "bg_color": "#F5F5F5", "text_color": "#000000"},
+    "Calcoli": {"prima": "N.ANTE", "ultima": "Costo_serramento_scontato_posizione", "tag": "calcoli",
+                "bg_color": "#E0E0E0", "text_color": "#000000"},
+    "Distanziale/Imbotte": {"prima": "Distanziali/Imbotti", "ultima": "Ml totali Dist/imb", "tag": "distanziali",
+                            "bg_color": "#C8E6C9", "text_color": "#000000"},
+    "Controtelai": {"prima": "Costo al ml controtelaio singolo", "ultima": "Costo listino controtelaio termico TIP B",
+                    "tag": "controtelai", "bg_color": "#FFD580", "text_color": "#000000"},
+}
+for _gruppo in GRUPPI.values():
+    # Indici da 0, estremi inclusi
+    _gruppo["inizio"] = INDICI[_gruppo["prima"]]
+    _gruppo["fine"] = INDICI[_gruppo["ultima"]]
+del _gruppo
+
+
+def gruppo_di(colonna):
+    """Nome del gruppo a cui appartiene la colonna, oppure None."""
+    indice = INDICI[colonna]
+    return next((nome for nome, g in GRUPPI.items() if g["inizio"] <= indice <= g["fine"]), None)
+
+
+def numero_da_testo(valore):
+    """
+    Converte un valore in formato italiano ("€ 1.234,56", "1,25", "35 %") in float.
+    Restituisce None se il valore è vuoto o non numerico.
+    """
+    if valore is None or isinstance(valore, bool):
+        return None
+    if isinstance(valore, Number):
+        # Anche i numeri numpy; NaN è l'unico valore diverso da sé stesso
+        return None if valore != valore else float(valore)
+    testo = str(valore).replace("€", "").replace("%", "").strip()
+    if "," in testo:
+        testo = testo.replace(".", "").replace(",", ".")
+    try:
+        return float(testo)
+    except ValueError:
+        return None
+
+
+def formatta_euro(valore):
+    """Formatta un importo come "€ 1.234,56"."""
+    return f"€ {valore:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def formatta_valore(valore, formato):
+    """Restituisce la stringa da visualizzare per un valore tipizzato."""
+    if valore is None or (isinstance(valore, Number) and valore != valore):
+        return ""
+    if formato == "testo":
+        return str(valore)
+    numero = numero_da_testo(valore)
+    if numero is None:
+        return str(valore)
+    if formato == "intero":
+        return str(int(numero))
+    if formato == "numero":
+        return f"{numero:.2f}".rstrip("0").rstrip(".").replace(".", ",")
+    if formato == "decimale":
+        return f"{numero:.2f}".replace(".", ",")
+    if formato == "euro_o_vuoto" and not numero:
+        return ""
+    return formatta_euro(numero)
@@ -0,0 +1,202 @@
+"""
+Tabella virtuale su un ttk.Treeview.
+
+Le righe vivono in un archivio esterno (lista ordinata di id); nel Treeview vengono
+materializzate solo quelle che entrano nella finestra visibile, usando lo stesso id
+come iid. Scorrere, aprire un preventivo con migliaia di posizioni o selezionare una
+riga costa quindi in proporzione alle righe visibili, non al totale.
+"""
+import tkinter as tk
+from tkinter import ttk
+
+from prestazioni import misura
+
+# Altezza dell'intestazione del Treeview in pixel (stima usata per calcolare le righe visibili)
+ALTEZZA_INTESTAZIONE = 25
+
+
+class TabellaVirtuale:
+    """Gestisce l'ordine delle righe e la finestra di righe materializzate in un Treeview."""
+
+    def __init__(self, tree, scrollbar, valori_riga, tag_riga=None):
+        """
+        :param tree: ttk.Treeview in cui materializzare le righe visibili
+        :param scrollbar: scrollbar verticale da pilotare al posto di quella nativa del Treeview
+        :param valori_riga: funzione id -> lista dei valori formattati da mostrare
+        :param tag_riga: funzione opzionale id -> tupla di tag della riga
+        """
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.valori_riga = valori_riga
+        self.tag_riga = tag_riga
+        self.righe = []
+        self.inizio = 0
+        self.visibili = int(tree.cget("height")) or 10
+        self._prossimo_id = 0
+        self._selezione = set()
+        self._ridisegno_programmato = None
+
+        scrollbar.config(command=self.yview)
+        tree.configure(yscrollcommand="")
+        tree.bind("<Configure>", self._on_configure, add="+")
+        tree.bind("<MouseWheel>", self._on_rotella, add="+")
+        tree.bind("<Button-4>", lambda e: self._scorri(-3), add="+")
+        tree.bind("<Button-5>", lambda e: self._scorri(3), add="+")
+        tree.bind("<Up>", lambda e: self._on_freccia(-1), add="+")
+        tree.bind("<Down>", lambda e: self._on_freccia(1), add="+")
+        tree.bind("<Prior>", lambda e: self._scorri(-self.visibili), add="+")
+        tree.bind("<Next>", lambda e: self._scorri(self.visibili), add="+")
+
+    # --- Archivio delle righe ---
+
+    def __len__(self):
+        return len(self.righe)
+
+    def nuovo_id(self):
+        self._prossimo_id += 1
+        return f"R{self._prossimo_id}"
+
+    def indice(self, iid):
+        """Posizione della riga nell'ordine della tabella."""
+        return self.righe.index(iid)
+
+    def inserisci(self, indice="end"):
+        """Aggiunge una riga (in coda o alla posizione `indice`) e ne restituisce l'id."""
+        iid = self.nuovo_id()
+        if indice == "end":
+            self.righe.append(iid)
+        else:
+            self.righe.insert(indice, iid)
+        self.programma_ridisegno()
+        return iid
+
+    def elimina(self, *iids):
+        """Rimuove le righe indicate dall'archivio e dalla vista."""
+        da_eliminare = set(iids)
+        self.righe = [iid for iid in self.righe if iid not in da_eliminare]
+        self._selezione -= da_eliminare
+        presenti = [iid for iid in iids if self.tree.exists(iid)]
+        if presenti:
+            self.tree.delete(*presenti)
+        self.programma_ridisegno()
+
+    def svuota(self):
+        """Elimina tutte le righe."""
+        self.righe = []
+        self.inizio = 0
+        self._selezione.clear()
+        self.tree.delete(*self.tree.get_children())
+        self.programma_ridisegno()
+
+    # --- Vista ---
+
+    def aggiorna_riga(self, iid):
+        """Aggiorna valori e tag di una riga, solo se è materializzata."""
+        if self.tree.exists(iid):
+            self.tree.item(iid, values=self.valori_riga(iid))
+            if self.tag_riga is not None:
+                self.tree.item(iid, tags=self.tag_riga(iid))
+
+    def aggiorna_visibili(self):
+        """Aggiorna valori e tag di tutte le righe materializzate (dopo una modifica in blocco dei dati)."""
+        for iid in self.tree.get_children():
+            self.tree.item(iid, values=self.valori_riga(iid))
+            if self.tag_riga is not None:
+                self.tree.item(iid, tags=self.tag_riga(iid))
+
+    def finestra(self):
+        """Id delle righe che entrano nella finestra visibile."""
+        return self.righe[self.inizio:self.inizio + self.visibili]
+
+    def programma_ridisegno(self):
+        """Accorpa più modifiche consecutive in un solo ridisegno, eseguito quando Tk è inattivo."""
+        if self._ridisegno_programmato is None:
+            self._ridisegno_programmato = self.tree.after_idle(self.ridisegna)
+
+    @misura("tabella.ridisegno")
+    def ridisegna(self):
+        """Materializza nel Treeview solo le righe della finestra visibile."""
+        self._ridisegno_programmato = None
+        self._limita()
+        materializzate = self.tree.get_children()
+        self._selezione = (self._selezione - set(materializzate)) | set(self.tree.selection())
+        finestra = self.finestra()
+        if list(materializzate) != finestra:
+            if materializzate:
+                self.tree.delete(*materializzate)
+            for iid in finestra:
+                tags = self.tag_riga(iid) if self.tag_riga is not None else ()
+                self.tree.insert("", "end", iid=iid, values=self.valori_riga(iid), tags=tags)
+            selezionate = [iid for iid in finestra if iid in self._selezione]
+            if selezionate:
+                self.tree.selection_set(selezionate)
+        self.tree.yview_moveto(0)
+        self._aggiorna_scrollbar()
+
+    def mostra(self, iid):
+        """Scorre la tabella in modo che la riga indicata sia visibile."""
+        indice = self.indice(iid)
+        if indice < self.inizio:
+            self.inizio = indice
+        elif indice >= self.inizio + self.visibili:
+            self.inizio = indice - self.visibili + 1
+        self.ridisegna()
+
+    def yview(self, *args):
+        """Comando della scrollbar verticale ("moveto f" oppure "scroll n units|pages")."""
+        if not args:
+            return
+        if args[0] == "moveto":
+            self.inizio = int(float(args[1]) * len(self.righe))
+        elif args[0] == "scroll":
+            passo = self.visibili if str(args[2]).startswith("page") else 1
+            self.inizio += int(args[1]) * passo
+        self.ridisegna()
+
+    def _limita(self):
+        self.inizio = max(0, min(self.inizio, len(self.righe) - self.visibili))
+
+    def _aggiorna_scrollbar(self):
+        totale = len(self.righe)
+        if totale <= self.visibili:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.inizio / totale, (self.inizio + self.visibili) / totale)
+
+    def _scorri(self, righe):
+        self.inizio += righe
+        self.ridisegna()
+        return "break"
+
+    def _on_rotella(self, event):
+        return self._scorri(-3 if event.delta > 0 else 3)
+
+    def _on_freccia(self, verso):
+        """Con la selezione sul bordo della finestra, le frecce fanno scorrere la tabella."""
+        focus = self.tree.focus()
+        finestra = self.finestra()
+        if not focus or focus not in finestra:
+            return None
+        indice = self.inizio + finestra.index(focus) + verso
+        if not 0 <= indice < len(self.righe):
+            return "break"
+        bordo = finestra[0] if verso < 0 else finestra[-1]
+        if focus != bordo:
+            return None
+        iid = self.righe[indice]
+        self._selezione = {iid}
+        self.mostra(iid)
+        self.tree.selection_set(iid)
+        self.tree.focus(iid)
+        return "break"
+
+    def _on_configure(self, event):
+        stile = ttk.Style()
+        try:
+            altezza_riga = int(stile.lookup("Treeview", "rowheight") or 20)
+        except (ValueError, tk.TclError):
+            altezza_riga = 20
+        visibili = max(1, (event.height - ALTEZZA_INTESTAZIONE) // altezza_riga)
+        if visibili != self.visibili:
+            self.visibili = visibili
+            self.ridisegna()